@@ -0,0 +1,99 @@
+'''
+Synthetic news corpora of any size, built by recombining the
+sentences and headline words of the saved test stories.
+
+Usage: python -m benchmarks.corpus --size N [--seed S] > corpus.ndjson
+'''
+
+import os
+import re
+import json
+import pickle
+import random
+import argparse
+import datetime as dt
+from typing import Dict, List
+
+from news_api import constants
+
+
+NEWS_DATA = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+    'tests', 'data', 'news_data.pickle'
+)
+
+_SENTENCE_RE = re.compile(r'(?<=[.!?])\s+(?=[A-Z"])')
+
+_NAME_RE = re.compile(r'\b[A-Z][a-z]+(?:\s+[A-Z][a-z]+)*\b')
+
+
+def load_seed(path: str = NEWS_DATA) -> Dict:
+    '''
+    ARGS:
+        path: Pickled dict of headline -> story text
+
+    Get the stories the corpus is built from
+    '''
+    with open(path, 'rb') as fd:
+        return pickle.loads(fd.read())
+
+
+def generate(size: int, seed: int = 0, days: int = 30, seed_data: Dict = None) -> List:
+    '''
+    ARGS:
+        size: Number of stories
+        seed: Random seed, the same seed gives the same corpus
+        days: Number of days the stories are spread over, ending today
+        seed_data: Stories recombined, defaults to the test stories
+
+    RETURNS:
+        A list of story dicts with title, text and dated keys. Story
+        lengths follow the seed stories and no two titles are equal
+    '''
+    seed_data = seed_data or load_seed()
+    rng = random.Random(seed)
+
+    stories = [_SENTENCE_RE.split(text.strip()) for text in seed_data.values()]
+    sentences = [s for story in stories for s in story]
+    lengths = [len(story) for story in stories]
+    title_words = [t.split() for t in seed_data]
+    today = dt.date.today()
+    corpus = []
+
+    for i in range(size):
+        words = rng.choice(title_words)
+        title = ' '.join(rng.sample(words, len(words)))
+        text = ' '.join(rng.choice(sentences) for _ in range(rng.choice(lengths)))
+        dated = today - dt.timedelta(days=rng.randrange(days))
+        corpus.append({
+            'title': '{} ({})'.format(title, i),
+            'text': text,
+            'dated': dated.strftime(constants.DATE_FMT),
+        })
+
+    return corpus
+
+
+def names(text: str) -> List:
+    '''
+    ARGS:
+        text: Story text
+
+    Get runs of capitalized words in a text, a stand in for the
+    entities named in it when no ner model is available
+    '''
+    return _NAME_RE.findall(text)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--size', type=int, default=1000)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    for story in generate(args.size, args.seed):
+        print(json.dumps(story))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,73 @@
+'''
+Micro-benchmark of html extraction engines over saved html fixtures.
+
+Usage: python -m benchmarks.extract [--repeat N]
+'''
+
+import os
+import glob
+import timeit
+import argparse
+
+from news_api import extract
+
+
+FIXTURE_DIR = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+    'tests', 'data', 'html'
+)
+
+
+def load_fixtures(fixture_dir: str = FIXTURE_DIR) -> dict:
+    '''
+    ARGS:
+        fixture_dir: Directory containing saved html pages
+
+    Get the contents of each saved html page by file name
+    '''
+    fixtures = {}
+
+    for path in sorted(glob.glob(os.path.join(fixture_dir, '*.html'))):
+        with open(path, 'rb') as fd:
+            fixtures[os.path.basename(path)] = fd.read()
+
+    return fixtures
+
+
+def run(repeat: int = 20) -> dict:
+    '''
+    ARGS:
+        repeat: Number of times each page is extracted
+
+    RETURNS:
+        A dict of engine -> best seconds per page, averaged over pages
+    '''
+    fixtures = load_fixtures()
+    result = {}
+
+    for engine in extract.ENGINES:
+        times = []
+
+        for data in fixtures.values():
+            timer = timeit.Timer(lambda: extract.extract_paragraphs(data, 'utf-8', engine))
+            times.append(min(timer.repeat(repeat=repeat, number=1)))
+
+        result[engine] = sum(times) / len(times)
+
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    result = run(args.repeat)
+    baseline = result['html.parser']
+
+    for engine, seconds in sorted(result.items(), key=lambda r: r[1]):
+        print('{:<12} {:8.2f} ms  {:5.1f}x'.format(engine, seconds * 1000, baseline / seconds))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,317 @@
+'''
+Benchmarks of the hot paths of the api over a synthetic corpus.
+
+Usage: python -m benchmarks.suite [--size N] [--repeat R] [--only CASE ...]
+                                  [--output FILE] [--baseline FILE] [--threshold T]
+
+Results are written as json. With a baseline, results slower than
+the baseline by more than the threshold are reported as regressions
+and the exit status is 1
+'''
+
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import tempfile
+from collections import Counter, OrderedDict
+from typing import Callable, Dict, List
+
+import pandas as pd
+
+from news_api import create_app, db, geo, news
+from . import corpus, extract as extract_benchmark
+
+
+CASES = OrderedDict()
+
+
+def case(name: str) -> Callable:
+    '''
+    ARGS:
+        name: Case name
+
+    Registers a function taking a Context and returning a dict of
+    result name -> (seconds, number of items timed) as a case
+    '''
+    def register(func):
+        CASES[name] = func
+        return func
+
+    return register
+
+
+class Context:
+    '''
+    Corpus and settings shared by the cases of a run
+    '''
+
+    def __init__(self, size: int, repeat: int, seed: int = 0, geodata: str = None):
+        self.size = size
+        self.repeat = repeat
+        self.corpus = corpus.generate(size, seed)
+        self.geodata = geodata
+        self._app = None
+
+    def best(self, func: Callable, setup: Callable = None) -> float:
+        '''
+        ARGS:
+            func: Code to be timed
+            setup: Called before each run, not timed
+
+        Get the best time of repeated runs of func in seconds
+        '''
+        times = []
+
+        for _ in range(self.repeat):
+            if setup is not None:
+                setup()
+
+            start = time.perf_counter()
+            func()
+            times.append(time.perf_counter() - start)
+
+        return min(times)
+
+    def gazetteer(self) -> geo.Gazetteer:
+        '''
+        Get the gazetteer of the geodata file, or one made up of the
+        names used most in the corpus if no file is given
+        '''
+        if self.geodata:
+            return geo.Gazetteer.from_csv(self.geodata)
+
+        counts = Counter(n for s in self.corpus for n in corpus.names(s['text']))
+        countries = [n for n, _ in counts.most_common(200)]
+        return geo.Gazetteer.from_frame(pd.DataFrame({
+            'countries': countries,
+            'nationalities': [c + 'ian' for c in countries],
+        }))
+
+    def app(self):
+        '''
+        Get an app whose database holds the corpus
+        '''
+        if self._app is None:
+            _, path = tempfile.mkstemp(suffix='.db')
+            self._app = create_app(test_config={
+                'TESTING': True,
+                'DATABASE': path,
+                'METRICS_DIR': None  # Metrics are not written into the instance folder
+            })
+
+            with self._app.app_context():
+                db.init_db()
+                db.save('news', db.get_db(), self.rows())
+                db.get_db().commit()
+
+        return self._app
+
+    def rows(self) -> List:
+        return [{**s, 'digest': news.story_digest(s)} for s in self.corpus]
+
+    def close(self):
+        if self._app is not None:
+            db.get_manager(self._app).close_all()
+            os.unlink(self._app.config['DATABASE'])
+
+
+@case('extract')
+def bench_extract(ctx: Context) -> Dict:
+    pages = extract_benchmark.load_fixtures()
+    return {
+        'extract.{}'.format(engine): (seconds * len(pages), len(pages))
+        for engine, seconds in extract_benchmark.run(ctx.repeat).items()
+    }
+
+
+@case('gazetteer')
+def bench_gazetteer(ctx: Context) -> Dict:
+    gazetteer = ctx.gazetteer()
+    names = [corpus.names(s['text']) for s in ctx.corpus]
+    seconds = ctx.best(lambda: [gazetteer.locate(n) for n in names])
+    return {'gazetteer.locate': (seconds, len(names))}
+
+
+@case('ner')
+def bench_ner(ctx: Context) -> Dict:
+    gazetteer = ctx.gazetteer()
+    texts = [s['text'] for s in ctx.corpus[:200]]
+    news.get_locations_mentioned_batch(texts[:1], gazetteer)  # Loads the pipeline
+    seconds = ctx.best(lambda: news.get_locations_mentioned_batch(texts, gazetteer))
+    return {'ner.batch': (seconds, len(texts))}
+
+
+@case('lsa')
+def bench_lsa(ctx: Context) -> Dict:
+    from news_api import nlp
+
+    texts = [s['text'] for s in ctx.corpus]
+    titles = [s['title'] for s in ctx.corpus[:100]]
+    build = ctx.best(lambda: nlp.LSA(texts, svd_rank=100).fit())
+    model = nlp.LSA(texts, svd_rank=100).fit()
+    query = ctx.best(lambda: model.get_similarity(titles))
+    return {'lsa.build': (build, len(texts)), 'lsa.query': (query, len(titles))}
+
+
+@case('db')
+def bench_db(ctx: Context) -> Dict:
+    app = ctx.app()
+    rows = ctx.rows()
+    dates = sorted({s['dated'] for s in ctx.corpus})
+
+    with app.app_context():
+        conn = db.get_db()
+
+        def reset():
+            conn.execute('DELETE FROM news')
+            conn.commit()
+
+        def save():
+            db.save('news', conn, rows)
+            conn.commit()
+
+        insert = ctx.best(save, setup=reset)
+        read_all = ctx.best(lambda: db.read_all('news', conn))
+        read_range = ctx.best(lambda: [db.read_range('news', conn, 'dated', d) for d in dates])
+
+    return {
+        'db.save': (insert, len(rows)),
+        'db.read_all': (read_all, len(rows)),
+        'db.read_range': (read_range, len(dates)),
+    }
+
+
+@case('api')
+def bench_api(ctx: Context) -> Dict:
+    client = ctx.app().test_client()
+    today = max(s['dated'] for s in ctx.corpus)
+    requests = 20
+
+    def get(url, **kwargs):
+        def run():
+            for _ in range(requests):
+                assert client.get(url, **kwargs).status_code == 200
+
+        return ctx.best(run)
+
+    return {
+        'api.latest': (get('/latest'), requests),
+        'api.news': (get('/news', query_string={'from': today, 'limit': 100}), requests),
+        'api.search': (get('/search', query_string={'q': 'said'}), requests),
+    }
+
+
+def run(size: int = 1000, repeat: int = 3, only: List = None, seed: int = 0, geodata: str = None) -> Dict:
+    '''
+    ARGS:
+        size: Number of stories in the corpus
+        repeat: Number of runs of each case, the best is kept
+        only: Names of the cases run, defaults to all
+        seed: Corpus random seed
+        geodata: Geodata csv file, defaults to names in the corpus
+
+    RETURNS:
+        A dict with the run's settings under meta and a dict of
+        result name -> seconds, items and milliseconds per item
+        under results. Cases that cannot run, such as ner without
+        a spacy model, are recorded as skipped with the reason
+    '''
+    ctx = Context(size, repeat, seed, geodata)
+    results = OrderedDict()
+
+    try:
+        for name, func in CASES.items():
+            if only and name not in only:
+                continue
+
+            try:
+                timings = func(ctx)
+            except Exception as err:
+                results[name] = {'skipped': '{}: {}'.format(type(err).__name__, err)}
+                continue
+
+            for result, (seconds, items) in timings.items():
+                results[result] = {
+                    'seconds': seconds,
+                    'items': items,
+                    'ms_per_item': seconds * 1000 / items if items else None,
+                }
+    finally:
+        ctx.close()
+
+    meta = {
+        'size': size,
+        'repeat': repeat,
+        'seed': seed,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+    }
+    return {'meta': meta, 'results': results}
+
+
+def compare(current: Dict, baseline: Dict, threshold: float = 0.2) -> List:
+    '''
+    ARGS:
+        current: Results of run
+        baseline: Results of an earlier run
+        threshold: Allowed slow down, 0.2 allows results 20% slower
+
+    RETURNS:
+        A list of (name, baseline ms per item, current ms per item)
+        of results slower than the baseline by more than threshold
+    '''
+    regressions = []
+
+    for name, result in current['results'].items():
+        before = baseline['results'].get(name, {}).get('ms_per_item')
+        after = result.get('ms_per_item')
+
+        if before and after and after > before * (1 + threshold):
+            regressions.append((name, before, after))
+
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--size', type=int, default=1000)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--only', nargs='*', choices=list(CASES))
+    parser.add_argument('--geodata')
+    parser.add_argument('--output', help='File the json results are written to, stdout if not given')
+    parser.add_argument('--baseline', help='json results of an earlier run')
+    parser.add_argument('--threshold', type=float, default=0.2)
+    args = parser.parse_args()
+
+    result = run(args.size, args.repeat, args.only, args.seed, args.geodata)
+
+    for name, r in result['results'].items():
+        if 'skipped' in r:
+            print('{:<16} skipped ({})'.format(name, r['skipped']), file=sys.stderr)
+        else:
+            print('{:<16} {:10.3f} ms/item'.format(name, r['ms_per_item']), file=sys.stderr)
+
+    if args.output:
+        with open(args.output, 'w') as fd:
+            json.dump(result, fd, indent=2)
+    else:
+        print(json.dumps(result, indent=2))
+
+    if args.baseline:
+        with open(args.baseline) as fd:
+            regressions = compare(result, json.load(fd), args.threshold)
+
+        for name, before, after in regressions:
+            print('REGRESSION {:<16} {:.3f} -> {:.3f} ms/item'.format(name, before, after), file=sys.stderr)
+
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
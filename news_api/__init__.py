@@ -1,6 +1,7 @@
 __version__ = '0.1.0'
 
 import os
+import time
 from typing import Dict, Optional
 
 from flask import Flask
@@ -8,7 +9,7 @@ from redis import Redis
 from celery import Celery
 from flask_restful import Api
 
-from . import resources
+from . import metrics, profiling, resources
 
 
 def create_app(
@@ -43,10 +44,17 @@ def create_app(
     api = Api(app)
     api.add_resource(resources.DailyNews, '/latest')
     api.add_resource(resources.News, '/news')
+    api.add_resource(resources.RelatedNews, '/news/<int:news_id>/related')
+    api.add_resource(resources.Search, '/search')
+    api.add_resource(resources.Metrics, '/metrics')
 
     # Adds application setup
-    from . import db
+    from . import cache, db, metrics, news, profiling
+    cache.init_app(app)
     db.init_app(app)
+    metrics.init_app(app)
+    news.init_app(app)
+    profiling.init_app(app)
 
     return app
 
@@ -69,14 +77,28 @@ def create_celery(app: Flask, celery_name: str = __name__):
         '''
         Inherits tasks and creates a cache.
         Also, wraps application context around call to task
+        and profiles it when wanted, or when sent with a
+        profile header
         '''
 
         def __init__(self):
             self._cache = Redis.from_url(app.config['CELERY_BACKEND'])
 
         def __call__(self, *args, **kwargs):
-            with app.app_context():
-                return super().__call__(*args, **kwargs)
+            status = 'failure'
+            start = time.perf_counter()
+
+            try:
+                forced = bool(getattr(self.request, 'profile', False))
+
+                with app.app_context(), profiling.get_profiler(app).profile('task', self.name, forced):
+                    result = super().__call__(*args, **kwargs)
+
+                status = 'success'
+                return result
+            finally:
+                metrics.TASK_SECONDS.observe(time.perf_counter() - start, task=self.name, status=status)
+                metrics.REGISTRY.flush()
 
     instance.Task = ContextTask
     return instance
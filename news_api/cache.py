@@ -0,0 +1,143 @@
+'''
+Response cache. Uses redis when CACHE_URL is configured,
+an in-process LRU cache otherwise
+'''
+
+import time
+import logging
+import threading
+from collections import OrderedDict
+from typing import Optional
+
+from flask import current_app, Flask
+from redis import Redis, RedisError
+
+
+LOGGER = logging.getLogger(__name__)
+
+_PREFIX = 'news-api:'
+
+
+class LocalCache:
+    '''
+    In-process least recently used cache with expiry,
+    a stand in for redis in tests and single process deployments
+    '''
+
+    def __init__(self, size: int = 128):
+        self._size = size
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[bytes]:
+        with self._lock:
+            item = self._data.get(key)
+
+            if item is None:
+                return None
+
+            value, expires = item
+
+            if expires is not None and expires < time.monotonic():
+                del self._data[key]
+                return None
+
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key: str, value: bytes, ttl: Optional[int] = None):
+        expires = time.monotonic() + ttl if ttl else None
+
+        with self._lock:
+            self._data[key] = (value, expires)
+            self._data.move_to_end(key)
+
+            while len(self._data) > self._size:
+                self._data.popitem(last=False)
+
+    def incr(self, key: str) -> int:
+        with self._lock:
+            value, expires = self._data.get(key, (0, None))
+            self._data[key] = (int(value) + 1, expires)
+            return int(value) + 1
+
+
+class RedisCache:
+    '''
+    Cache stored in redis, shared by all processes. Redis errors are
+    logged and treated as cache misses
+    '''
+
+    def __init__(self, client: Redis):
+        self._client = client
+
+    def get(self, key: str) -> Optional[bytes]:
+        try:
+            return self._client.get(key)
+        except RedisError as err:
+            LOGGER.warning('Cache read failed: %s', err)
+            return None
+
+    def set(self, key: str, value: bytes, ttl: Optional[int] = None):
+        try:
+            self._client.set(key, value, ex=ttl)
+        except RedisError as err:
+            LOGGER.warning('Cache write failed: %s', err)
+
+    def incr(self, key: str) -> int:
+        try:
+            return self._client.incr(key)
+        except RedisError as err:
+            LOGGER.warning('Cache invalidation failed: %s', err)
+            return 0
+
+
+def init_app(app: Flask):
+    if app.config.get('CACHE_URL'):
+        app.extensions['response_cache'] = RedisCache(Redis.from_url(app.config['CACHE_URL']))
+    else:
+        app.extensions['response_cache'] = LocalCache(app.config.get('CACHE_SIZE', 128))
+
+
+def get_cache():
+    '''
+    Get the response cache of the current app
+    '''
+    return current_app.extensions['response_cache']
+
+
+def generation() -> int:
+    '''
+    Get the current cache generation. Cached responses from
+    older generations are no longer used
+    '''
+    value = get_cache().get(_PREFIX + 'generation')
+    return int(value) if value is not None else 0
+
+
+def invalidate():
+    '''
+    Starts a new cache generation, called when stored news changes
+    '''
+    get_cache().incr(_PREFIX + 'generation')
+
+
+def get(key: str) -> Optional[bytes]:
+    '''
+    ARGS:
+        key: Cache key
+
+    Get a cached value, None if not cached
+    '''
+    return get_cache().get(_PREFIX + key)
+
+
+def store(key: str, value: bytes):
+    '''
+    ARGS:
+        key: Cache key
+        value: Value to be cached
+
+    Caches a value for CACHE_TTL seconds
+    '''
+    get_cache().set(_PREFIX + key, value, current_app.config.get('CACHE_TTL', 86400))
@@ -4,16 +4,173 @@ Application level constants
 
 SCHEMA = \
     '''
+    DROP TABLE IF EXISTS news_fts;
+    DROP TABLE IF EXISTS news_minhash_bands;
+    DROP TABLE IF EXISTS news_minhash;
+    DROP TABLE IF EXISTS news_locations;
     DROP TABLE IF EXISTS news;
+    DROP TABLE IF EXISTS feeds;
+    DROP TABLE IF EXISTS fetched_links;
 
     CREATE TABLE news
     (
      id INTEGER PRIMARY KEY AUTOINCREMENT,
      title TEXT NOT NULL,
      text TEXT NOT NULL,
-     dated TEXT NOT NULL
+     dated TEXT NOT NULL,
+     located INTEGER NOT NULL DEFAULT 0,
+     digest TEXT
     );
+
+    CREATE INDEX news_dated_idx ON news (dated, id);
+
+    CREATE UNIQUE INDEX news_digest_idx ON news (digest);
+
+    CREATE TABLE news_locations
+    (
+     news_id INTEGER NOT NULL REFERENCES news (id) ON DELETE CASCADE,
+     location TEXT NOT NULL,
+     PRIMARY KEY (news_id, location)
+    );
+
+    CREATE TABLE feeds
+    (
+     url TEXT PRIMARY KEY,
+     etag TEXT,
+     modified TEXT,
+     checked TEXT NOT NULL
+    );
+
+    CREATE TABLE fetched_links
+    (
+     url TEXT PRIMARY KEY,
+     content_hash TEXT NOT NULL,
+     fetched TEXT NOT NULL
+    );
+
+    CREATE INDEX fetched_links_hash_idx ON fetched_links (content_hash);
+
+    CREATE VIRTUAL TABLE news_fts USING fts5
+    (
+     title,
+     text,
+     content='news',
+     content_rowid='id',
+     tokenize='porter unicode61'
+    );
+
+    CREATE TRIGGER news_fts_insert AFTER INSERT ON news BEGIN
+     INSERT INTO news_fts (rowid, title, text) VALUES (new.id, new.title, new.text);
+    END;
+
+    CREATE TRIGGER news_fts_delete AFTER DELETE ON news BEGIN
+     INSERT INTO news_fts (news_fts, rowid, title, text) VALUES ('delete', old.id, old.title, old.text);
+    END;
+
+    CREATE TRIGGER news_fts_update AFTER UPDATE OF title, text ON news BEGIN
+     INSERT INTO news_fts (news_fts, rowid, title, text) VALUES ('delete', old.id, old.title, old.text);
+     INSERT INTO news_fts (rowid, title, text) VALUES (new.id, new.title, new.text);
+    END;
+
+    CREATE TABLE news_minhash
+    (
+     news_id INTEGER PRIMARY KEY REFERENCES news (id) ON DELETE CASCADE,
+     signature BLOB NOT NULL
+    );
+
+    CREATE TABLE news_minhash_bands
+    (
+     band INTEGER NOT NULL,
+     value INTEGER NOT NULL,
+     news_id INTEGER NOT NULL REFERENCES news (id) ON DELETE CASCADE,
+     PRIMARY KEY (band, value, news_id)
+    ) WITHOUT ROWID;
+
+    CREATE INDEX news_minhash_bands_news_idx ON news_minhash_bands (news_id);
+    '''
+
+# Upgrades applied in order to databases created with an older SCHEMA.
+# The number of applied migrations is tracked in PRAGMA user_version
+MIGRATIONS = [
     '''
+    ALTER TABLE news ADD COLUMN located INTEGER NOT NULL DEFAULT 0;
+
+    CREATE TABLE IF NOT EXISTS news_locations
+    (
+     news_id INTEGER NOT NULL REFERENCES news (id) ON DELETE CASCADE,
+     location TEXT NOT NULL,
+     PRIMARY KEY (news_id, location)
+    );
+    ''',
+    '''
+    CREATE INDEX IF NOT EXISTS news_dated_idx ON news (dated, id);
+    ''',
+    '''
+    ALTER TABLE news ADD COLUMN digest TEXT;
+
+    CREATE UNIQUE INDEX IF NOT EXISTS news_digest_idx ON news (digest);
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS feeds
+    (
+     url TEXT PRIMARY KEY,
+     etag TEXT,
+     modified TEXT,
+     checked TEXT NOT NULL
+    );
+
+    CREATE TABLE IF NOT EXISTS fetched_links
+    (
+     url TEXT PRIMARY KEY,
+     content_hash TEXT NOT NULL,
+     fetched TEXT NOT NULL
+    );
+
+    CREATE INDEX IF NOT EXISTS fetched_links_hash_idx ON fetched_links (content_hash);
+    ''',
+    '''
+    CREATE VIRTUAL TABLE IF NOT EXISTS news_fts USING fts5
+    (
+     title,
+     text,
+     content='news',
+     content_rowid='id',
+     tokenize='porter unicode61'
+    );
+
+    CREATE TRIGGER IF NOT EXISTS news_fts_insert AFTER INSERT ON news BEGIN
+     INSERT INTO news_fts (rowid, title, text) VALUES (new.id, new.title, new.text);
+    END;
+
+    CREATE TRIGGER IF NOT EXISTS news_fts_delete AFTER DELETE ON news BEGIN
+     INSERT INTO news_fts (news_fts, rowid, title, text) VALUES ('delete', old.id, old.title, old.text);
+    END;
+
+    CREATE TRIGGER IF NOT EXISTS news_fts_update AFTER UPDATE OF title, text ON news BEGIN
+     INSERT INTO news_fts (news_fts, rowid, title, text) VALUES ('delete', old.id, old.title, old.text);
+     INSERT INTO news_fts (rowid, title, text) VALUES (new.id, new.title, new.text);
+    END;
+
+    INSERT INTO news_fts (news_fts) VALUES ('rebuild');
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS news_minhash
+    (
+     news_id INTEGER PRIMARY KEY REFERENCES news (id) ON DELETE CASCADE,
+     signature BLOB NOT NULL
+    );
+
+    CREATE TABLE IF NOT EXISTS news_minhash_bands
+    (
+     band INTEGER NOT NULL,
+     value INTEGER NOT NULL,
+     news_id INTEGER NOT NULL REFERENCES news (id) ON DELETE CASCADE,
+     PRIMARY KEY (band, value, news_id)
+    ) WITHOUT ROWID;
+
+    CREATE INDEX IF NOT EXISTS news_minhash_bands_news_idx ON news_minhash_bands (news_id);
+    ''',
+]
 
 FEED_URLS = {
     'reuters': 'http://feeds.reuters.com/reuters/AFRICAWorldNews'
@@ -2,19 +2,190 @@
 Database operations. The Api uses file based db (sqlite)
 '''
 
+import os
+import time
 import sqlite3
-from typing import Dict, List
+import functools
+import threading
+from urllib.request import pathname2url
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple
+from collections import defaultdict
 
 import click
 from flask import current_app, g, Flask
 from flask.cli import with_appcontext
 
-from . import constants, exceptions
+from . import constants, exceptions, metrics
+
+
+_MAX_PARAMS = 999  # Default SQLITE_MAX_VARIABLE_NUMBER of older sqlite builds
+
+_CHUNK_SIZE = 500
+
+_CONFLICT_CLAUSES = {
+    'IGNORE': 'OR IGNORE',
+    'REPLACE': 'OR REPLACE',
+    'ABORT': '',
+}
+
+# Applied to every connection, DB_PRAGMAS in the app config overrides these
+DEFAULT_PRAGMAS = {
+    'journal_mode': 'WAL',  # Readers do not block on writers
+    'synchronous': 'NORMAL',
+    'cache_size': -16000,  # KiB
+    'mmap_size': 268435456,
+    'temp_store': 'MEMORY',
+    'foreign_keys': 'ON',
+}
+
+
+class ConnectionManager:
+    '''
+    Opens tuned sqlite connections and keeps up to pool_size idle
+    writable and read only connections, checked out by acquire and
+    returned by release, so connections are reused across app contexts
+    and threads without growing with the number of threads
+    '''
+
+    def __init__(
+            self,
+            database: str,
+            pragmas: Optional[Dict] = None,
+            timeout: float = 30.0,
+            pool: bool = True,
+            pool_size: int = 8
+    ):
+        self._database = database
+        self._pragmas = {**DEFAULT_PRAGMAS, **(pragmas or {})}
+        self._timeout = timeout
+        self._pool = pool
+        self._pool_size = pool_size
+        self._lock = threading.Lock()
+        self._reset()
+
+    @property
+    def open_connections(self) -> int:
+        '''
+        Number of connections opened by the pool and not yet closed
+        '''
+        with self._lock:
+            return len(self._connections)
+
+    def acquire(self, readonly: bool = False) -> sqlite3.Connection:
+        '''
+        ARGS:
+            readonly: Get a connection that can not write
+
+        Get a connection for the caller's sole use until released
+        '''
+        if self._pid != os.getpid():  # Connections can not be shared with a forked child
+            self._reset()
+
+        if not self._pool:
+            return self.connect(readonly)
+
+        with self._lock:
+            idle = self._idle[readonly]
+
+            if idle:
+                return idle.pop()
+
+        conn = self.connect(readonly)
+
+        with self._lock:
+            self._connections[conn] = readonly
+
+        return conn
+
+    def release(self, conn: sqlite3.Connection):
+        '''
+        ARGS:
+            conn: A connection returned by acquire
+
+        Returns a connection to the pool, discarding uncommitted
+        changes. Connections beyond pool_size idle ones are closed
+        '''
+        if not self._pool:
+            conn.close()
+            return
+
+        with self._lock:
+            readonly = self._connections.get(conn)
+
+        if readonly is None:  # Opened before a fork or close_all
+            conn.close()
+            return
+
+        if conn.in_transaction:
+            conn.rollback()
+
+        with self._lock:
+            idle = self._idle[readonly]
+
+            if len(idle) < self._pool_size:
+                idle.append(conn)
+                return
+
+            del self._connections[conn]
+
+        conn.close()
+
+    def connect(self, readonly: bool = False) -> sqlite3.Connection:
+        '''
+        ARGS:
+            readonly: Open the database in read only mode
+
+        Opens a new connection with the configured pragmas
+        '''
+        try:
+            if readonly:
+                conn = sqlite3.connect(
+                    'file:{}?mode=ro'.format(pathname2url(self._database)),
+                    timeout=self._timeout,
+                    detect_types=sqlite3.PARSE_DECLTYPES,
+                    check_same_thread=False,  # Pooled connections move between threads
+                    uri=True
+                )
+            else:
+                conn = sqlite3.connect(
+                    self._database,
+                    timeout=self._timeout,
+                    detect_types=sqlite3.PARSE_DECLTYPES,
+                    check_same_thread=False
+                )
+
+            conn.row_factory = sqlite3.Row
+
+            for name, value in self._pragmas.items():
+                if readonly and name == 'journal_mode':  # Set by writers, persisted in the file
+                    continue
+
+                conn.execute('PRAGMA {} = {}'.format(name, value)).fetchall()
+        except sqlite3.Error as err:
+            raise exceptions.DBError(err)
+
+        return conn
+
+    def close_all(self):
+        '''
+        Closes every pooled connection
+        '''
+        with self._lock:
+            for conn in self._connections:
+                conn.close()
+
+            self._reset()
+
+    def _reset(self):
+        self._pid = os.getpid()
+        self._connections = {}  # Open connection -> whether it is read only
+        self._idle = {False: [], True: []}
 
 
 def init_app(app: Flask):
     app.teardown_appcontext(close_db)
     app.cli.add_command(init_db_command)
+    app.cli.add_command(migrate_db_command)
 
 
 def init_db():
@@ -23,6 +194,28 @@ def init_db():
     '''
     db = get_db()
     db.executescript(constants.SCHEMA)
+    db.execute('PRAGMA user_version = {}'.format(len(constants.MIGRATIONS)))
+
+
+def migrate_db() -> int:
+    '''
+    RETURNS:
+        Number of migrations applied
+
+    Brings a database created with an older schema up to date
+    '''
+    db = get_db()
+    version = db.execute('PRAGMA user_version').fetchone()[0]
+    pending = constants.MIGRATIONS[version:]
+
+    try:
+        for i, script in enumerate(pending, start=version + 1):
+            db.executescript(script)
+            db.execute('PRAGMA user_version = {}'.format(i))
+    except sqlite3.Error as err:
+        raise exceptions.DBError(err)
+
+    return len(pending)
 
 
 @click.command('init-db')
@@ -35,34 +228,85 @@ def init_db_command():
     click.echo('Database initialized')
 
 
-def get_db() -> sqlite3.Connection:
+@click.command('migrate-db')
+@with_appcontext
+def migrate_db_command():
+    '''
+    Applies pending schema migrations
+    '''
+    count = migrate_db()
+    click.echo('Applied {} migration(s)'.format(count))
+
+
+def get_manager(app: Optional[Flask] = None) -> ConnectionManager:
+    '''
+    ARGS:
+        app: Flask application, defaults to the current app
+
+    Get the connection manager of an application,
+    created on first use
+    '''
+    app = app or current_app
+    manager = app.extensions.get('sqlite')
+
+    if manager is None:
+        manager = app.extensions.setdefault('sqlite', ConnectionManager(
+            app.config['DATABASE'],
+            pragmas=app.config.get('DB_PRAGMAS'),
+            timeout=app.config.get('DB_TIMEOUT', 30.0),
+            pool=app.config.get('DB_POOL', True),
+            pool_size=app.config.get('DB_POOL_SIZE', 8)
+        ))
+
+    return manager
+
+
+def get_db(readonly: bool = False) -> sqlite3.Connection:
     '''
+    ARGS:
+        readonly: Get a read only connection, if enabled with DB_READONLY
+
     connect to database if not in app global context otherwise,
     retreive from g
     '''
-    if 'db' not in g:
-        conn = sqlite3.connect(
-            current_app.config['DATABASE'],
-            detect_types=sqlite3.PARSE_DECLTYPES
-        )
+    readonly = readonly and current_app.config.get('DB_READONLY', True)
+    key = 'db_readonly' if readonly else 'db'
 
-        conn.row_factory = sqlite3.Row
-        g.db = conn
+    if key not in g:
+        setattr(g, key, get_manager().acquire(readonly))
 
-    return g.db
+    return getattr(g, key)
 
 
 def close_db(e=None):
     '''
-    Close database connection and remove from application context
-    if present
+    Return database connections to the pool and remove from
+    application context if present
     '''
-    db = g.pop('db', None)
+    for key in ('db', 'db_readonly'):
+        db = g.pop(key, None)
+
+        if db is not None:
+            get_manager().release(db)
+
+
+def _timed(func):
+    # Observes the duration of a table operation by name and table
+    @functools.wraps(func)
+    def timed(table_name, *args, **kwargs):
+        start = time.perf_counter()
 
-    if db is not None:
-        db.close()
+        try:
+            return func(table_name, *args, **kwargs)
+        finally:
+            metrics.DB_QUERY_SECONDS.observe(
+                time.perf_counter() - start, operation=func.__name__, table=table_name
+            )
+
+    return timed
 
 
+@_timed
 def read_all(table_name: str, conn: sqlite3.Connection) -> Dict:
     '''
     ARGS:
@@ -78,38 +322,393 @@ def read_all(table_name: str, conn: sqlite3.Connection) -> Dict:
         raise exceptions.DBError(err)
 
 
-def save(table_name: str, conn: sqlite3.Connection, data: List[Dict]):
+@_timed
+def read_max(table_name: str, conn: sqlite3.Connection, column: str = 'id'):
+    '''
+    ARGS:
+        table_name: Name of the table to be read
+        conn: connection instance
+        column: Column to be read
+
+    Get the largest value of a column, None if the table is empty
+    '''
+    try:
+        return conn.execute('SELECT MAX({}) FROM {}'.format(column, table_name)).fetchone()[0]
+    except sqlite3.Error as err:
+        raise exceptions.DBError(err)
+
+
+@_timed
+def read_range(
+        table_name: str,
+        conn: sqlite3.Connection,
+        column: str,
+        start,
+        end=None,
+        columns: Optional[Iterable] = None,
+        after_id: Optional[int] = None,
+        limit: Optional[int] = None
+) -> List[Dict]:
+    '''
+    ARGS:
+        table_name: Name of the table to be read
+        conn: connection instance
+        column: Column to filter on, ideally indexed
+        start: Smallest value of column to be matched
+        end: Largest value of column to be matched, defaults to start
+        columns: Columns to be read, defaults to all
+        after_id: Only read rows with a larger id, for paginating
+        limit: Maximum number of rows returned
+
+    RETURNS:
+        A list of rows ordered by id
+
+    Read rows of a table where column lies between start and end
+    '''
+    if end is None or end == start:
+        conditions, params = ['{} = ?'.format(column)], [start]
+    else:
+        conditions, params = ['{0} >= ? AND {0} <= ?'.format(column)], [start, end]
+
+    return _select(table_name, conn, conditions, params, [column], columns, after_id, limit)
+
+
+@_timed
+def read_after(
+        table_name: str,
+        conn: sqlite3.Connection,
+        after_id: Optional[int] = None,
+        columns: Optional[Iterable] = None,
+        limit: Optional[int] = None
+) -> List[Dict]:
+    '''
+    ARGS:
+        table_name: Name of the table to be read
+        conn: connection instance
+        after_id: Only read rows with a larger id
+        columns: Columns to be read, defaults to all
+        limit: Maximum number of rows returned
+
+    RETURNS:
+        A list of rows ordered by id
+
+    Read rows of a table in id order, for paginating over a whole table
+    '''
+    return _select(table_name, conn, [], [], [], columns, after_id, limit)
+
+
+def _select(
+        table_name: str,
+        conn: sqlite3.Connection,
+        conditions: List,
+        params: List,
+        filtered: List,
+        columns: Optional[Iterable],
+        after_id: Optional[int],
+        limit: Optional[int]
+) -> List[Dict]:
+    table_columns = get_columns(table_name, conn)
+    columns = list(columns) if columns is not None else table_columns
+    unknown = set(columns + filtered) - set(table_columns)
+
+    if unknown:
+        raise exceptions.DBError('Unknown columns: {}'.format(', '.join(sorted(unknown))))
+
+    conditions, params = list(conditions), list(params)
+
+    if after_id is not None:
+        conditions.append('id > ?')
+        params.append(after_id)
+
+    query = 'SELECT {columns} FROM {table_name}'.format(
+        columns=','.join(columns),
+        table_name=table_name
+    )
+
+    if conditions:
+        query += ' WHERE ' + ' AND '.join(conditions)
+
+    query += ' ORDER BY id'
+
+    if limit is not None:
+        query += ' LIMIT ?'
+        params.append(limit)
+
+    try:
+        data = conn.execute(query, params).fetchall()
+        return [dict(r) for r in data]
+    except sqlite3.Error as err:
+        raise exceptions.DBError(err)
+
+
+@_timed
+def read_match(
+        table_name: str,
+        conn: sqlite3.Connection,
+        fts_table: str,
+        query: str,
+        columns: Optional[Iterable] = None,
+        snippet_column: int = -1,
+        limit: Optional[int] = None,
+        offset: int = 0
+) -> List[Dict]:
+    '''
+    ARGS:
+        table_name: Name of the table to be read
+        conn: connection instance
+        fts_table: Full text index of the table, keyed by its id
+        query: FTS5 query
+        columns: Columns of the table to be read, defaults to all
+        snippet_column: Index column the snippet is taken from,
+                        -1 takes it from the best matching column
+        limit: Maximum number of rows returned
+        offset: Number of best matching rows skipped
+
+    RETURNS:
+        Matching rows, best match first, each with its bm25 score
+        as score, larger being better, and a snippet of the match
+
+    Read rows of a table matching a full text query
+    '''
+    columns = list(columns) if columns is not None else get_columns(table_name, conn)
+    query_sql = (
+        'SELECT {columns}, -bm25({fts}) AS score,'
+        ' snippet({fts}, ?, \'<b>\', \'</b>\', \'...\', 16) AS snippet'
+        ' FROM {fts} JOIN {table_name} ON {table_name}.id = {fts}.rowid'
+        ' WHERE {fts} MATCH ? ORDER BY bm25({fts}) LIMIT ? OFFSET ?'
+    ).format(
+        columns=','.join('{}.{}'.format(table_name, c) for c in columns),
+        fts=fts_table,
+        table_name=table_name
+    )
+
+    try:
+        data = conn.execute(query_sql, (snippet_column, query, -1 if limit is None else limit, offset)).fetchall()
+        return [dict(r) for r in data]
+    except sqlite3.Error as err:
+        raise exceptions.DBError(err)
+
+
+def get_columns(table_name: str, conn: sqlite3.Connection) -> List:
+    '''
+    ARGS:
+        table_name: Name of the table
+        conn: connection instance
+
+    Get the column names of a table
+    '''
+    try:
+        info = conn.execute('PRAGMA table_info({})'.format(table_name)).fetchall()
+    except sqlite3.Error as err:
+        raise exceptions.DBError(err)
+
+    if not info:
+        raise exceptions.DBError('No such table: {}'.format(table_name))
+
+    return [r['name'] for r in info]
+
+
+@_timed
+def read_where_in(
+        table_name: str,
+        conn: sqlite3.Connection,
+        column: str,
+        values: Iterable,
+        columns: Optional[Iterable] = None,
+        limit: Optional[int] = None
+) -> List[Dict]:
+    '''
+    ARGS:
+        table_name: Name of the table to be read
+        conn: connection instance
+        column: Column to filter on
+        values: Values of column to be matched
+        columns: Columns to be read, defaults to all
+        limit: Maximum number of rows returned
+
+    Read rows of a table where column matches any of the values
+    '''
+    values = list(values)
+    columns = ','.join(columns) if columns is not None else '*'
+    result = []
+
+    # Keeps the number of bound parameters under sqlite's limit
+    for i in range(0, len(values), _MAX_PARAMS):
+        chunk = values[i:i + _MAX_PARAMS]
+        query = 'SELECT {columns} FROM {table_name} WHERE {column} IN ({placeholder})'.format(
+            columns=columns,
+            table_name=table_name,
+            column=column,
+            placeholder=','.join(['?'] * len(chunk))
+        )
+
+        if limit is not None:
+            query += ' LIMIT {:d}'.format(limit - len(result))
+
+        try:
+            data = conn.execute(query, chunk).fetchall()
+        except sqlite3.Error as err:
+            raise exceptions.DBError(err)
+
+        result.extend(dict(r) for r in data)
+
+        if limit is not None and len(result) >= limit:
+            break
+
+    return result
+
+
+@_timed
+def update_where_in(
+        table_name: str,
+        conn: sqlite3.Connection,
+        data: Dict,
+        column: str,
+        values: Iterable
+):
+    '''
+    ARGS:
+        table_name: Name of the table to be updated
+        conn: Database connection instance
+        data: Column values to be set
+        column: Column to filter on
+        values: Values of column to be matched
+
+    Updates rows of a table where column matches any of the values
+    '''
+    values = list(values)
+    assignments = ','.join('{} = ?'.format(c) for c in data)
+    step = _MAX_PARAMS - len(data)
+
+    for i in range(0, len(values), step):
+        chunk = values[i:i + step]
+        query = 'UPDATE {table_name} SET {assignments} WHERE {column} IN ({placeholder})'.format(
+            table_name=table_name,
+            assignments=assignments,
+            column=column,
+            placeholder=','.join(['?'] * len(chunk))
+        )
+
+        try:
+            conn.execute(query, list(data.values()) + chunk)
+        except sqlite3.Error as err:
+            raise exceptions.DBError(err)
+
+
+class SaveResult(NamedTuple):
+    '''
+    Row counts of a bulk save
+    '''
+    inserted: int
+    skipped: int
+    failed: int
+
+
+@_timed
+def save(
+        table_name: str,
+        conn: sqlite3.Connection,
+        data: List[Dict],
+        on_conflict: str = 'IGNORE',
+        chunk_size: int = _CHUNK_SIZE
+) -> SaveResult:
     '''
     ARGS:
         table_name: Name of the table to be saved to
         conn: Database connection instance
         data: A list of dictionaries to be saved to db
+        on_conflict: Conflict resolution for rows violating a constraint,
+                     one of IGNORE, REPLACE, ABORT
+        chunk_size: Number of rows inserted per statement batch
 
-    Saves data in form of list of dictionaries to the database
+    RETURNS:
+        Counts of rows inserted, skipped due to conflicts and failed
+
+    Saves data in form of list of dictionaries to the database.
+    Rows with the same columns are inserted together with executemany,
+    within the current transaction. A failing batch is retried a row
+    at a time so that one bad row does not lose the rest.
+    Changes are not committed
     '''
+    on_conflict = on_conflict.upper()
+
+    if on_conflict not in _CONFLICT_CLAUSES:
+        raise ValueError('Unknown conflict resolution: {}'.format(on_conflict))
+
+    groups = defaultdict(list)
+
     for row in data:
+        groups[tuple(row)].append(row)
+
+    inserted = failed = 0
+
+    try:
+        if not conn.in_transaction:
+            conn.execute('BEGIN')
+
+        for cols, rows in groups.items():
+            query = _insert_query(table_name, cols, on_conflict)
+
+            for i in range(0, len(rows), chunk_size):
+                values = [[r[c] for c in cols] for r in rows[i:i + chunk_size]]
+                conn.execute('SAVEPOINT bulk_save')
+
+                # Counted from rowcount, which unlike total_changes
+                # leaves out rows written by triggers
+                try:
+                    inserted += conn.executemany(query, values).rowcount
+                except sqlite3.Error:
+                    conn.execute('ROLLBACK TO bulk_save')
+                    chunk_inserted, chunk_failed = _save_rows(conn, query, values)
+                    inserted += chunk_inserted
+                    failed += chunk_failed
+
+                conn.execute('RELEASE bulk_save')
+    except sqlite3.Error as err:
+        raise exceptions.DBError(err)
+
+    return SaveResult(inserted, len(data) - inserted - failed, failed)
+
+
+def _save_rows(conn: sqlite3.Connection, query: str, values: List) -> Tuple[int, int]:
+    inserted = failed = 0
+
+    for v in values:
         try:
-            save_row(table_name, conn, row)
+            inserted += conn.execute(query, v).rowcount
         except sqlite3.Error as err:
             current_app.logger.error(err)
+            failed += 1
+
+    return inserted, failed
 
 
-def save_row(table_name: str, conn: sqlite3.Connection, data: Dict):
+@_timed
+def save_row(
+        table_name: str,
+        conn: sqlite3.Connection,
+        data: Dict,
+        on_conflict: str = 'ABORT'
+) -> int:
     '''
     ARGS:
         table_name: Name of the table to be saved to
         conn: Database connection instance
+        on_conflict: Conflict resolution if the row violates a constraint
+
+    RETURNS:
+        Id of the inserted row
 
     Saves dictionary to the database
     '''
-    cols = list(data.keys())
-    values = list(data.values())
-    placeholder = ['?'] * len(cols)
+    query = _insert_query(table_name, tuple(data), on_conflict.upper())
+    return conn.execute(query, list(data.values())).lastrowid
+
 
-    query = 'INSERT INTO {table_name} ({cols}) VALUES ({placeholder})'.format(
+def _insert_query(table_name: str, cols: tuple, on_conflict: str) -> str:
+    return 'INSERT {conflict} INTO {table_name} ({cols}) VALUES ({placeholder})'.format(
+        conflict=_CONFLICT_CLAUSES[on_conflict],
         table_name=table_name,
         cols=','.join(cols),
-        placeholder=','.join(placeholder)
+        placeholder=','.join(['?'] * len(cols))
     )
-
-    conn.execute(query, values)
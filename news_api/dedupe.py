@@ -0,0 +1,169 @@
+'''
+Near duplicate detection for news stories.
+
+Stories are fingerprinted with a MinHash signature of their word
+shingles, whose matching positions estimate the Jaccard similarity
+of two stories. Signatures are split into bands and the hash of each
+band is stored in a lookup table, so only stories sharing a band
+with an incoming story are compared with it. With BANDS bands of
+ROWS rows, stories sharing most of their shingles almost always
+share a band
+'''
+
+import re
+import zlib
+import hashlib
+import sqlite3
+from collections import defaultdict
+from typing import Iterable, List, Optional, Tuple
+
+import numpy as np
+
+from . import exceptions
+
+
+BANDS = 32
+
+ROWS = 4
+
+NUM_PERM = BANDS * ROWS
+
+_TOKEN_RE = re.compile(r'\w+')
+
+# Multiply shift hash functions standing in for random permutations
+_RNG = np.random.RandomState(1)
+
+_A = _RNG.randint(1, 2 ** 62, NUM_PERM, dtype=np.uint64) * np.uint64(2) + np.uint64(1)
+
+_B = _RNG.randint(0, 2 ** 62, NUM_PERM, dtype=np.uint64)
+
+
+def minhash(text: str, shingle_size: int = 3) -> Optional[np.ndarray]:
+    '''
+    ARGS:
+        text: Story text
+        shingle_size: Number of words per shingle
+
+    RETURNS:
+        A signature of NUM_PERM uint32 values,
+        None for texts without words
+    '''
+    tokens = _TOKEN_RE.findall(text.lower())
+
+    if not tokens:
+        return None
+
+    size = min(shingle_size, len(tokens))
+    shingles = {' '.join(tokens[i:i + size]) for i in range(len(tokens) - size + 1)}
+    hashes = np.fromiter(
+        (zlib.crc32(s.encode('utf-8')) for s in shingles),
+        dtype=np.uint64,
+        count=len(shingles)
+    )
+
+    with np.errstate(over='ignore'):  # Products wrap around 2 ** 64 by design
+        permuted = (_A[:, np.newaxis] * hashes + _B[:, np.newaxis]) >> np.uint64(32)
+
+    return permuted.min(axis=1).astype(np.uint32)
+
+
+def similarity(a: np.ndarray, b: np.ndarray) -> float:
+    '''
+    Estimated Jaccard similarity of the stories of two signatures
+    '''
+    return float(np.mean(a == b))
+
+
+def bands(signature: np.ndarray) -> List[int]:
+    '''
+    ARGS:
+        signature: A MinHash signature
+
+    RETURNS:
+        A 64 bit hash of each band of the signature
+    '''
+    return [
+        int.from_bytes(hashlib.blake2b(band.tobytes(), digest_size=8).digest(), 'little', signed=True)
+        for band in signature.reshape(BANDS, ROWS)
+    ]
+
+
+class FingerprintStore:
+    '''
+    Signatures of saved stories, used to find near duplicates
+    of incoming stories. Changes are committed by the caller
+    '''
+
+    def __init__(self, conn: sqlite3.Connection, threshold: float = 0.7):
+        '''
+        ARGS:
+            conn: Database connection
+            threshold: Smallest estimated Jaccard similarity
+                       of near duplicates
+        '''
+        self._conn = conn
+        self._threshold = threshold
+
+    def filter(self, signatures: Iterable) -> List[bool]:
+        '''
+        ARGS:
+            signatures: Signatures of incoming stories, None for
+                        stories that are not checked
+
+        RETURNS:
+            For each story, whether it is new, that is neither a near
+            duplicate of a saved story nor of an earlier incoming story
+        '''
+        batch = defaultdict(list)
+        keep = []
+
+        for signature in signatures:
+            if signature is None:
+                keep.append(True)
+                continue
+
+            keys = list(enumerate(bands(signature)))
+            candidates = [c for k in keys for c in batch[k]]
+            candidates.extend(self._candidates(keys))
+            is_new = all(similarity(signature, c) < self._threshold for c in candidates)
+
+            if is_new:
+                for k in keys:
+                    batch[k].append(signature)
+
+            keep.append(is_new)
+
+        return keep
+
+    def save(self, fingerprints: Iterable[Tuple]):
+        '''
+        ARGS:
+            fingerprints: (news id, signature) tuples,
+                          None signatures are ignored
+        '''
+        fingerprints = [(i, s) for i, s in fingerprints if i is not None and s is not None]
+
+        try:
+            self._conn.executemany(
+                'INSERT OR REPLACE INTO news_minhash (news_id, signature) VALUES (?, ?)',
+                [(i, s.tobytes()) for i, s in fingerprints]
+            )
+            self._conn.executemany(
+                'INSERT OR IGNORE INTO news_minhash_bands (band, value, news_id) VALUES (?, ?, ?)',
+                [(b, v, i) for i, s in fingerprints for b, v in enumerate(bands(s))]
+            )
+        except sqlite3.Error as err:
+            raise exceptions.DBError(err)
+
+    def _candidates(self, keys: List[Tuple]) -> List[np.ndarray]:
+        query = (
+            'SELECT m.signature FROM news_minhash m WHERE m.news_id IN'
+            ' (SELECT news_id FROM news_minhash_bands WHERE {})'
+        ).format(' OR '.join(['(band = ? AND value = ?)'] * len(keys)))
+
+        try:
+            rows = self._conn.execute(query, [p for k in keys for p in k]).fetchall()
+        except sqlite3.Error as err:
+            raise exceptions.DBError(err)
+
+        return [np.frombuffer(r[0], dtype=np.uint32) for r in rows]
@@ -0,0 +1,148 @@
+'''
+Extracts story text from html pages.
+
+Extraction engines are registered by name. The fastest available
+engine is used by default, falling back to a full html.parser
+parse if it fails
+'''
+
+import io
+import re
+import logging
+from typing import Callable, Optional
+
+from bs4 import BeautifulSoup, SoupStrainer, UnicodeDammit
+
+try:
+    from lxml import etree
+except ImportError:  # lxml is optional
+    etree = None
+
+from . import exceptions
+
+
+LOGGER = logging.getLogger(__name__)
+
+ENGINES = {}
+
+_CHARSET_RE = re.compile(r'charset=["\']?([\w.:-]+)', re.IGNORECASE)
+
+
+def register_engine(name: str) -> Callable:
+    '''
+    ARGS:
+        name: Engine name
+
+    Registers a function taking html text and returning a list of
+    paragraphs as an extraction engine
+    '''
+    def register(func):
+        ENGINES[name] = func
+        return func
+
+    return register
+
+
+@register_engine('html.parser')
+def _extract_html_parser(html: str) -> list:
+    soup = BeautifulSoup(html, 'html.parser')
+    return [p.text for p in soup.find_all('p')]
+
+
+@register_engine('strainer')
+def _extract_strainer(html: str) -> list:
+    # Only paragraph nodes are added to the tree
+    soup = BeautifulSoup(html, 'lxml' if etree is not None else 'html.parser', parse_only=SoupStrainer('p'))
+    return [p.text for p in soup.find_all('p')]
+
+
+if etree is not None:
+    @register_engine('lxml')
+    def _extract_lxml(html: str) -> list:
+        source = io.BytesIO(html.encode('utf-8'))
+        paras = []
+
+        for _, element in etree.iterparse(source, events=('end',), tag='p', html=True, encoding='utf-8'):
+            paras.append(''.join(element.itertext()))
+            element.clear()
+
+            # Drops already processed siblings so the tree stays small
+            while element.getprevious() is not None:
+                del element.getparent()[0]
+
+        return paras
+
+
+def default_engine() -> str:
+    '''
+    Get the name of the fastest available engine
+    '''
+    return 'lxml' if 'lxml' in ENGINES else 'strainer'
+
+
+def charset_from_content_type(content_type: Optional[str]) -> Optional[str]:
+    '''
+    ARGS:
+        content_type: Value of a Content-Type header
+
+    Get the charset declared in a Content-Type header, if any
+    '''
+    match = _CHARSET_RE.search(content_type or '')
+    return match.group(1) if match else None
+
+
+def decode_html(data: bytes, encoding: Optional[str] = None) -> str:
+    '''
+    ARGS:
+        data: Raw html
+        encoding: Declared encoding, detected from the document if not given
+
+    Decodes an html page to text
+    '''
+    if encoding is not None:
+        try:
+            return data.decode(encoding, errors='replace')
+        except LookupError:  # Unknown encoding name
+            LOGGER.warning('Unknown encoding %s, detecting from document', encoding)
+
+    dammit = UnicodeDammit(data, is_html=True)
+
+    if dammit.unicode_markup is None:
+        return data.decode('utf-8', errors='replace')
+
+    return dammit.unicode_markup
+
+
+def extract_paragraphs(data: bytes, encoding: Optional[str] = None, engine: Optional[str] = None) -> str:
+    '''
+    ARGS:
+        data: Raw html
+        encoding: Declared encoding of the page
+        engine: Name of a registered engine, defaults to the fastest
+
+    RETURNS:
+        str: Text of the paragraphs in the page, one per line
+
+    Extracts text from the paragraphs of an html page
+    '''
+    engine = engine or default_engine()
+
+    if engine not in ENGINES:
+        raise exceptions.ScrapingError('Unknown extraction engine: {}'.format(engine))
+
+    html = decode_html(data, encoding)
+
+    try:
+        paras = ENGINES[engine](html)
+    except Exception as err:
+        if engine == 'html.parser':
+            raise exceptions.ScrapingError(err)
+
+        LOGGER.warning('Extraction with %s failed, falling back to html.parser: %s', engine, err)
+
+        try:
+            paras = ENGINES['html.parser'](html)
+        except Exception as err:
+            raise exceptions.ScrapingError(err)
+
+    return '\n'.join(paras)
@@ -0,0 +1,173 @@
+'''
+Concurrent, rate limited HTTP fetching for news sources
+'''
+
+import time
+import logging
+import threading
+from urllib.parse import urlsplit
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Iterable, List, Optional, Tuple
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from . import exceptions, metrics
+
+
+LOGGER = logging.getLogger(__name__)
+
+USER_AGENT = 'news-api/0.1'
+
+
+class RateLimiter:
+    '''
+    Token bucket rate limiter with a separate bucket per key,
+    such as a host name
+    '''
+
+    def __init__(self, rate: Optional[float], burst: int = 1):
+        '''
+        ARGS:
+            rate: Tokens added per second, None disables limiting
+            burst: Maximum number of tokens in a bucket
+        '''
+        self._rate = rate
+        self._burst = burst
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def acquire(self, key: str):
+        '''
+        ARGS:
+            key: Bucket to take a token from
+
+        Blocks until a token is available
+        '''
+        if not self._rate:
+            return
+
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                tokens, last = self._buckets.get(key, (self._burst, now))
+                tokens = min(self._burst, tokens + (now - last) * self._rate)
+
+                if tokens >= 1:
+                    self._buckets[key] = (tokens - 1, now)
+                    return
+
+                self._buckets[key] = (tokens, now)
+                wait = (1 - tokens) / self._rate
+
+            time.sleep(wait)
+
+
+class Fetcher:
+    '''
+    Fetches urls through a pooled HTTP session, limiting the request
+    rate per host and running requests on a bounded thread pool
+    '''
+
+    def __init__(
+            self,
+            max_workers: int = 8,
+            rate: Optional[float] = 4.0,
+            burst: int = 4,
+            timeout: Tuple[float, float] = (5.0, 30.0),
+            retries: int = 2
+    ):
+        '''
+        ARGS:
+            max_workers: Maximum number of concurrent requests
+            rate: Requests per second allowed to each host
+            burst: Requests allowed to a host at once before limiting
+            timeout: Connect and read timeouts in seconds
+            retries: Retries for connection errors and 429, 5xx responses
+        '''
+        self._max_workers = max_workers
+        self._timeout = timeout
+        self._limiter = RateLimiter(rate, burst)
+
+        retry = Retry(
+            total=retries,
+            backoff_factor=0.5,
+            status_forcelist=(429, 500, 502, 503, 504),
+            raise_on_status=False
+        )
+        adapter = HTTPAdapter(pool_connections=max_workers, pool_maxsize=max_workers, max_retries=retry)
+
+        self._session = requests.Session()
+        self._session.headers['User-Agent'] = USER_AGENT
+        self._session.mount('http://', adapter)
+        self._session.mount('https://', adapter)
+
+    def get(self, url: str, **kwargs) -> requests.Response:
+        '''
+        ARGS:
+            url: Url to be fetched
+            kwargs: Passed on to requests
+
+        Get a url, waiting for the rate limit of its host.
+        Raises ScrapingError on failure
+        '''
+        self._limiter.acquire(urlsplit(url).netloc)
+        kwargs.setdefault('timeout', self._timeout)
+        start = time.perf_counter()
+
+        try:
+            resp = self._session.get(url, **kwargs)
+            resp.raise_for_status()
+            metrics.FETCH_SECONDS.observe(time.perf_counter() - start, outcome='ok')
+            return resp
+        except requests.RequestException as err:
+            metrics.FETCH_SECONDS.observe(time.perf_counter() - start, outcome='error')
+            raise exceptions.ScrapingError(err)
+
+    def map(self, func: Callable, items: Iterable) -> List:
+        '''
+        ARGS:
+            func: Called with each item, usually fetching a url
+            items: Items to be processed
+
+        RETURNS:
+            A list of results in the same order as items,
+            None for items where func raised ScrapingError
+
+        Runs func over items concurrently. Failures are logged and
+        do not affect other items
+        '''
+        def call(item):
+            try:
+                return func(item)
+            except exceptions.ScrapingError as err:
+                LOGGER.warning('Failed to fetch %s: %s', item, err)
+                return None
+
+        with ThreadPoolExecutor(max_workers=self._max_workers) as executor:
+            return list(executor.map(call, items))
+
+    def close(self):
+        '''
+        Closes pooled connections
+        '''
+        self._session.close()
+
+
+_DEFAULT = None
+
+_DEFAULT_LOCK = threading.Lock()
+
+
+def get_fetcher() -> Fetcher:
+    '''
+    Get a process wide fetcher with default settings
+    '''
+    global _DEFAULT
+
+    with _DEFAULT_LOCK:
+        if _DEFAULT is None:
+            _DEFAULT = Fetcher()
+
+    return _DEFAULT
@@ -0,0 +1,154 @@
+'''
+Geographic name lookups used to resolve locations mentioned in news
+'''
+
+import os
+import re
+import threading
+from typing import Dict, Iterable, List, Optional, Set
+
+import pandas as pd
+
+
+_TOKEN_RE = re.compile(r"\w+(?:['.-]\w+)*")
+
+_CACHE = {}
+
+_CACHE_LOCK = threading.Lock()
+
+
+def tokenize(text: str) -> tuple:
+    '''
+    ARGS:
+        text: Text to be split
+
+    Splits text into lower case word tokens
+    '''
+    return tuple(_TOKEN_RE.findall(text.lower()))
+
+
+class Gazetteer:
+    '''
+    Compiled lookup of countries and the nationalities
+    referring to them. Names are matched case insensitively
+    '''
+
+    def __init__(self, nationalities: Dict[str, str], countries: Iterable):
+        self._countries = frozenset(c.lower() for c in countries)
+        self._nationalities = {n.lower(): c.lower() for n, c in nationalities.items()}
+
+        # Token sequence -> country for every known name, used to find
+        # names spanning several words within a longer phrase
+        self._phrases = {tokenize(c): c for c in self._countries}
+        self._phrases.update(
+            (tokenize(n), c) for n, c in self._nationalities.items()
+            if c in self._countries
+        )
+        self._phrases.pop((), None)
+        self._max_phrase_len = max((len(p) for p in self._phrases), default=0)
+
+    @classmethod
+    def from_frame(cls, geo_db: pd.DataFrame) -> 'Gazetteer':
+        '''
+        ARGS:
+            geo_db: A dataframe with nationalities and countries columns
+        '''
+        geo_db = geo_db.dropna(subset=['nationalities', 'countries'])
+        nationalities = dict(zip(geo_db['nationalities'], geo_db['countries']))
+        return cls(nationalities, geo_db['countries'])
+
+    @classmethod
+    def from_csv(cls, path: str) -> 'Gazetteer':
+        '''
+        ARGS:
+            path: Path to geodata csv file
+        '''
+        return cls.from_frame(pd.read_csv(path))
+
+    def __contains__(self, name: str) -> bool:
+        return self.resolve(name) is not None
+
+    def resolve(self, name: str) -> Optional[str]:
+        '''
+        ARGS:
+            name: A country or nationality
+
+        RETURNS:
+            The lower case country name, None if not known
+        '''
+        name = name.lower()
+        country = self._nationalities.get(name, name)
+        return country if country in self._countries else None
+
+    def match_phrases(self, text: str) -> Set:
+        '''
+        ARGS:
+            text: Text to be searched
+
+        RETURNS:
+            A set of countries whose names or nationalities
+            appear in the text
+
+        Finds the longest known names at each position in the text
+        '''
+        tokens = tokenize(text)
+        found = set()
+        i = 0
+
+        while i < len(tokens):
+            for size in range(min(self._max_phrase_len, len(tokens) - i), 0, -1):
+                country = self._phrases.get(tokens[i:i + size])
+
+                if country is not None:
+                    found.add(country)
+                    i += size
+                    break
+            else:
+                i += 1
+
+        return found
+
+    def locate(self, names: Iterable) -> List:
+        '''
+        ARGS:
+            names: Place names and nationalities, such as
+                   geographic entities found in a text
+
+        RETURNS:
+            A list of distinct countries referred to by names
+        '''
+        found = set()
+
+        for name in names:
+            country = self.resolve(name)
+
+            if country is not None:
+                found.add(country)
+            else:
+                found.update(self.match_phrases(name))
+
+        return list(found)
+
+
+def get_gazetteer(path: str) -> Gazetteer:
+    '''
+    ARGS:
+        path: Path to geodata csv file
+
+    Get a gazetteer for the file, compiled once and
+    recompiled when the file is modified
+    '''
+    mtime = os.stat(path).st_mtime_ns
+    cached = _CACHE.get(path)
+
+    if cached is not None and cached[0] == mtime:
+        return cached[1]
+
+    with _CACHE_LOCK:
+        cached = _CACHE.get(path)
+
+        if cached is None or cached[0] != mtime:
+            cached = (mtime, Gazetteer.from_csv(path))
+            _CACHE[path] = cached
+
+    return cached[1]
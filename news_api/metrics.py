@@ -0,0 +1,415 @@
+'''
+Counters and latency histograms, exposed in the prometheus text format.
+
+Each process keeps its metrics in memory. When a metrics folder is
+configured, processes also write their metrics to a file of their
+own in it every METRICS_FLUSH_INTERVAL seconds, and the metrics of
+all processes, such as api and celery workers, are summed when
+rendered. Files of processes that have exited are removed then
+'''
+
+import os
+import json
+import time
+import glob
+import atexit
+import bisect
+import threading
+from contextlib import contextmanager
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+from flask import Flask, g, request
+
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+class Metric:
+    '''
+    A metric with a value for each combination of label values
+    '''
+
+    kind = None
+
+    def __init__(self, registry: 'Registry', name: str, description: str, labels: Iterable = ()):
+        self.name = name
+        self.description = description
+        self.labels = tuple(labels)
+        self._registry = registry
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def snapshot(self) -> Dict:
+        '''
+        Get a copy of the value of each label combination
+        '''
+        with self._lock:
+            return {k: self._copy(v) for k, v in self._values.items()}
+
+    def clear(self):
+        with self._lock:
+            self._values.clear()
+
+    def _key(self, labels: Dict) -> Tuple:
+        return tuple(str(labels.get(label, '')) for label in self.labels)
+
+    @staticmethod
+    def _copy(value):
+        return value
+
+
+class Counter(Metric):
+    '''
+    A count that only goes up
+    '''
+
+    kind = 'counter'
+
+    def inc(self, amount: float = 1, **labels):
+        '''
+        ARGS:
+            amount: Amount added
+            labels: Label values
+        '''
+        key = self._key(labels)
+
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+        self._registry.updated()
+
+
+class Histogram(Metric):
+    '''
+    Counts of observed values, such as durations in seconds,
+    falling under each bucket bound, along with their sum
+    '''
+
+    kind = 'histogram'
+
+    def __init__(self, *args, buckets: Iterable = DEFAULT_BUCKETS, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.buckets = tuple(sorted(float(b) for b in buckets))
+
+    def observe(self, value: float, **labels):
+        '''
+        ARGS:
+            value: Observed value
+            labels: Label values
+        '''
+        key = self._key(labels)
+        i = bisect.bisect_left(self.buckets, value)
+
+        with self._lock:
+            counts = self._values.get(key)
+
+            if counts is None:
+                counts = self._values[key] = [0] * (len(self.buckets) + 1) + [0.0]
+
+            counts[i] += 1
+            counts[-1] += value
+
+        self._registry.updated()
+
+    @contextmanager
+    def time(self, **labels) -> Iterator:
+        '''
+        ARGS:
+            labels: Label values
+
+        Observes the seconds spent in the with block
+        '''
+        start = time.perf_counter()
+
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    @staticmethod
+    def _copy(value):
+        return list(value)
+
+
+class Registry:
+    '''
+    The metrics of a process
+    '''
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+        self._directory = None
+        self._interval = 5.0
+        self._next_flush = 0.0
+
+    def counter(self, name: str, description: str, labels: Iterable = ()) -> Counter:
+        return self._add(Counter(self, name, description, labels))
+
+    def histogram(self, name: str, description: str, labels: Iterable = (), **kwargs) -> Histogram:
+        return self._add(Histogram(self, name, description, labels, **kwargs))
+
+    def configure(self, directory: Optional[str], interval: float = 5.0):
+        '''
+        ARGS:
+            directory: Folder shared by processes, None to only
+                       render the metrics of this process
+            interval: Seconds between writes of this process' metrics
+        '''
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        self._directory = directory
+        self._interval = interval
+        self._next_flush = 0.0
+
+    def updated(self):
+        '''
+        Called when a metric changes, writes the
+        metrics if the flush interval has passed
+        '''
+        if self._directory is not None and time.monotonic() >= self._next_flush:
+            self.flush()
+
+    def flush(self):
+        '''
+        Writes the metrics of this process to the metrics folder
+        '''
+        directory = self._directory
+
+        if directory is None:
+            return
+
+        self._next_flush = time.monotonic() + self._interval
+        data = {
+            m.name: [[list(k), v] for k, v in m.snapshot().items()]
+            for m in list(self._metrics.values())
+        }
+        path = os.path.join(directory, 'metrics-{}.json'.format(os.getpid()))
+
+        try:
+            with open(path + '.tmp', 'w') as fd:
+                json.dump(data, fd)
+
+            os.replace(path + '.tmp', path)
+        except OSError:
+            pass  # Metrics are never worth failing for
+
+    def collect(self) -> Dict:
+        '''
+        RETURNS:
+            A dict of metric name -> label values -> value, summed
+            over this process and those that wrote to the metrics folder
+
+        Files of processes no longer running are removed, so restarted
+        workers do not leave their files behind. Counts of exited
+        processes are dropped with them, which prometheus sees as a
+        counter reset
+        '''
+        collected = {name: m.snapshot() for name, m in self._metrics.items()}
+
+        if self._directory is None:
+            return collected
+
+        own = os.path.join(self._directory, 'metrics-{}.json'.format(os.getpid()))
+
+        for path in glob.glob(os.path.join(self._directory, 'metrics-*.json')):
+            if path == own:
+                continue
+
+            if not _running(path):
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass  # Removed by another process
+
+                continue
+
+            try:
+                with open(path) as fd:
+                    data = json.load(fd)
+            except (OSError, ValueError):
+                continue
+
+            for name, values in data.items():
+                if name in collected:
+                    for key, value in values:
+                        _merge(collected[name], tuple(key), value)
+
+        return collected
+
+    def render(self) -> str:
+        '''
+        Get all metrics in the prometheus text format
+        '''
+        collected = self.collect()
+        lines = []
+
+        for name, metric in sorted(self._metrics.items()):
+            lines.append('# HELP {} {}'.format(name, metric.description))
+            lines.append('# TYPE {} {}'.format(name, metric.kind))
+
+            for key, value in sorted(collected[name].items()):
+                labels = list(zip(metric.labels, key))
+
+                if metric.kind == 'counter':
+                    lines.append('{}{} {}'.format(name, _labels(labels), _number(value)))
+                    continue
+
+                cumulative = 0
+
+                for bound, count in zip(metric.buckets + (float('inf'),), value):
+                    cumulative += count
+                    le = '+Inf' if bound == float('inf') else _number(bound)
+                    lines.append('{}_bucket{} {}'.format(name, _labels(labels + [('le', le)]), cumulative))
+
+                lines.append('{}_sum{} {}'.format(name, _labels(labels), _number(value[-1])))
+                lines.append('{}_count{} {}'.format(name, _labels(labels), cumulative))
+
+        return '\n'.join(lines) + '\n'
+
+    def reset(self):
+        '''
+        Clears all values, such as in a forked child
+        whose parent's values are counted by the parent
+        '''
+        for m in self._metrics.values():
+            m.clear()
+
+        self._next_flush = 0.0
+
+    def _add(self, metric: Metric) -> Metric:
+        with self._lock:
+            return self._metrics.setdefault(metric.name, metric)
+
+
+def _running(path: str) -> bool:
+    '''
+    ARGS:
+        path: Metrics file of a process
+
+    Whether the process that wrote the file is running
+    '''
+    pid = os.path.basename(path)[len('metrics-'):-len('.json')]
+
+    if not pid.isdigit():
+        return True
+
+    try:
+        os.kill(int(pid), 0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        pass  # Running as another user
+
+    return True
+
+
+def _merge(values: Dict, key: Tuple, value):
+    current = values.get(key)
+
+    if current is None:
+        values[key] = value
+    elif isinstance(current, list):
+        values[key] = [a + b for a, b in zip(current, value)]
+    else:
+        values[key] = current + value
+
+
+def _labels(labels: List) -> str:
+    if not labels:
+        return ''
+
+    escaped = (
+        '{}="{}"'.format(k, v.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+        for k, v in labels
+    )
+    return '{' + ','.join(escaped) + '}'
+
+
+def _number(value: float) -> str:
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+REGISTRY = Registry()
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=REGISTRY.reset)
+
+atexit.register(REGISTRY.flush)
+
+HTTP_REQUEST_SECONDS = REGISTRY.histogram(
+    'news_api_http_request_seconds', 'Duration of http requests', ['method', 'endpoint', 'status']
+)
+
+TASK_SECONDS = REGISTRY.histogram(
+    'news_api_task_seconds', 'Duration of celery tasks', ['task', 'status']
+)
+
+TASK_RETRIES = REGISTRY.counter(
+    'news_api_task_retries_total', 'Celery task retries after errors', ['task']
+)
+
+STAGE_SECONDS = REGISTRY.histogram(
+    'news_api_stage_seconds', 'Duration of ingest stage calls', ['stage']
+)
+
+STAGE_ITEMS = REGISTRY.counter(
+    'news_api_stage_items_total', 'Items received and passed on by ingest stages', ['stage', 'direction']
+)
+
+FETCH_SECONDS = REGISTRY.histogram(
+    'news_api_fetch_seconds', 'Duration of http fetches', ['outcome']
+)
+
+NER_SECONDS = REGISTRY.histogram(
+    'news_api_ner_seconds', 'Duration of batched location finding', []
+)
+
+DB_QUERY_SECONDS = REGISTRY.histogram(
+    'news_api_db_query_seconds', 'Duration of database operations', ['operation', 'table']
+)
+
+
+def init_app(app: Flask):
+    '''
+    Times requests. Metrics are shared through METRICS_DIR, by default
+    the metrics folder under the instance folder, None disables sharing.
+    Requests are observed on teardown, so those that failed with an
+    unhandled exception are counted with status 500
+    '''
+    REGISTRY.configure(
+        app.config.get('METRICS_DIR', os.path.join(app.instance_path, 'metrics')),
+        app.config.get('METRICS_FLUSH_INTERVAL', 5.0)
+    )
+
+    @app.before_request
+    def start_timer():
+        g.metrics_start = time.perf_counter()
+
+    @app.after_request
+    def record_status(resp):
+        g.metrics_status = resp.status_code
+        return resp
+
+    @app.teardown_request
+    def observe_request(exc):
+        start = g.pop('metrics_start', None)
+        status = g.pop('metrics_status', None)
+
+        if start is not None:
+            HTTP_REQUEST_SECONDS.observe(
+                time.perf_counter() - start,
+                method=request.method,
+                endpoint=request.endpoint or 'unknown',
+                status=500 if exc is not None or status is None else status
+            )
+
+
+def render() -> str:
+    '''
+    Get the metrics of all processes in the prometheus text format
+    '''
+    return REGISTRY.render()
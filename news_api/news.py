@@ -2,78 +2,342 @@
 Download news data from various sources
 '''
 
-import time
+import os
+import hashlib
+import itertools
+import threading
 import datetime as dt
-from typing import List
+from typing import Dict, Iterable, List, Optional, Tuple
+from collections import Counter, defaultdict, OrderedDict
 
-import requests
+import click
 import feedparser
-import pandas as pd
-from bs4 import BeautifulSoup
+from flask import current_app, Flask
+from flask.cli import with_appcontext
 from sqlite3 import Connection
 
 
-from . import exceptions, constants, db, nlp
+from . import cache, exceptions, constants, db, dedupe, extract, fetch, geo, metrics, nlp, pipeline
 
 
 REUTERS_FEED_URL = 'http://feeds.reuters.com/reuters/AFRICAWorldNews'
 
 DATE_FMT = '%Y%m%d'
 
+NEWS_COLUMNS = ['id', 'title', 'text', 'dated']
 
-def get_news_reuters() -> List:
+# Default workers of each ingest stage
+STAGE_WORKERS = {'fetch': 8, 'extract': 2, 'enrich': 1, 'persist': 1}
+
+
+def init_app(app: Flask):
+    app.cli.add_command(backfill_locations_command)
+    app.cli.add_command(backfill_fingerprints_command)
+
+
+class LinkStore:
     '''
+    Persists feed validators and the urls of fetched stories,
+    so that unchanged feeds and known stories are not downloaded again.
+    Writes are made in the current transaction of the connection and
+    are only kept once committed, such as along with the stories saved
+    by save_news_to_db, so stories that fail to save are fetched again
+    '''
+
+    def __init__(self, conn: Connection):
+        self._conn = conn
+
+    def feed_headers(self, url: str) -> Dict:
+        '''
+        ARGS:
+            url: Feed url
+
+        RETURNS:
+            Conditional request headers for the feed
+        '''
+        rows = db.read_where_in('feeds', self._conn, 'url', [url])
+        headers = {}
+
+        if rows and rows[0]['etag']:
+            headers['If-None-Match'] = rows[0]['etag']
+
+        if rows and rows[0]['modified']:
+            headers['If-Modified-Since'] = rows[0]['modified']
+
+        return headers
+
+    def save_feed(self, url: str, headers: Dict):
+        '''
+        ARGS:
+            url: Feed url
+            headers: Response headers of the feed request
+
+        Saves the validators of a feed response
+        '''
+        row = {
+            'url': url,
+            'etag': headers.get('ETag'),
+            'modified': headers.get('Last-Modified'),
+            'checked': dt.datetime.utcnow().isoformat()
+        }
+        self._save('feeds', [row])
+
+    def unseen(self, urls: List) -> List:
+        '''
+        ARGS:
+            urls: Story urls
+
+        RETURNS:
+            The urls that have not been fetched before
+        '''
+        seen = db.read_where_in('fetched_links', self._conn, 'url', urls, columns=['url'])
+        seen = {r['url'] for r in seen}
+        return [u for u in urls if u not in seen]
+
+    def save_links(self, texts: Dict) -> List:
+        '''
+        ARGS:
+            texts: Story url -> story text
+
+        RETURNS:
+            The urls whose text had not been fetched before,
+            under any url
+
+        Records stories as fetched, without committing
+        '''
+        hashes = {u: hashlib.sha1(t.encode('utf-8')).hexdigest() for u, t in texts.items()}
+        known = db.read_where_in(
+            'fetched_links', self._conn, 'content_hash', set(hashes.values()), columns=['content_hash']
+        )
+        known = {r['content_hash'] for r in known}
+
+        fetched = dt.datetime.utcnow().isoformat()
+        rows = [{'url': u, 'content_hash': h, 'fetched': fetched} for u, h in hashes.items()]
+        self._save('fetched_links', rows)
+
+        new, new_hashes = [], set()
+
+        for u, h in hashes.items():
+            if h not in known and h not in new_hashes:
+                new.append(u)
+                new_hashes.add(h)
+
+        return new
+
+    def commit(self):
+        '''
+        Commits the feeds and links recorded
+        '''
+        self._conn.commit()
+
+    def _save(self, table_name: str, rows: List):
+        try:
+            db.save(table_name, self._conn, rows, on_conflict='REPLACE')
+        except exceptions.DBError as err:
+            self._conn.rollback()
+            raise exceptions.NewsApiError(err)
+
+
+def get_news_reuters(
+        feed_url: Optional[str] = None,
+        fetcher: Optional[fetch.Fetcher] = None,
+        store: Optional[LinkStore] = None
+) -> List:
+    '''
+    ARGS:
+        feed_url: RSS feed url, defaults to the reuters feed in FEED_URLS
+        fetcher: Fetcher used for requests, defaults to a shared one
+        store: Fetch history, used to skip unchanged feeds and known stories
+
     RETURNS:
         A list of dicts with the following keys:
             title: News headline
             text: Contents of story
             dated: when the news was retrieved
 
-    Parses reuters RSS feed
+    Parses reuters RSS feed. Stories are fetched concurrently and
+    stories that could not be fetched are left out. With a store, the
+    feed and stories are recorded as fetched in the current transaction
+    of the store's connection, to be committed when the stories are saved
     '''
-    reuters_link = constants.FEED_URLS['reuters']
-    feed = feedparser.parse(reuters_link)
-    entries = feed['entries']
-    result = []
+    reuters_link = feed_url or constants.FEED_URLS['reuters']
+    fetcher = fetcher or fetch.get_fetcher()
+    resp, entries = _feed_entries(reuters_link, fetcher, store)
 
-    for d in entries:
-        n = dict()
-        text = parse_link_reuters(d['link'])
+    if resp is None:
+        return []
 
-        n['title'] = d['title']
-        n['text'] = text
-        n['dated'] = dt.datetime.now().date().strftime(constants.DATE_FMT)
+    texts = fetcher.map(lambda d: parse_link_reuters(d['link'], fetcher), entries)
+    fetched = [(d, text) for d, text in zip(entries, texts) if text is not None]
 
-        result.append(n)
-        time.sleep(1)
+    if store is not None:
+        new = set(store.save_links({d['link']: text for d, text in fetched}))
 
-    return result
+        if len(fetched) == len(entries):  # Failed stories are retried on the next poll
+            store.save_feed(reuters_link, resp.headers)
+
+        fetched = [(d, text) for d, text in fetched if d['link'] in new]
+
+    dated = dt.datetime.now().date().strftime(constants.DATE_FMT)
+    return [_make_story(d, text, dated) for d, text in fetched]
+
+
+def ingest_news_reuters(
+        feed_url: Optional[str] = None,
+        fetcher: Optional[fetch.Fetcher] = None,
+        store: Optional[LinkStore] = None,
+        seen=None
+) -> db.SaveResult:
+    '''
+    ARGS:
+        feed_url: RSS feed url, defaults to the reuters feed in FEED_URLS
+        fetcher: Fetcher used for requests, defaults to a shared one
+        store: Fetch history, used to skip unchanged feeds and known stories
+        seen: Recently ingested stories, such as seen.SeenStories,
+              whose stories are not fetched again
+
+    RETURNS:
+        Counts of stories inserted, skipped and failed
+
+    Streams stories of the reuters RSS feed through fetch, extract,
+    enrich and persist stages, so stories are saved while others are
+    still being downloaded. The workers of each stage are set in
+    INGEST_STAGE_WORKERS, items waiting for a stage in
+    INGEST_QUEUE_SIZE and stories enriched and saved together
+    in INGEST_BATCH_SIZE
+    '''
+    reuters_link = feed_url or constants.FEED_URLS['reuters']
+    fetcher = fetcher or fetch.get_fetcher()
+    resp, entries = _feed_entries(reuters_link, fetcher, store)
+
+    if resp is None:
+        return db.SaveResult(0, 0, 0)
+
+    if seen is not None:
+        entries = seen.unseen(entries)
+
+    config = current_app.config
+    workers = {**STAGE_WORKERS, **config.get('INGEST_STAGE_WORKERS', {})}
+    batch_size = config.get('INGEST_BATCH_SIZE', 32)
+    dated = dt.datetime.now().date().strftime(constants.DATE_FMT)
+    totals = Counter()
+    lock = threading.Lock()
+
+    def fetch_story(entry):
+        try:
+            return entry, fetcher.get(entry['link'])
+        except exceptions.ScrapingError as err:
+            current_app.logger.warning('Failed to fetch %s: %s', entry['link'], err)
+
+    def extract_story(item):
+        entry, story_resp = item
+        encoding = extract.charset_from_content_type(story_resp.headers.get('Content-Type'))
+
+        try:
+            text = extract.extract_paragraphs(story_resp.content, encoding)
+        except exceptions.ScrapingError as err:
+            current_app.logger.warning('Failed to extract %s: %s', entry['link'], err)
+            return None
+
+        return entry['link'], _make_story(entry, text, dated)
+
+    def enrich_stories(batch):
+        selected, locations = locate_new_stories([story for _, story in batch])
+        # Digest and signature of stories to be saved, None for those skipped
+        fingerprints = {i: (d, sig) for i, d, sig in selected}
+        return [
+            (link, story, locs, fingerprints.get(i))
+            for i, ((link, story), locs) in enumerate(zip(batch, locations))
+        ]
+
+    def persist_stories(batch):
+        # Links are recorded on the connection save_news_to_db commits,
+        # so they are only kept if the stories are saved
+        if store is not None:
+            new = set(LinkStore(db.get_db()).save_links({link: story['text'] for link, story, _, _ in batch}))
+        else:
+            new = {link for link, _, _, _ in batch}
+
+        kept = [(story, locs, fp) for link, story, locs, fp in batch if link in new]
+        result = save_news_to_db(
+            [story for story, _, _ in kept],
+            [locs for _, locs, _ in kept],
+            [(i,) + fp for i, (_, _, fp) in enumerate(kept) if fp is not None]
+        )
+
+        if seen is not None:
+            seen.add([story for _, story, _, _ in batch])
+
+        with lock:
+            totals['inserted'] += result.inserted
+            totals['skipped'] += result.skipped + len(batch) - len(kept)
+            totals['failed'] += result.failed
+
+        return [story for _, story, _, _ in batch]
+
+    stages = pipeline.Pipeline([
+        pipeline.Stage('fetch', fetch_story, workers['fetch']),
+        pipeline.Stage('extract', extract_story, workers['extract']),
+        pipeline.Stage('enrich', enrich_stories, workers['enrich'], batch_size),
+        pipeline.Stage('persist', persist_stories, workers['persist'], batch_size),
+    ], queue_size=config.get('INGEST_QUEUE_SIZE', 64))
+    done = sum(1 for _ in stages.run(entries))
+
+    if store is not None and done == len(entries):  # Failed stories are retried on the next poll
+        store.save_feed(reuters_link, resp.headers)
+        store.commit()
+
+    current_app.logger.info('Ingest stages: %s', stages.stats)
+    return db.SaveResult(totals['inserted'], totals['skipped'] + len(entries) - done, totals['failed'])
+
+
+def _feed_entries(feed_url: str, fetcher: fetch.Fetcher, store: Optional[LinkStore]) -> Tuple:
+    # The feed response, None if unchanged, and its entries not fetched before
+    headers = store.feed_headers(feed_url) if store is not None else {}
+    resp = fetcher.get(feed_url, headers=headers)
 
+    if resp.status_code == 304:  # Feed unchanged
+        return None, []
 
-def parse_link_reuters(url: str) -> str:
+    entries = feedparser.parse(resp.content)['entries']
+
+    if store is not None:
+        unseen = set(store.unseen([d['link'] for d in entries]))
+        entries = [d for d in entries if d['link'] in unseen]
+
+    return resp, entries
+
+
+def _make_story(entry: Dict, text: str, dated: str) -> Dict:
+    return {'title': entry['title'], 'text': text, 'dated': dated}
+
+
+def parse_link_reuters(
+        url: str,
+        fetcher: Optional[fetch.Fetcher] = None,
+        engine: Optional[str] = None
+) -> str:
     '''
     ARGS:
         url: Story url
+        fetcher: Fetcher used for the request, defaults to a shared one
+        engine: Html extraction engine, defaults to the fastest available
     RETURNS:
         str: News text
 
-    Parses html from reuters news page and gets text
-    using beautiful soup
+    Downloads a reuters news page and gets the text of its paragraphs
     '''
-    try:
-        data = requests.get(url).content
-        soup = BeautifulSoup(data, 'html.parser')
-        paras = [p.text for p in soup.find_all('p')]
-        return '\n'.join(paras)
-    except Exception as err:
-        raise exceptions.ScrapingError(err)
+    fetcher = fetcher or fetch.get_fetcher()
+    resp = fetcher.get(url)
+    encoding = extract.charset_from_content_type(resp.headers.get('Content-Type'))
+    return extract.extract_paragraphs(resp.content, encoding, engine)
 
 
-def get_locations_mentioned(news_txt: str, geo_db: pd.DataFrame) -> List:
+def get_locations_mentioned(news_txt: str, gazetteer: geo.Gazetteer) -> List:
     '''
     ARGS:
         news_txt: News text
-        geo_db: The database containing geodata
+        gazetteer: Compiled geodata lookup
 
     Get the list of locations mentioned in the text
     '''
@@ -82,51 +346,478 @@ def get_locations_mentioned(news_txt: str, geo_db: pd.DataFrame) -> List:
     except Exception as err:
         raise exceptions.NewsApiError(err)
 
+    return _filter_locations(entities, gazetteer)
+
+
+def get_locations_mentioned_batch(
+        news_txts: List,
+        gazetteer: geo.Gazetteer,
+        batch_size: int = 64,
+        n_process: Optional[int] = None
+) -> List:
+    '''
+    ARGS:
+        news_txts: A list of news texts
+        gazetteer: Compiled geodata lookup
+        batch_size: Number of texts sent to the ner pipeline at a time
+        n_process: Number of ner worker processes
+
+    RETURNS:
+        A list of location lists, in the same order as news_txts
+
+    Get the locations mentioned in each text, running entity
+    recognition over all texts in one pass
+    '''
+    try:
+        entity_lists = nlp.get_entities_batch(news_txts, batch_size, n_process)
+    except Exception as err:
+        raise exceptions.NewsApiError(err)
+
+    return [_filter_locations(entities, gazetteer) for entities in entity_lists]
+
+
+def _filter_locations(entities: List, gazetteer: geo.Gazetteer) -> List:
     geo_entity_types = ['NORP', 'GPE']
-    geo_entities = [e.lower() for e, t in entities if t in geo_entity_types]
-    geo_entities = list(set(geo_entities))
+    return gazetteer.locate(e for e, t in entities if t in geo_entity_types)
 
-    for _, row in geo_db.iterrows():  # Replace nationality, language etc with location
-        nationality = row['nationalities'].lower()
-        location = row['countries'].lower()
-        geo_entities = [location if g == nationality else g for g in geo_entities]
 
-    list_of_locations = list(geo_db['countries'].str.lower())
-    geo_entities = [e for e in geo_entities if e in list_of_locations]  # Filter non nationalities
-    geo_entities = list(set(geo_entities))
-    return geo_entities
+def load_gazetteer() -> geo.Gazetteer:
+    '''
+    Get the gazetteer for the geodata file in the application
+    instance folder
+    '''
+    geo_file = os.path.join(current_app.instance_path, 'geodata.csv')
+    return geo.get_gazetteer(geo_file)
+
+
+def get_latest_id() -> Optional[int]:
+    '''
+    Get the id of the most recently saved story
+    '''
+    try:
+        return db.read_max('news', db.get_db(readonly=True))
+    except exceptions.DBError as err:
+        raise exceptions.NewsApiError(err)
 
 
 def get_news_from_db(date: dt.date):
     '''
     ARGS:
-        conn: Database connection instance
         date: Date filter
 
-    Get news data from database
+    Get news data from database, along with the locations
+    found in each story when it was saved
+    '''
+    return list_news(date, date)
+
+
+def list_news(
+        start: dt.date,
+        end: dt.date,
+        after_id: Optional[int] = None,
+        limit: Optional[int] = None
+) -> List:
+    '''
+    ARGS:
+        start: First date to be read
+        end: Last date to be read
+        after_id: Only read stories with a larger id
+        limit: Maximum number of stories
+
+    RETURNS:
+        A list of stories ordered by id
+
+    Get news saved between two dates, along with the
+    locations found in each story
     '''
     try:
-        conn = db.get_db()
-        rows = db.read_all('news', conn)
-        date_str = date.strftime(constants.DATE_FMT)
-        date_rows = [r for r in rows if r['dated'] == date_str]
-        return date_rows
+        conn = db.get_db(readonly=True)
+        rows = db.read_range(
+            'news',
+            conn,
+            'dated',
+            start.strftime(constants.DATE_FMT),
+            end.strftime(constants.DATE_FMT),
+            columns=NEWS_COLUMNS,
+            after_id=after_id,
+            limit=limit
+        )
+        return _attach_locations(conn, rows)
     except exceptions.DBError as err:
-        raise NewsApiError(err)
+        raise exceptions.NewsApiError(err)
 
 
-def save_news_to_db(news_data: List):
+def get_stories_after(after_id: Optional[int] = None, limit: Optional[int] = None) -> List:
+    '''
+    ARGS:
+        after_id: Only read stories with a larger id
+        limit: Maximum number of stories
+
+    RETURNS:
+        A list of dicts with the id and text of stories, ordered by id
+    '''
+    try:
+        return db.read_after('news', db.get_db(readonly=True), after_id, columns=['id', 'text'], limit=limit)
+    except exceptions.DBError as err:
+        raise exceptions.NewsApiError(err)
+
+
+def search_news(query: str, limit: int = 20, offset: int = 0) -> List:
+    '''
+    ARGS:
+        query: Keywords, stories must contain all of them
+        limit: Maximum number of stories
+        offset: Number of best matching stories skipped
+
+    RETURNS:
+        A list of dicts with the id, title, date, bm25 score and
+        a snippet of the text of matching stories, best match first
+    '''
+    # Keywords are quoted so characters in them are not read as query syntax
+    terms = ['"{}"'.format(t.replace('"', '""')) for t in query.split()]
+
+    if not terms:
+        return []
+
+    try:
+        return db.read_match(
+            'news',
+            db.get_db(readonly=True),
+            'news_fts',
+            ' '.join(terms),
+            columns=['id', 'title', 'dated'],
+            snippet_column=1,
+            limit=limit,
+            offset=offset
+        )
+    except exceptions.DBError as err:
+        raise exceptions.NewsApiError(err)
+
+
+def get_stories(ids: List) -> List:
+    '''
+    ARGS:
+        ids: Story ids
+
+    RETURNS:
+        A list of dicts with the id, title and date of stories,
+        in the order of ids. Unknown ids are left out
+    '''
+    try:
+        rows = db.read_where_in('news', db.get_db(readonly=True), 'id', ids, columns=['id', 'title', 'dated'])
+    except exceptions.DBError as err:
+        raise exceptions.NewsApiError(err)
+
+    by_id = {r['id']: r for r in rows}
+    return [by_id[i] for i in ids if i in by_id]
+
+
+def _attach_locations(conn: Connection, rows: List) -> List:
+    located = db.read_where_in('news_locations', conn, 'news_id', [r['id'] for r in rows])
+    locations = defaultdict(list)
+
+    for loc in located:
+        locations[loc['news_id']].append(loc['location'])
+
+    return [{'locations_mentioned': locations[r['id']], **r} for r in rows]
+
+
+def story_digest(story: Dict) -> str:
+    '''
+    ARGS:
+        story: A news story dict
+
+    RETURNS:
+        A hex digest identifying the story, stories with the
+        same headline have the same digest
+    '''
+    title = ' '.join(story['title'].lower().split())
+    return hashlib.sha1(title.encode('utf-8')).hexdigest()
+
+
+def save_news_to_db(
+        news_data: List,
+        locations: Optional[List] = None,
+        selected: Optional[List] = None
+) -> db.SaveResult:
     '''
     ARGS:
         news_data: A List of dictionaries containing
                    relevant news data
+        locations: Locations already found in each story, None
+                   for stories whose locations are to be found
+        selected: Index, digest and signature of the stories to save,
+                  as returned by locate_new_stories, None to select
+                  them here
 
-    Saves news to database
+    RETURNS:
+        Counts of stories inserted, skipped and failed
+
+    Saves news to database along with the locations mentioned in
+    each story. Stories that are already saved are skipped, as are
+    near duplicates of saved stories, such as rewrites and wire
+    republishes, found by comparing MinHash signatures.
+    Stories whose locations could not be found are saved
+    unlocated and picked up by backfill_locations. Stories selected
+    beforehand are only checked again for being saved since
     '''
+    conn = db.get_db()
+
     try:
-        conn = db.get_db()
-        db.save('news', conn, news_data)
+        if selected is None:
+            store, selected = _select_new(conn, news_data)
+        else:
+            store = _fingerprint_store(conn)
+            unsaved = _unsaved(conn, [d for _, d, _ in selected])
+            fresh = []
+
+            for i, d, sig in selected:
+                if d in unsaved:  # Once per digest, as stories may come from several selections
+                    unsaved.discard(d)
+                    fresh.append((i, d, sig))
+
+            selected = fresh
+
+        new_stories = [news_data[i] for i, _, _ in selected]
+        digests = [d for _, d, _ in selected]
+        signatures = [s for _, _, s in selected]
+        known = [locations[i] if locations is not None else None for i, _, _ in selected]
+        missing = [n for n, locs in zip(new_stories, known) if locs is None]
+
+        try:
+            found = iter(_find_locations(missing) if missing else [])
+            locations = [locs if locs is not None else next(found) for locs in known]
+        except (OSError, exceptions.NewsApiError) as err:
+            current_app.logger.error('Could not find locations: %s', err)
+            locations = None
+
+        rows = [
+            {**n, 'digest': d, 'located': int(locations is not None)}
+            for d, n in zip(digests, new_stories)
+        ]
+        result = db.save('news', conn, rows)
+
+        ids = db.read_where_in('news', conn, 'digest', digests, columns=['id', 'digest'])
+        ids = {r['digest']: r['id'] for r in ids}
+        ids = [ids.get(d) for d in digests]
+        store.save(zip(ids, signatures))
+
+        if locations is not None:
+            _save_locations(conn, ids, locations)
+
         conn.commit()
     except exceptions.DBError as err:
         conn.rollback()
-        raise NewsApiError(err)
+        raise exceptions.NewsApiError(err)
+
+    cache.invalidate()
+    result = result._replace(skipped=len(news_data) - result.inserted - result.failed)
+    current_app.logger.info(
+        'Saved %s stories, skipped %s, failed %s', result.inserted, result.skipped, result.failed
+    )
+    return result
+
+
+def ingest_stories(stories: Iterable, chunk_size: int = 500) -> db.SaveResult:
+    '''
+    ARGS:
+        stories: Story dicts, such as a stream read from a request
+        chunk_size: Number of stories saved per transaction
+
+    RETURNS:
+        Counts of stories inserted, skipped and failed
+
+    Saves stories in chunks as they are read, so that
+    a stream of stories is never held in memory at once
+    '''
+    stories = iter(stories)
+    inserted = skipped = failed = 0
+
+    while True:
+        chunk = list(itertools.islice(stories, chunk_size))
+
+        if not chunk:
+            return db.SaveResult(inserted, skipped, failed)
+
+        result = save_news_to_db(chunk)
+        inserted += result.inserted
+        skipped += result.skipped
+        failed += result.failed
+
+
+def locate_new_stories(news_data: List) -> Tuple[List, List]:
+    '''
+    ARGS:
+        news_data: A list of story dicts
+
+    RETURNS:
+        The index, digest and signature of each story to be saved,
+        and a list of the locations mentioned in each story, None for
+        stories that are already saved or whose locations could
+        not be found
+
+    Finds locations in stories save_news_to_db would save,
+    so entity recognition can run ahead of saving. The stories
+    selected can be passed on to save_news_to_db, which then
+    does not look for near duplicates again
+    '''
+    try:
+        _, selected = _select_new(db.get_db(), news_data)
+    except exceptions.DBError as err:
+        raise exceptions.NewsApiError(err)
+
+    locations = [None] * len(news_data)
+
+    try:
+        found = _find_locations([news_data[i] for i, _, _ in selected]) if selected else []
+    except (OSError, exceptions.NewsApiError) as err:
+        current_app.logger.error('Could not find locations: %s', err)
+        return selected, locations
+
+    for (i, _, _), locs in zip(selected, found):
+        locations[i] = locs
+
+    return selected, locations
+
+
+def _select_new(conn: Connection, news_data: List) -> Tuple[dedupe.FingerprintStore, List]:
+    # Index, digest and signature of each story that is neither saved nor a near duplicate
+    stories = OrderedDict()
+
+    for i, n in enumerate(news_data):
+        stories.setdefault(story_digest(n), i)
+
+    unsaved = _unsaved(conn, list(stories))
+    stories = OrderedDict((d, i) for d, i in stories.items() if d in unsaved)
+    store = _fingerprint_store(conn)
+    signatures = [dedupe.minhash(news_data[i]['text']) for i in stories.values()]
+    keep = store.filter(signatures)
+
+    if not all(keep):
+        current_app.logger.info('Skipping %s near duplicate stories', len(keep) - sum(keep))
+
+    selected = [(i, d, sig) for (d, i), sig, k in zip(stories.items(), signatures, keep) if k]
+    return store, selected
+
+
+def _unsaved(conn: Connection, digests: List) -> set:
+    # Digests of stories not saved yet
+    saved = db.read_where_in('news', conn, 'digest', digests, columns=['digest'])
+    return set(digests) - {r['digest'] for r in saved}
+
+
+def _fingerprint_store(conn: Connection) -> dedupe.FingerprintStore:
+    return dedupe.FingerprintStore(conn, current_app.config.get('NEAR_DUPLICATE_THRESHOLD', 0.7))
+
+
+def backfill_locations(batch_size: int = 500) -> int:
+    '''
+    ARGS:
+        batch_size: Number of stories processed per transaction
+
+    RETURNS:
+        Number of stories located
+
+    Finds and saves locations for stories saved without them, such as
+    those created before locations were stored
+    '''
+    conn = db.get_db()
+    count = 0
+
+    while True:
+        rows = db.read_where_in('news', conn, 'located', [0], limit=batch_size)
+
+        if not rows:
+            return count
+
+        try:
+            locations = _find_locations(rows)
+            ids = [r['id'] for r in rows]
+            _save_locations(conn, ids, locations)
+            db.update_where_in('news', conn, {'located': 1}, 'id', ids)
+            conn.commit()
+        except exceptions.DBError as err:
+            conn.rollback()
+            raise exceptions.NewsApiError(err)
+
+        cache.invalidate()
+
+        count += len(rows)
+
+
+def backfill_fingerprints(batch_size: int = 500) -> int:
+    '''
+    ARGS:
+        batch_size: Number of stories processed per transaction
+
+    RETURNS:
+        Number of stories fingerprinted
+
+    Saves fingerprints of stories saved without them, such as those
+    created before near duplicates were detected
+    '''
+    conn = db.get_db()
+    store = dedupe.FingerprintStore(conn)
+    after_id = None
+    count = 0
+
+    while True:
+        rows = db.read_after('news', conn, after_id, columns=['id', 'text'], limit=batch_size)
+
+        if not rows:
+            return count
+
+        after_id = rows[-1]['id']
+
+        try:
+            done = db.read_where_in('news_minhash', conn, 'news_id', [r['id'] for r in rows], columns=['news_id'])
+            done = {r['news_id'] for r in done}
+            rows = [r for r in rows if r['id'] not in done]
+            store.save((r['id'], dedupe.minhash(r['text'])) for r in rows)
+            conn.commit()
+        except exceptions.DBError as err:
+            conn.rollback()
+            raise exceptions.NewsApiError(err)
+
+        count += len(rows)
+
+
+def _find_locations(news_data: List) -> List:
+    with metrics.NER_SECONDS.time():
+        return get_locations_mentioned_batch(
+            [n['text'] for n in news_data],
+            load_gazetteer(),
+            batch_size=current_app.config.get('NER_BATCH_SIZE', 64),
+            n_process=current_app.config.get('NER_PROCESSES')
+        )
+
+
+def _save_locations(conn: Connection, ids: List, locations: List):
+    rows = [
+        {'news_id': i, 'location': loc}
+        for i, locs in zip(ids, locations) if i is not None
+        for loc in locs
+    ]
+    db.save('news_locations', conn, rows)
+
+
+@click.command('backfill-locations')
+@click.option('--batch-size', default=500, help='Stories processed per transaction')
+@with_appcontext
+def backfill_locations_command(batch_size):
+    '''
+    Saves locations for stories stored without them
+    '''
+    count = backfill_locations(batch_size)
+    click.echo('Located {} stories'.format(count))
+
+
+@click.command('backfill-fingerprints')
+@click.option('--batch-size', default=500, help='Stories processed per transaction')
+@with_appcontext
+def backfill_fingerprints_command(batch_size):
+    '''
+    Saves near duplicate signatures for stories stored without them
+    '''
+    count = backfill_fingerprints(batch_size)
+    click.echo('Fingerprinted {} stories'.format(count))
@@ -2,16 +2,149 @@
 NLP library
 '''
 
-from typing import List, Optional
-from collections import OrderedDict, Counter
+import os
+import json
+import math
+import time
+import uuid
+import shutil
+import resource
+import threading
+import datetime as dt
+from typing import Dict, Iterable, List, Optional, Union
+from collections import defaultdict, OrderedDict, Counter
 
 import spacy
 import numpy as np
 import pandas as pd
+from scipy.sparse import csc_matrix, csr_matrix, hstack
+from scipy.sparse.linalg import svds
+
+from . import exceptions
 
 
 _SPACY_LANG_PACK = 'en_core_web_sm'
 
+_SPACY_COMPONENTS = ('tagger', 'parser', 'ner')
+
+_SINGULAR_TOL = 1e-10
+
+_CURRENT_MODEL = 'CURRENT'
+
+MODEL_DIR = 'lsa'  # Models are saved here under the instance folder
+
+
+class PipelineRegistry:
+    '''
+    Process wide registry of spacy pipelines.
+
+    Each variant is loaded once, on first use, with the components
+    it does not need disabled. Loading is guarded by a lock so that
+    concurrent callers share a single instance per variant.
+    '''
+
+    # Variant name -> components kept enabled, None keeps all
+    VARIANTS = {
+        'full': None,
+        'ner': ('ner',),
+        'tagger': ('tagger',),
+        'sentencizer': (),
+    }
+
+    def __init__(self, lang_pack: str = _SPACY_LANG_PACK):
+        self._lang_pack = lang_pack
+        self._lock = threading.Lock()
+        self._pipelines = {}
+        self._stats = defaultdict(Counter)
+
+    def get(self, variant: str = 'full') -> spacy.language.Language:
+        '''
+        ARGS:
+            variant: One of the names in VARIANTS
+
+        RETURNS:
+            A spacy pipeline for the variant, loaded if required
+        '''
+        nlp = self._pipelines.get(variant)
+
+        if nlp is None:
+            with self._lock:
+                nlp = self._pipelines.get(variant)
+
+                if nlp is None:
+                    nlp = self._load(variant)
+                    self._pipelines[variant] = nlp
+                    return nlp
+
+        self._stats[variant]['hits'] += 1
+        return nlp
+
+    def warm_up(self, variants: Optional[Iterable] = None):
+        '''
+        ARGS:
+            variants: Variants to be loaded, defaults to all of them
+
+        Loads pipelines ahead of the first request
+        '''
+        for variant in variants or self.VARIANTS:
+            self.get(variant)
+
+    @property
+    def stats(self) -> Dict:
+        '''
+        RETURNS:
+            A dict of variant -> counters. Counters are:
+                loads: Number of times the pipeline was loaded
+                hits: Number of times the loaded pipeline was reused
+                load_seconds: Time taken to load the pipeline
+                rss_bytes: Growth in peak resident memory while loading
+        '''
+        return {k: dict(v) for k, v in self._stats.items()}
+
+    def clear(self):
+        '''
+        Drops all loaded pipelines
+        '''
+        with self._lock:
+            self._pipelines.clear()
+
+    def _load(self, variant: str) -> spacy.language.Language:
+        if variant not in self.VARIANTS:
+            raise ValueError('Unknown pipeline variant: {}'.format(variant))
+
+        keep = self.VARIANTS[variant]
+        disable = [] if keep is None else [c for c in _SPACY_COMPONENTS if c not in keep]
+
+        rss_before = _peak_rss_bytes()
+        started = time.perf_counter()
+        nlp = spacy.load(self._lang_pack, disable=disable)
+
+        if variant == 'sentencizer':
+            nlp.add_pipe(nlp.create_pipe('sentencizer'))
+
+        stats = self._stats[variant]
+        stats['loads'] += 1
+        stats['load_seconds'] += time.perf_counter() - started
+        stats['rss_bytes'] += _peak_rss_bytes() - rss_before
+        return nlp
+
+
+def _peak_rss_bytes() -> int:
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024  # Reported in KB
+
+
+PIPELINES = PipelineRegistry()
+
+
+def get_pipeline(variant: str = 'full') -> spacy.language.Language:
+    '''
+    ARGS:
+        variant: Pipeline variant, see PipelineRegistry.VARIANTS
+
+    Get a shared spacy pipeline from the process wide registry
+    '''
+    return PIPELINES.get(variant)
+
 
 def make_sentences(document: str) -> List:
     '''
@@ -20,7 +153,7 @@ def make_sentences(document: str) -> List:
 
     Returns a list of sentences for a given document
     '''
-    nlp = spacy.load(_SPACY_LANG_PACK)
+    nlp = get_pipeline('sentencizer')
     return [s.text for s in nlp(document).sents]
 
 
@@ -31,11 +164,108 @@ def get_entities(document: str) -> List:
 
     Get english language entities from a piece of text
     '''
-    nlp = spacy.load(_SPACY_LANG_PACK)
+    nlp = get_pipeline('ner')
     doc = nlp(document)
     return [(ent.text, ent.label_) for ent in doc.ents]
 
 
+def get_entities_batch(
+        documents: Iterable,
+        batch_size: int = 64,
+        n_process: Optional[int] = None
+) -> List:
+    '''
+    ARGS:
+        documents: The documents to be analysed
+        batch_size: Number of documents sent to the pipeline at a time
+        n_process: Number of worker processes, defaults to the cpu count
+
+    RETURNS:
+        A list of entity lists, in the same order as documents
+
+    Get english language entities from many documents in a single
+    pass over the ner pipeline
+    '''
+    documents = list(documents)
+
+    if n_process is None:
+        n_process = os.cpu_count() or 1
+
+    # Starting workers costs more than it saves when there are few batches
+    n_process = max(1, min(n_process, math.ceil(len(documents) / batch_size)))
+
+    nlp = get_pipeline('ner')
+    docs = nlp.pipe(documents, batch_size=batch_size, n_process=n_process)
+    return [[(ent.text, ent.label_) for ent in doc.ents] for doc in docs]
+
+
+class _Segment:
+    '''
+    Terms and documents added to a model together, by a fit or a
+    fold in. Each segment is saved in a folder of its own, so later
+    versions of a model link to the folders of unchanged segments
+    instead of writing them again
+    '''
+
+    def __init__(
+            self,
+            name: str,
+            terms: int,
+            matrix: csc_matrix,
+            errors: Iterable = (),
+            documents: Optional[List] = None,
+            parts: Iterable = (),
+            path: Optional[str] = None
+    ):
+        '''
+        ARGS:
+            name: Folder name of the segment
+            terms: Number of terms first seen in the segment
+            matrix: Term counts of the segment's documents, with a
+                    row for each term of the model up to the segment
+            errors: Fold in errors of the documents
+            documents: Documents, read from path or parts if None
+            parts: Segments merged into this one
+            path: Folder the segment is saved in
+        '''
+        self.name = name
+        self.terms = terms
+        self.matrix = matrix
+        self.errors = list(errors)
+        self.parts = list(parts)
+        self.path = path
+        self._documents = documents
+
+    @property
+    def docs(self) -> int:
+        return self.matrix.shape[1]
+
+    @property
+    def documents(self) -> List:
+        if self._documents is None:
+            if self.path is not None:
+                with open(os.path.join(self.path, 'documents.json'), encoding='utf-8') as fd:
+                    self._documents = json.load(fd)
+            else:
+                self._documents = [d for p in self.parts for d in p.documents]
+
+        return self._documents
+
+    def merge(self, other: '_Segment', name: str) -> '_Segment':
+        '''
+        ARGS:
+            other: The segment following this one
+            name: Folder name of the merged segment
+        '''
+        return _Segment(
+            name,
+            self.terms + other.terms,
+            hstack([_pad_rows(self.matrix, other.matrix.shape[0]), other.matrix], format='csc'),
+            self.errors + other.errors,
+            parts=[self, other]
+        )
+
+
 class LSA:
     '''
     Latent semantic analysis
@@ -44,14 +274,48 @@ class LSA:
     _POS = ['PROPN', 'NOUN']
     _SVD_RANK = 3
 
-    def __init__(self, doclist: List, svd_rank: int = 3, vocab: Optional[List] = None):
-        self._nlp = spacy.load(_SPACY_LANG_PACK)
-        self._doclist = doclist
-        self._vocabulary = vocab if vocab is not None else self._calculate_vocab()
+    FORMAT_VERSION = 3
+
+    def __init__(
+            self,
+            doclist: List,
+            svd_rank: int = 3,
+            vocab: Optional[List] = None,
+            doc_ids: Optional[List] = None,
+            refit_threshold: float = 0.1
+    ):
+        '''
+        ARGS:
+            doclist: Documents of the corpus
+            svd_rank: Number of latent dimensions
+            vocab: Terms of the occurrence matrix, defaults to the
+                   nouns and proper nouns in the documents
+            doc_ids: Identifiers of the documents, defaults to their positions
+            refit_threshold: Increase in mean fold in error, over the error of
+                             the fitted documents, after which a refit is needed
+        '''
+        self._doclist = list(doclist)
+        self._doc_ids = list(doc_ids) if doc_ids is not None else list(range(len(self._doclist)))
+
+        if len(self._doc_ids) != len(self._doclist):
+            raise ValueError('Got {} doc ids for {} documents'.format(len(self._doc_ids), len(self._doclist)))
+        self._refit_threshold = refit_threshold
+        self._tokens = None
+        self._doc_keywords = None
+        self._vocabulary = list(OrderedDict.fromkeys(vocab)) if vocab is not None else self._calculate_vocab()
+        self._vocab_index = {v: i for i, v in enumerate(self._vocabulary)}
         self._svd_rank = svd_rank
+        self._matrix = None
+        self._U = None
+        self._segments = []
+        self._next_segment = 0
+        self._fit_id = None
 
-    def get_occurrence_matrix(self) -> pd.DataFrame:
+    def get_occurrence_matrix(self, sparse: bool = False) -> Union[pd.DataFrame, csr_matrix]:
         '''
+        ARGS:
+            sparse: Return a scipy sparse matrix instead of a dataframe
+
         RETURNS:
             An occurrence matrix of the form :
 
@@ -67,68 +331,570 @@ class LSA:
         columns indicating documents. Entries of the matrix represent the frequency of
         terms in the corresponding documents
         '''
-        matrix = pd.DataFrame()
+        if self._matrix is None and self._segments:
+            self._matrix = hstack(
+                [_pad_rows(s.matrix, len(self._vocabulary)) for s in self._segments], format='csr'
+            )
+        elif self._matrix is None:
+            tokens = self._tokens if self._tokens is not None else self._tokenize(self.documents)
+            self._matrix = self._count_terms(tokens)
+            self._tokens = None  # Only needed once
+
+        if sparse:
+            return self._matrix
+
+        return pd.DataFrame(self._matrix.toarray(), index=self._vocabulary, columns=self.documents)
+
+    @property
+    def documents(self) -> List:
+        '''
+        Documents of the model. Documents of a loaded model
+        are read from disk on first use
+        '''
+        if self._doclist is None:
+            self._doclist = [d for s in self._segments for d in s.documents]
+
+        return self._doclist
+
+    def fit(self, occurence_matrix: Optional[Union[pd.DataFrame, csr_matrix]] = None) -> 'LSA':
+        '''
+        ARGS:
+            occurence_matrix: Matrix to be decomposed, defaults to the
+                              occurrence matrix of the documents
+
+        RETURNS:
+            The fitted model
+
+        Computes a truncated svd of the occurrence matrix and caches the
+        factors used to compare documents, so that queries only need
+        a small matrix product
+        '''
+        labels = None  # Scores are labelled with the model's own documents
+
+        if occurence_matrix is None:
+            matrix = self.get_occurrence_matrix(sparse=True)
+        elif isinstance(occurence_matrix, pd.DataFrame):
+            matrix = csr_matrix(occurence_matrix.to_numpy(dtype=np.float64))
+            labels = list(occurence_matrix.columns)
+        else:
+            matrix = occurence_matrix
+
+        U, s, Vt = self._calculate_svd(matrix)
+        V = Vt.transpose()
+
+        self._fitted_on = occurence_matrix
+        self._labels = labels
+        self._keyword_lists = self._doc_keywords if labels is None else None
+        self._U = U
+        self._S_inv = 1 / s
+        self._doc_vectors = _normalize_rows(V)
+        self._fit_terms = U.shape[0]
+        self._fit_error = np.mean(self._projection_error(matrix)) if matrix.shape[1] else 0.0
+        self._fit_id = uuid.uuid4().hex
+        self._segments = [] if occurence_matrix is not None else [_Segment(
+            self._segment_name(),
+            len(self._vocabulary),
+            matrix.tocsc(),
+            documents=list(self._doclist) if self._doclist is not None else None,
+            parts=self._segments
+        )]
+        return self
+
+    def fold_in(self, docs: List, doc_ids: Optional[List] = None) -> float:
+        '''
+        ARGS:
+            docs: Documents to be added
+            doc_ids: Identifiers of the documents
+
+        RETURNS:
+            Mean fold in error of the documents added since the last fit
+
+        Adds documents to a fitted model without recomputing the svd.
+        Documents are projected into the existing latent space, and terms
+        first seen in them are added to the vocabulary and projected
+        using the new documents. Fold in error is the share of a
+        document's term counts the latent space does not capture
+        '''
+        docs = list(docs)
+
+        if doc_ids is not None:
+            doc_ids = list(doc_ids)
+
+            if len(doc_ids) != len(docs):
+                raise ValueError('Got {} doc ids for {} documents'.format(len(doc_ids), len(docs)))
+
+        if self._U is None:
+            self.fit()
+
+        if self._fitted_on is not None:
+            raise exceptions.NLPError('Only models fitted on their own documents can be extended')
+
+        tokens, keywords = [], []
+
+        for doc in self._nlp.pipe(docs):
+            tokens.append([t.text for t in doc])
+            keywords.append([t.text for t in doc if t.pos_ in self._POS])
+
+        known_terms = len(self._vocabulary)
+
+        for term in (t for k in keywords for t in k):
+            if term not in self._vocab_index:
+                self._vocab_index[term] = len(self._vocabulary)
+                self._vocabulary.append(term)
+
+        counts = self._count_terms(tokens)
+
+        # Documents: d^t . U . S^-1, then new terms: t . V_new . S^-1
+        doc_coords = (counts[:known_terms].transpose() @ self._U) * self._S_inv
+        term_coords = (counts[known_terms:] @ doc_coords) * self._S_inv
+
+        # Documents and counts are kept in a segment of their own,
+        # so saving the model only writes what was added
+        self._segments.append(_Segment(
+            self._segment_name(),
+            len(self._vocabulary) - known_terms,
+            counts.tocsc(),
+            self._projection_error(counts),
+            documents=docs
+        ))
+        self._matrix = None
+
+        self._U = np.vstack([self._U, term_coords])
+        self._doc_vectors = np.vstack([self._doc_vectors, _normalize_rows(doc_coords)])
+        start = len(self._doc_ids)
+        self._doc_ids.extend(doc_ids if doc_ids is not None else range(start, start + len(docs)))
+
+        if self._doclist is not None:
+            self._doclist.extend(docs)
 
-        for d in self._doclist:
-            embedding = self._get_embedding(d)
-            matrix = matrix.append(embedding)
+        if self._keyword_lists is not None:
+            self._keyword_lists.extend(keywords)
 
-        return matrix.transpose()
+        return self.fold_in_error
 
-    def get_related_keywords(self, doc: str, occurence_matrix: pd.DataFrame) -> List:
+    @property
+    def fold_in_error(self) -> float:
         '''
+        Mean fold in error of the documents added since the last fit
+        '''
+        errors = [e for s in self._segments for e in s.errors]
+        return float(np.mean(errors)) if errors else 0.0
+
+    @property
+    def needs_refit(self) -> bool:
+        '''
+        Whether documents added since the last fit are represented
+        much worse than the fitted documents
+        '''
+        return self.fold_in_error - self._fit_error > self._refit_threshold
+
+    @property
+    def doc_ids(self) -> List:
+        '''
+        Identifiers of the documents in the model
+        '''
+        return self._doc_ids
+
+    @property
+    def fit_id(self) -> Optional[str]:
+        '''
+        Identifier of the last fit. Models with the same fit id share
+        the vectors of the documents they have in common
+        '''
+        return self._fit_id
+
+    @property
+    def doc_vectors(self) -> np.ndarray:
+        '''
+        Unit length vectors of the documents in the latent space,
+        one row per document
+        '''
+        return self._doc_vectors
+
+    def _projection_error(self, counts: csr_matrix) -> np.ndarray:
+        # Share of each document's squared term counts outside the span of the fitted terms
+        counts = counts.astype(np.float64)
+        captured = np.square(counts[:self._fit_terms].transpose() @ self._U[:self._fit_terms]).sum(axis=1)
+        total = np.asarray(counts.multiply(counts).sum(axis=0)).ravel()
+        return np.divide(total - captured, total, out=np.zeros_like(total), where=total > 0)
+
+    def transform(self, docs: List) -> np.ndarray:
+        '''
+        ARGS:
+            docs: Documents to be projected
+
+        RETURNS:
+            An array with a row of latent space coordinates for each document
+
+        Projects documents into the latent space of the fitted model
+        '''
+        counts = self._count_terms(self._tokenize(docs))
+        return (counts.transpose() @ self._U) * self._S_inv  # Q^t . U . S^-1
+
+    def get_related_keywords(
+            self,
+            doc: Union[str, List],
+            occurence_matrix: Optional[pd.DataFrame] = None
+    ) -> List:
+        '''
+        ARGS:
+            doc: The doc, or list of docs, to be compared
+            occurrence_matrix: The documents to be compared against,
+                               defaults to the fitted documents
+
+        RETURNS:
+            A list of keywords, or a list of keyword lists for a list of docs
+
         Get top keywords related to the document to compared with the rest of the
         corpus
         '''
         similarity_scores = self.get_similarity(doc, occurence_matrix)
-        rounded = similarity_scores.apply(lambda x: round(x, 2))
-        top = rounded[rounded > 0]
-        docs = top.index
-        return [t.text for t in self._nlp(' '.join(docs)) if t.pos_ in self._POS]
+        scores = similarity_scores.to_numpy().reshape(-1, len(self._doc_vectors))
+        keyword_lists = self._get_keyword_lists()
+        result = []
+
+        for row in np.round(scores, 2) > 0:
+            result.append([k for j in np.flatnonzero(row) for k in keyword_lists[j]])
+
+        return result[0] if isinstance(doc, str) else result
 
-    def get_similarity(self, doc: str, occurence_matrix: pd.DataFrame) -> pd.Series:
+    def get_similarity(
+            self,
+            doc: Union[str, List],
+            occurence_matrix: Optional[pd.DataFrame] = None
+    ) -> Union[pd.Series, pd.DataFrame]:
         '''
         ARGS:
-            doc: The doc to be compared
-            occurrence_matrix: The document to be compared against
+            doc: The doc, or list of docs, to be compared
+            occurrence_matrix: The documents to be compared against,
+                               defaults to the fitted documents
 
         RETURNS:
-            A series with similairity scores
+            A series with similairity scores, or a dataframe with a row
+            of scores for each doc in a list
 
-        Calculculates similarity between a document and an occurence matrix
-        and returns a list of similarity scores for each document
+        Calculculates cosine similarity in the latent space between
+        documents and each document of an occurence matrix. The model
+        is fitted on first use or when given a different matrix
         '''
-        U, s, Vt = self._calculate_svd(occurence_matrix)
-        V = Vt.transpose()
-        S = np.zeros((len(s), len(s),))
-        np.fill_diagonal(S, s)
-
-        U_red = U[:, :self._svd_rank]
-        S_red = S[:self._svd_rank, :self._svd_rank]
-        V_red = V[: , :self._svd_rank]
-        Vt_red = V_red.transpose()
-
-        embedding = self._get_embedding(doc)
-        embedding_red = np.dot(np.dot(embedding, U_red), np.linalg.inv(S_red))   # Q^t . U . S^-1
-        scores = []
-
-        for row in V_red:
-            cosine = np.dot(embedding_red, row) / np.linalg.norm(embedding_red) * np.linalg.norm(row)
-            scores.append(cosine)
-
-        return pd.Series(scores, index=occurence_matrix.columns, name='Similairity')  # Since order of documents is preserved
-
-    def _calculate_svd(self, matrix):
-        array = matrix.to_numpy(dtype='int32')
-        U, S, Vt = np.linalg.svd(array, full_matrices=False)
-        return U, S, Vt
-
-    def _calculate_vocab(self):
-        docstr = ' '.join(self._doclist)
-        doc = self._nlp(docstr)
-        vocab = [token.text for token in doc if token.pos_ in self._POS]
-        return vocab
-
-    def _get_embedding(self, doc: str) -> pd.Series:
-        tokens = [t.text for t in self._nlp(doc)]
-        return pd.Series({v: tokens.count(v) for v in self._vocabulary}, name=doc)
+        if self._U is None or (occurence_matrix is not None and occurence_matrix is not self._fitted_on):
+            self.fit(occurence_matrix)
+
+        docs = [doc] if isinstance(doc, str) else list(doc)
+        queries = _normalize_rows(self.transform(docs))
+        scores = queries @ self._doc_vectors.transpose()
+
+        if isinstance(doc, str):
+            # Since order of documents is preserved
+            return pd.Series(scores[0], index=self._get_labels(), name='Similairity')
+
+        return pd.DataFrame(scores, index=docs, columns=self._get_labels())
+
+    def save(self, path: str):
+        '''
+        ARGS:
+            path: Directory to be created for the model
+
+        Saves a fitted model. The vectors used by queries are saved
+        whole as npy files, so that they are memory mapped as single
+        arrays when loaded. Term counts and documents are saved in
+        segments. Segments already saved by the model, or loaded with
+        it, are hard linked from where they were saved, so only terms
+        and documents added since are written. Trailing segments are
+        merged when they grow to about the size of the segment before
+        them, which keeps the number of segments logarithmic in the
+        number of documents
+        '''
+        if self._U is None or self._fitted_on is not None:
+            raise exceptions.NLPError('Only models fitted on their own documents can be saved')
+
+        self._compact()
+        os.makedirs(path)
+
+        for name, array in (('U', self._U), ('S_inv', self._S_inv), ('doc_vectors', self._doc_vectors)):
+            np.save(os.path.join(path, name + '.npy'), np.asarray(array))
+
+        terms = docs = 0
+
+        for segment in self._segments:
+            target = os.path.join(path, segment.name)
+
+            if segment.path is not None and os.path.isdir(segment.path):
+                _link_tree(segment.path, target)
+            else:
+                self._save_segment(segment, target, terms, docs)
+
+            terms += segment.terms
+            docs += segment.docs
+
+        meta = {
+            'format_version': self.FORMAT_VERSION,
+            'svd_rank': self._svd_rank,
+            'refit_threshold': self._refit_threshold,
+            'fit_id': self._fit_id,
+            'fit_terms': self._fit_terms,
+            'fit_error': float(self._fit_error),
+            'next_segment': self._next_segment,
+            'segments': [s.name for s in self._segments],
+        }
+
+        with open(os.path.join(path, 'meta.json'), 'w', encoding='utf-8') as fd:
+            json.dump(meta, fd)
+
+        self._saved_to(path)
+
+    @classmethod
+    def load(cls, path: str, mmap: bool = True) -> 'LSA':
+        '''
+        ARGS:
+            path: Directory of a saved model
+            mmap: Memory map matrices instead of reading them, so that
+                  processes loading the same model share its pages
+
+        Loads a saved model. Documents are only read when needed
+        '''
+        with open(os.path.join(path, 'meta.json'), encoding='utf-8') as fd:
+            meta = json.load(fd)
+
+        if meta['format_version'] != cls.FORMAT_VERSION:
+            raise exceptions.NLPError('Unsupported model format: {}'.format(meta['format_version']))
+
+        segments, vocabulary, doc_ids = [], [], []
+        mmap_mode = 'r' if mmap else None
+
+        for name in meta['segments']:
+            segment_path = os.path.join(path, name)
+
+            def load_array(array_name):
+                return np.load(os.path.join(segment_path, array_name + '.npy'), mmap_mode=mmap_mode)
+
+            with open(os.path.join(segment_path, 'terms.json'), encoding='utf-8') as fd:
+                vocabulary.extend(json.load(fd))
+
+            with open(os.path.join(segment_path, 'doc_ids.json'), encoding='utf-8') as fd:
+                ids = json.load(fd)
+                doc_ids.extend(ids)
+
+            matrix = csc_matrix(
+                (load_array('matrix_data'), load_array('matrix_indices'), load_array('matrix_indptr')),
+                shape=(len(vocabulary), len(ids))
+            )
+            segments.append(_Segment(
+                name, len(vocabulary) - sum(s.terms for s in segments), matrix, load_array('errors'), path=segment_path
+            ))
+
+        model = cls.__new__(cls)
+        model._doclist = None
+        model._doc_ids = doc_ids
+        model._refit_threshold = meta['refit_threshold']
+        model._tokens = None
+        model._doc_keywords = None
+        model._vocabulary = vocabulary
+        model._vocab_index = {v: i for i, v in enumerate(model._vocabulary)}
+        model._svd_rank = meta['svd_rank']
+        model._matrix = None
+        model._fitted_on = None
+        model._labels = None
+        model._keyword_lists = None
+        model._U = np.load(os.path.join(path, 'U.npy'), mmap_mode=mmap_mode)
+        model._S_inv = np.load(os.path.join(path, 'S_inv.npy'), mmap_mode=mmap_mode)
+        model._doc_vectors = np.load(os.path.join(path, 'doc_vectors.npy'), mmap_mode=mmap_mode)
+        model._fit_terms = meta['fit_terms']
+        model._fit_error = meta['fit_error']
+        model._fit_id = meta['fit_id']
+        model._segments = segments
+        model._next_segment = meta['next_segment']
+        return model
+
+    def _save_segment(self, segment: _Segment, path: str, terms: int, docs: int):
+        # terms and docs are the numbers of terms and documents before the segment
+        os.makedirs(path)
+
+        arrays = {
+            'matrix_data': segment.matrix.data,
+            'matrix_indices': segment.matrix.indices,
+            'matrix_indptr': segment.matrix.indptr,
+            'errors': np.asarray(segment.errors, dtype=np.float64),
+        }
+
+        for name, array in arrays.items():
+            np.save(os.path.join(path, name + '.npy'), np.asarray(array))
+
+        lists = {
+            'terms': self._vocabulary[terms:terms + segment.terms],
+            'doc_ids': self._doc_ids[docs:docs + segment.docs],
+            'documents': segment.documents,
+        }
+
+        for name, values in lists.items():
+            with open(os.path.join(path, name + '.json'), 'w', encoding='utf-8') as fd:
+                json.dump(values, fd)
+
+    def _compact(self):
+        # Merges unsaved segments, and trailing segments of similar size,
+        # so that each segment holds at least half of the documents after it
+        segments = self._segments
+
+        while len(segments) > 1 and (segments[-2].path is None or segments[-2].docs < 2 * segments[-1].docs):
+            last = segments.pop()
+            segments[-1] = segments[-1].merge(last, self._segment_name())
+
+    def _saved_to(self, path: str):
+        # Saved segments are read back from path, so merged parts can be let go
+        for segment in self._segments:
+            segment.path = os.path.join(path, segment.name)
+            segment.parts = []
+
+    def _segment_name(self) -> str:
+        self._next_segment += 1
+        return 'segment-{:06d}'.format(self._next_segment)
+
+    @property
+    def _nlp(self) -> spacy.language.Language:
+        return get_pipeline('tagger')
+
+    def _get_labels(self) -> List:
+        return self._labels if self._labels is not None else self.documents
+
+    def _calculate_svd(self, matrix: csr_matrix):
+        matrix = matrix.astype(np.float64)
+        rank = min(self._svd_rank, *matrix.shape)
+
+        if rank < min(matrix.shape) - 1:
+            U, S, Vt = svds(matrix, k=rank)
+            order = np.argsort(S)[::-1]  # svds does not sort singular values
+            U, S, Vt = U[:, order], S[order], Vt[order]
+        else:  # svds needs rank < min(shape), small matrices are decomposed fully
+            U, S, Vt = np.linalg.svd(matrix.toarray(), full_matrices=False)
+            U, S, Vt = U[:, :rank], S[:rank], Vt[:rank]
+
+        keep = S > _SINGULAR_TOL * max(S.max(initial=0), 1)  # Zero singular values have no inverse
+        return U[:, keep], S[keep], Vt[keep]
+
+    def _get_keyword_lists(self) -> List:
+        if self._keyword_lists is None:
+            self._keyword_lists = [
+                [t.text for t in d if t.pos_ in self._POS]
+                for d in self._nlp.pipe(self._get_labels())
+            ]
+
+        return self._keyword_lists
+
+    def _calculate_vocab(self) -> List:
+        # Tokens are kept so that documents are only tokenized and tagged once
+        self._tokens = []
+        self._doc_keywords = []
+        vocab = OrderedDict()
+
+        for doc in self._nlp.pipe(self._doclist):
+            self._tokens.append([t.text for t in doc])
+            self._doc_keywords.append([t.text for t in doc if t.pos_ in self._POS])
+            vocab.update((t, None) for t in self._doc_keywords[-1])
+
+        return list(vocab)
+
+    def _tokenize(self, docs: List) -> List:
+        return [[t.text for t in d] for d in self._nlp.tokenizer.pipe(docs)]
+
+    def _count_terms(self, token_lists: List) -> csr_matrix:
+        # Terms x documents matrix of term counts, in one pass per document
+        rows, cols, counts = [], [], []
+
+        for j, tokens in enumerate(token_lists):
+            terms = Counter(self._vocab_index[t] for t in tokens if t in self._vocab_index)
+            rows.extend(terms.keys())
+            cols.extend([j] * len(terms))
+            counts.extend(terms.values())
+
+        return csr_matrix(
+            (np.array(counts, dtype=np.int32), (rows, cols)),
+            shape=(len(self._vocabulary), len(token_lists))
+        )
+
+
+def save_model(model: LSA, root: str, keep: int = 2) -> str:
+    '''
+    ARGS:
+        model: Fitted model
+        root: Directory holding model versions
+        keep: Number of versions kept
+
+    RETURNS:
+        Name of the saved version
+
+    Saves a model as a new version and makes it the current one.
+    The model is written before being made current, so readers
+    never see a partly written model
+    '''
+    # Names sort in the order versions were saved, down to the microsecond
+    name = 'v{}-{}-{}'.format(
+        LSA.FORMAT_VERSION, dt.datetime.utcnow().strftime('%Y%m%d%H%M%S%f'), uuid.uuid4().hex[:8]
+    )
+    staging = os.path.join(root, '.' + name)
+
+    model.save(staging)
+    os.rename(staging, os.path.join(root, name))
+    model._saved_to(os.path.join(root, name))  # Later versions link to the renamed segments
+
+    pointer = os.path.join(root, _CURRENT_MODEL)
+    with open(pointer + '.tmp', 'w') as fd:
+        fd.write(name)
+    os.replace(pointer + '.tmp', pointer)
+
+    versions = sorted(v for v in os.listdir(root) if v.startswith('v') and v != name)
+
+    for old in versions[:max(0, len(versions) - keep + 1)]:
+        shutil.rmtree(os.path.join(root, old), ignore_errors=True)
+
+    return name
+
+
+def current_model_version(root: str) -> Optional[str]:
+    '''
+    ARGS:
+        root: Directory holding model versions
+
+    Get the name of the current model version, None if there is none
+    '''
+    try:
+        with open(os.path.join(root, _CURRENT_MODEL)) as fd:
+            return fd.read().strip()
+    except FileNotFoundError:
+        return None
+
+
+def load_model(root: str, mmap: bool = True) -> Optional[LSA]:
+    '''
+    ARGS:
+        root: Directory holding model versions
+        mmap: Memory map the model's matrices
+
+    Loads the current model version, None if there is none
+    '''
+    version = current_model_version(root)
+
+    if version is None:
+        return None
+
+    return LSA.load(os.path.join(root, version), mmap)
+
+
+def _pad_rows(matrix: csc_matrix, rows: int) -> csc_matrix:
+    # Adds empty rows to the bottom of a matrix, without copying its data
+    return csc_matrix((matrix.data, matrix.indices, matrix.indptr), shape=(rows, matrix.shape[1]))
+
+
+def _link_tree(source: str, target: str):
+    # Hard links the files of a folder, copying them where links are not supported
+    os.makedirs(target)
+
+    for name in os.listdir(source):
+        try:
+            os.link(os.path.join(source, name), os.path.join(target, name))
+        except OSError:
+            shutil.copy2(os.path.join(source, name), os.path.join(target, name))
+
+
+def _normalize_rows(matrix: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    return np.divide(matrix, norms, out=np.zeros_like(matrix), where=norms > 0)
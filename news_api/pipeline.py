@@ -0,0 +1,216 @@
+'''
+Staged processing of streams of items.
+
+Each stage runs on its own worker threads and stages are connected
+by bounded queues, so items move on as soon as a stage is done with
+them, and a slow stage holds back the stages feeding it instead of
+letting items pile up in memory
+'''
+
+import time
+import queue
+import logging
+import threading
+from contextlib import nullcontext
+from collections import Counter, defaultdict
+from typing import Callable, Dict, Iterable, Iterator, List, NamedTuple, Optional
+
+from flask import current_app, has_app_context
+
+from . import metrics
+
+
+LOGGER = logging.getLogger(__name__)
+
+_DONE = object()
+
+_POLL_INTERVAL = 0.1  # Seconds between checks for a stopped pipeline
+
+
+class Stage(NamedTuple):
+    '''
+    A pipeline stage.
+
+    func is called with each item and returns the item passed on,
+    None to drop it. With batch_size, func is called with lists of up
+    to batch_size items already waiting and returns a list. workers
+    is the number of threads calling func
+    '''
+    name: str
+    func: Callable
+    workers: int = 1
+    batch_size: Optional[int] = None
+
+
+class Pipeline:
+    '''
+    Runs items through stages in order. Stages run inside the
+    app context of the caller, if any
+    '''
+
+    def __init__(self, stages: List[Stage], queue_size: int = 64):
+        '''
+        ARGS:
+            stages: Stages in the order items go through them
+            queue_size: Maximum number of items waiting for each stage
+        '''
+        self._stages = stages
+        self._queue_size = queue_size
+        self._app = current_app._get_current_object() if has_app_context() else None
+        self._stats = defaultdict(Counter)
+        self._lock = threading.Lock()
+        self._stop = None
+        self._error = None
+
+    @property
+    def stats(self) -> Dict:
+        '''
+        Items received and passed on by each stage,
+        and seconds spent in its func
+        '''
+        with self._lock:
+            return {name: dict(counts) for name, counts in self._stats.items()}
+
+    def run(self, items: Iterable) -> Iterator:
+        '''
+        ARGS:
+            items: Items fed to the first stage
+
+        RETURNS:
+            An iterator of items passed on by the last stage, in the
+            order they are done. Stages stop when it is closed
+
+        Runs items through the stages. The first exception raised by
+        a stage stops all stages and is raised by the iterator
+        '''
+        self._stop = threading.Event()
+        self._error = None
+        queues = [queue.Queue(self._queue_size) for _ in range(len(self._stages) + 1)]
+        threads = [threading.Thread(target=self._feed, args=(items, queues[0]), daemon=True)]
+
+        for i, stage in enumerate(self._stages):
+            consumers = self._stages[i + 1].workers if i + 1 < len(self._stages) else 1
+            remaining = [stage.workers]
+
+            for _ in range(stage.workers):
+                threads.append(threading.Thread(
+                    target=self._work,
+                    args=(stage, queues[i], queues[i + 1], remaining, consumers),
+                    daemon=True
+                ))
+
+        for t in threads:
+            t.start()
+
+        try:
+            while True:
+                item = self._get(queues[-1])
+
+                if item is _DONE:
+                    break
+
+                yield item
+        finally:
+            self._stop.set()
+
+            for t in threads:
+                t.join()
+
+        if self._error is not None:
+            raise self._error
+
+    def _feed(self, items: Iterable, out: queue.Queue):
+        with self._context():
+            try:
+                for item in items:
+                    self._put(out, item)
+            except Exception as err:
+                self._fail(err)
+
+            for _ in range(self._stages[0].workers if self._stages else 1):
+                self._put(out, _DONE)
+
+    def _work(self, stage: Stage, inp: queue.Queue, out: queue.Queue, remaining: List, consumers: int):
+        with self._context():
+            done = False
+
+            while not done:
+                item = self._get(inp)
+
+                if item is _DONE:
+                    break
+
+                batch = [item]
+
+                while stage.batch_size and len(batch) < stage.batch_size:
+                    try:
+                        item = inp.get_nowait()
+                    except queue.Empty:
+                        break
+
+                    if item is _DONE:
+                        done = True
+                        break
+
+                    batch.append(item)
+
+                start = time.perf_counter()
+
+                try:
+                    results = stage.func(batch) if stage.batch_size else [stage.func(batch[0])]
+                except Exception as err:
+                    self._fail(err)
+                    break
+
+                results = [r for r in results if r is not None]
+                seconds = time.perf_counter() - start
+
+                with self._lock:
+                    counts = self._stats[stage.name]
+                    counts['received'] += len(batch)
+                    counts['passed'] += len(results)
+                    counts['seconds'] += seconds
+
+                metrics.STAGE_SECONDS.observe(seconds, stage=stage.name)
+                metrics.STAGE_ITEMS.inc(len(batch), stage=stage.name, direction='received')
+                metrics.STAGE_ITEMS.inc(len(results), stage=stage.name, direction='passed')
+
+                for r in results:
+                    self._put(out, r)
+
+            with self._lock:
+                remaining[0] -= 1
+                last = remaining[0] == 0
+
+            # The last worker of a stage to finish tells the next stage
+            if last:
+                for _ in range(consumers):
+                    self._put(out, _DONE)
+
+    def _get(self, inp: queue.Queue):
+        while not self._stop.is_set():
+            try:
+                return inp.get(timeout=_POLL_INTERVAL)
+            except queue.Empty:
+                pass
+
+        return _DONE
+
+    def _put(self, out: queue.Queue, item):
+        while not self._stop.is_set():
+            try:
+                return out.put(item, timeout=_POLL_INTERVAL)
+            except queue.Full:
+                pass
+
+    def _fail(self, err: Exception):
+        LOGGER.error('Pipeline stage failed: %s', err)
+
+        with self._lock:
+            if self._error is None:
+                self._error = err
+
+        self._stop.set()
+
+    def _context(self):
+        return self._app.app_context() if self._app is not None else nullcontext()
@@ -0,0 +1,264 @@
+'''
+Opt-in profiling of single requests and celery task executions.
+
+A request or task is profiled when PROFILE is set, when it is picked
+by PROFILE_SAMPLE_RATE, or, for requests, when it carries the
+PROFILE_HEADER header and comes from an address in PROFILE_ALLOWED.
+PROFILE_MODE picks cProfile, written as pstats .prof files, or a
+sampling stack profiler, written as folded stacks that flamegraph
+tools read. Profiles go to PROFILE_DIR, by default the profiles folder
+under the instance folder, and the oldest are removed once the folder
+holds more than PROFILE_MAX_BYTES
+'''
+
+import os
+import re
+import sys
+import time
+import random
+import logging
+import cProfile
+import itertools
+import threading
+from collections import Counter
+from contextlib import contextmanager
+from typing import Iterator, Optional
+
+from flask import Flask, g, request
+
+
+LOGGER = logging.getLogger(__name__)
+
+MODES = ('cprofile', 'sample')
+
+_UNSAFE_RE = re.compile(r'[^A-Za-z0-9_.-]+')
+
+
+class StackSampler:
+    '''
+    Records the stack of a thread every interval seconds
+    from a background thread, with little overhead on the thread
+    '''
+
+    suffix = '.folded'
+
+    def __init__(self, interval: float = 0.005, thread_id: Optional[int] = None):
+        '''
+        ARGS:
+            interval: Seconds between samples
+            thread_id: Thread sampled, defaults to the calling thread
+        '''
+        self.interval = interval
+        self.stacks = Counter()
+        self._thread_id = thread_id or threading.get_ident()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def enable(self):
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+        self._thread.start()
+
+    def disable(self):
+        self._stop.set()
+
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def dump_stats(self, path: str):
+        '''
+        ARGS:
+            path: File written
+
+        Writes the samples as folded stacks, one
+        "outermost;...;innermost count" line per stack
+        '''
+        with open(path, 'w') as fd:
+            for stack, count in self.stacks.most_common():
+                fd.write('{} {}\n'.format(stack, count))
+
+    def _sample(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self._thread_id)
+            frames = []
+
+            while frame is not None:
+                code = frame.f_code
+                frames.append('{} ({}:{})'.format(
+                    code.co_name, os.path.basename(code.co_filename), code.co_firstlineno
+                ))
+                frame = frame.f_back
+
+            if frames:
+                self.stacks[';'.join(reversed(frames))] += 1
+
+
+class Profiler:
+    '''
+    Decides what is profiled and writes the profiles of an app
+    '''
+
+    def __init__(
+            self,
+            directory: str,
+            mode: str = 'cprofile',
+            enabled: bool = False,
+            sample_rate: float = 0.0,
+            max_bytes: int = 100 * 2 ** 20,
+            interval: float = 0.005
+    ):
+        '''
+        ARGS:
+            directory: Folder profiles are written to
+            mode: cprofile or sample
+            enabled: Profiles everything if True
+            sample_rate: Fraction of requests and tasks profiled
+            max_bytes: Size of the folder above which the
+                       oldest profiles are removed
+            interval: Seconds between samples in sample mode
+        '''
+        if mode not in MODES:
+            raise ValueError('Unknown profiling mode {}, expected one of {}'.format(mode, ', '.join(MODES)))
+
+        self.directory = directory
+        self.mode = mode
+        self.enabled = enabled
+        self.sample_rate = sample_rate
+        self.max_bytes = max_bytes
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._count = itertools.count()
+
+    def wanted(self, forced: bool = False) -> bool:
+        '''
+        ARGS:
+            forced: Whether profiling was asked for, such as by a header
+
+        Whether the next request or task should be profiled
+        '''
+        return forced or self.enabled or (self.sample_rate > 0 and random.random() < self.sample_rate)
+
+    def start(self):
+        '''
+        RETURNS:
+            A running profiler of the calling thread, None if it
+            cannot be started, such as when another one is running
+        '''
+        profiler = cProfile.Profile() if self.mode == 'cprofile' else StackSampler(self.interval)
+
+        try:
+            profiler.enable()
+        except ValueError as err:
+            LOGGER.warning('Profiling skipped: %s', err)
+            return None
+
+        return profiler
+
+    def stop(self, profiler, kind: str, name: str) -> Optional[str]:
+        '''
+        ARGS:
+            profiler: Profiler returned by start
+            kind: request or task
+            name: Endpoint or task name
+
+        RETURNS:
+            Path of the profile written, None if writing failed
+
+        Files are named after the time, process and a count of the
+        profiles of the process, so that profiles of the same
+        second do not overwrite each other
+        '''
+        profiler.disable()
+        suffix = getattr(profiler, 'suffix', '.prof')
+        filename = '{}-{}-{}-{}-{}{}'.format(
+            kind, _UNSAFE_RE.sub('_', name), time.strftime('%Y%m%dT%H%M%S'), os.getpid(), next(self._count), suffix
+        )
+        path = os.path.join(self.directory, filename)
+
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            profiler.dump_stats(path)
+        except OSError as err:
+            LOGGER.warning('Could not write profile %s: %s', path, err)
+            return None
+
+        self.rotate()
+        return path
+
+    @contextmanager
+    def profile(self, kind: str, name: str, forced: bool = False) -> Iterator:
+        '''
+        ARGS:
+            kind: request or task
+            name: Endpoint or task name
+            forced: Whether profiling was asked for
+
+        Profiles the with block if wanted
+        '''
+        profiler = self.start() if self.wanted(forced) else None
+
+        try:
+            yield
+        finally:
+            if profiler is not None:
+                self.stop(profiler, kind, name)
+
+    def rotate(self):
+        '''
+        Removes the oldest profiles until the folder
+        holds no more than max_bytes
+        '''
+        with self._lock:
+            try:
+                entries = [e for e in os.scandir(self.directory) if e.is_file()]
+                files = sorted((e.stat().st_mtime, e.stat().st_size, e.path) for e in entries)
+            except OSError:
+                return
+
+            total = sum(size for _, size, _ in files)
+
+            for _, size, path in files:
+                if total <= self.max_bytes:
+                    break
+
+                try:
+                    os.remove(path)
+                except OSError:
+                    continue
+
+                total -= size
+
+
+def get_profiler(app: Flask) -> Profiler:
+    return app.extensions['profiler']
+
+
+def init_app(app: Flask):
+    '''
+    Adds the profiler of the app and profiles requests that want it
+    '''
+    profiler = app.extensions['profiler'] = Profiler(
+        app.config.get('PROFILE_DIR') or os.path.join(app.instance_path, 'profiles'),
+        mode=app.config.get('PROFILE_MODE', 'cprofile'),
+        enabled=app.config.get('PROFILE', False),
+        sample_rate=app.config.get('PROFILE_SAMPLE_RATE', 0.0),
+        max_bytes=app.config.get('PROFILE_MAX_BYTES', 100 * 2 ** 20),
+        interval=app.config.get('PROFILE_SAMPLE_INTERVAL', 0.005)
+    )
+    header = app.config.get('PROFILE_HEADER', 'X-Profile')
+    allowed = set(app.config.get('PROFILE_ALLOWED', ()))
+
+    @app.before_request
+    def start_profiler():
+        forced = bool(request.headers.get(header)) and request.remote_addr in allowed
+
+        if profiler.wanted(forced):
+            g.profiler = profiler.start()
+
+    @app.teardown_request
+    def stop_profiler(_):
+        running = g.pop('profiler', None)
+
+        if running is not None:
+            profiler.stop(running, 'request', request.endpoint or 'unknown')
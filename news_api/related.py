@@ -0,0 +1,236 @@
+'''
+Nearest neighbour index over lsa document vectors, used to
+find stories related to a saved story.
+
+Vectors are scored in blocks so memory stays bounded for large
+corpora. Random projection locality sensitive hashing can be
+enabled to only score stories sharing a hash bucket with the query
+'''
+
+import os
+import threading
+from typing import Iterable, List, Optional, Tuple
+
+import numpy as np
+from flask import current_app
+
+from . import exceptions, nlp
+
+
+_INDEX = ((None, None, None), None)  # (root, version, fit id) of the model indexed, index
+
+_INDEX_LOCK = threading.Lock()
+
+
+class NeighbourIndex:
+    '''
+    Cosine similarity top k search over document vectors
+    '''
+
+    def __init__(
+            self,
+            vectors: np.ndarray,
+            ids: Iterable,
+            block_size: int = 16384,
+            lsh_bits: Optional[int] = None,
+            lsh_tables: int = 4,
+            seed: int = 0
+    ):
+        '''
+        ARGS:
+            vectors: One row per document
+            ids: Identifiers of the documents
+            block_size: Number of vectors scored at once
+            lsh_bits: Hash bits per table, None for exact search
+            lsh_tables: Number of hash tables, more tables find more
+                        neighbours at the cost of scoring more stories
+            seed: Seed of the random projections
+        '''
+        self._ids = list(ids)
+        self._positions = {doc_id: i for i, doc_id in enumerate(self._ids)}
+        self._vectors = _unit_rows(vectors)
+        self._block_size = block_size
+        self._planes = None
+        self._tables = []
+
+        if lsh_bits:
+            rng = np.random.default_rng(seed)
+            self._planes = rng.standard_normal((lsh_tables, self._vectors.shape[1], lsh_bits)).astype(np.float32)
+            self._weights = 1 << np.arange(lsh_bits, dtype=np.int64)
+            self._tables = [{} for _ in range(lsh_tables)]
+            self._add_to_tables(np.arange(len(self._vectors)))
+
+    @classmethod
+    def from_model(cls, model: nlp.LSA, **kwargs) -> 'NeighbourIndex':
+        '''
+        ARGS:
+            model: Fitted lsa model
+            kwargs: Passed on to the index
+        '''
+        return cls(model.doc_vectors, model.doc_ids, **kwargs)
+
+    def extended(self, vectors: np.ndarray, ids: Iterable) -> 'NeighbourIndex':
+        '''
+        ARGS:
+            vectors: One row per added document
+            ids: Identifiers of the added documents
+
+        RETURNS:
+            A new index with the documents added, leaving this one
+            unchanged for queries still running on it. Only the added
+            vectors are normalized and hashed
+        '''
+        index = self.__class__.__new__(self.__class__)
+        index.__dict__.update(self.__dict__)
+        added = _unit_rows(vectors)
+        start = len(self._ids)
+
+        index._ids = self._ids + list(ids)
+        index._positions = dict(self._positions)
+        index._positions.update((doc_id, start + i) for i, doc_id in enumerate(index._ids[start:]))
+        index._vectors = np.concatenate([self._vectors, added])
+        index._tables = [dict(t) for t in self._tables]
+
+        if index._planes is not None:
+            index._add_to_tables(np.arange(start, len(index._vectors)))
+
+        return index
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+    def __contains__(self, doc_id) -> bool:
+        return doc_id in self._positions
+
+    def query(self, vector: np.ndarray, k: int = 10, exclude: Optional[int] = None) -> List[Tuple]:
+        '''
+        ARGS:
+            vector: Query vector in the lsa space
+            k: Number of neighbours
+            exclude: Position of a document left out of the results
+
+        RETURNS:
+            A list of (id, score) tuples, most similar first
+        '''
+        vector = np.asarray(vector, dtype=np.float32).ravel()
+        norm = np.linalg.norm(vector)
+
+        if norm == 0 or k <= 0:
+            return []
+
+        vector = vector / norm
+        candidates = self._candidates(vector)
+
+        if candidates is not None and len(candidates) > k:
+            positions, scores = self._top_k(candidates, self._vectors[candidates] @ vector, k, exclude)
+        else:
+            positions, scores = self._top_k_blocked(vector, k, exclude)
+
+        return [(self._ids[p], float(s)) for p, s in zip(positions, scores)]
+
+    def related(self, doc_id, k: int = 10) -> List[Tuple]:
+        '''
+        ARGS:
+            doc_id: Identifier of an indexed document
+            k: Number of neighbours
+
+        RETURNS:
+            A list of (id, score) tuples of the documents most
+            similar to doc_id, most similar first
+        '''
+        position = self._positions[doc_id]
+        return self.query(self._vectors[position], k, exclude=position)
+
+    def _add_to_tables(self, positions: np.ndarray):
+        for table, codes in zip(self._tables, self._hash(self._vectors[positions])):
+            order = np.argsort(codes, kind='stable')
+            keys, starts = np.unique(codes[order], return_index=True)
+
+            for key, bucket in zip(keys.tolist(), np.split(positions[order], starts[1:])):
+                table[key] = np.concatenate([table[key], bucket]) if key in table else bucket
+
+    def _hash(self, vectors: np.ndarray) -> List:
+        return [((vectors @ planes) > 0) @ self._weights for planes in self._planes]
+
+    def _candidates(self, vector: np.ndarray) -> Optional[np.ndarray]:
+        if self._planes is None:
+            return None
+
+        codes = self._hash(vector[np.newaxis])
+        buckets = [table.get(int(code[0])) for table, code in zip(self._tables, codes)]
+        buckets = [b for b in buckets if b is not None]
+        return np.unique(np.concatenate(buckets)) if buckets else None
+
+    def _top_k_blocked(self, vector: np.ndarray, k: int, exclude: Optional[int]) -> Tuple:
+        best_positions = np.empty(0, dtype=np.int64)
+        best_scores = np.empty(0, dtype=np.float32)
+
+        for start in range(0, len(self._vectors), self._block_size):
+            block = self._vectors[start:start + self._block_size]
+            positions = np.arange(start, start + len(block))
+            positions, scores = self._top_k(positions, block @ vector, k, exclude)
+            best_positions = np.concatenate([best_positions, positions])
+            best_scores = np.concatenate([best_scores, scores])
+
+        return self._top_k(best_positions, best_scores, k)
+
+    @staticmethod
+    def _top_k(positions: np.ndarray, scores: np.ndarray, k: int, exclude: Optional[int] = None) -> Tuple:
+        if exclude is not None:
+            keep = positions != exclude
+            positions, scores = positions[keep], scores[keep]
+
+        if len(scores) > k:
+            top = np.argpartition(-scores, k - 1)[:k]
+            positions, scores = positions[top], scores[top]
+
+        order = np.argsort(-scores, kind='stable')
+        return positions[order], scores[order]
+
+
+def get_index() -> Optional[NeighbourIndex]:
+    '''
+    Get an index of the current saved lsa model, None if no model
+    is saved. When a newer model is saved, the documents folded into
+    it are added to the index, which is only rebuilt after a refit.
+
+    RELATED_LSH_BITS enables hashing, with RELATED_LSH_TABLES tables
+    '''
+    global _INDEX
+
+    root = os.path.join(current_app.instance_path, nlp.MODEL_DIR)
+    version = nlp.current_model_version(root)
+
+    if version is None:
+        return None
+
+    with _INDEX_LOCK:
+        (cached_root, cached_version, fit_id), index = _INDEX
+
+        if (cached_root, cached_version) == (root, version):
+            return index
+
+        try:
+            model = nlp.LSA.load(os.path.join(root, version))
+        except (OSError, exceptions.NLPError) as err:
+            current_app.logger.error('Could not load lsa model %s: %s', version, err)
+            return index
+
+        # Vectors of documents already indexed only change when the model is refitted
+        if cached_root == root and fit_id == model.fit_id and len(model.doc_ids) >= len(index):
+            index = index.extended(model.doc_vectors[len(index):], model.doc_ids[len(index):])
+        else:
+            index = NeighbourIndex.from_model(
+                model,
+                lsh_bits=current_app.config.get('RELATED_LSH_BITS'),
+                lsh_tables=current_app.config.get('RELATED_LSH_TABLES', 4)
+            )
+
+        _INDEX = ((root, version, model.fit_id), index)
+        return index
+
+
+def _unit_rows(vectors: np.ndarray) -> np.ndarray:
+    vectors = np.array(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return np.divide(vectors, norms, out=vectors, where=norms > 0)
@@ -2,26 +2,82 @@
 Sets up application endpoints
 '''
 
-import os
+import gzip
 import json
+import zlib
+import hashlib
 import datetime as dt
+from typing import Iterator
 
-import pandas as pd
-from flask import current_app
-from flask_restful import Resource, reqparse
+from flask import current_app, request
+from flask_restful import Resource, abort, reqparse
 
-from . import db, news, constants
+from . import cache, db, metrics, news, constants, related
+
+
+MAX_PAGE_SIZE = 1000
+
+MAX_RELATED = 100
+
+NDJSON_MIMETYPES = ('application/x-ndjson', 'application/jsonlines')
+
+STORY_FIELDS = ('title', 'text', 'dated')
+
+
+def _date(value: str) -> dt.date:
+    return dt.datetime.strptime(value, constants.DATE_FMT).date()
+
+
+def _read_ndjson() -> Iterator:
+    # Reads the request body a line at a time, decompressing as it goes
+    stream = request.stream
+
+    if request.content_encoding == 'gzip':
+        stream = gzip.GzipFile(fileobj=stream, mode='rb')
+
+    for number, line in enumerate(stream, start=1):
+        if not line.strip():
+            continue
+
+        try:
+            story = json.loads(line)
+        except ValueError:
+            raise ValueError('Invalid json on line {}'.format(number))
+
+        if not isinstance(story, dict) or any(not isinstance(story.get(f), str) for f in STORY_FIELDS):
+            raise ValueError('Line {} is not a story with {}'.format(number, ', '.join(STORY_FIELDS)))
+
+        yield story
 
 
 Parser = reqparse.RequestParser()
 
 Parser.add_argument('news_data')
 
+ListParser = reqparse.RequestParser()
+
+ListParser.add_argument('from', type=_date, location='args', required=True)
+ListParser.add_argument('to', type=_date, location='args')
+ListParser.add_argument('after_id', type=int, location='args')
+ListParser.add_argument('limit', type=int, location='args', default=100)
+
+RelatedParser = reqparse.RequestParser()
+
+RelatedParser.add_argument('limit', type=int, location='args', default=10)
+
+SearchParser = reqparse.RequestParser()
+
+SearchParser.add_argument('q', location='args', required=True)
+SearchParser.add_argument('limit', type=int, location='args', default=20)
+SearchParser.add_argument('offset', type=int, location='args', default=0)
+
 
 class DailyNews(Resource):
     '''
     Daily news data resource.
-    Performs on the fly nlp operations
+    Locations mentioned are found when stories are saved.
+    Responses are cached until news is saved, and clients polling
+    with If-None-Match get 304 responses while nothing has changed
     '''
 
     def get(self):
@@ -32,23 +88,27 @@ class DailyNews(Resource):
         Gets all saved news from db
         '''
         today = dt.datetime.now().date()
-        today_news = news.get_news_from_db(today)
-        today_news = self._add_location_data(today_news)
-        return today_news
+        key = 'latest:{}:{}:{}'.format(
+            today.strftime(constants.DATE_FMT),
+            news.get_latest_id(),
+            cache.generation()
+        )
+        etag = hashlib.sha1(key.encode('utf-8')).hexdigest()
+
+        if etag in request.if_none_match:
+            resp = current_app.response_class(status=304)
+        else:
+            body = cache.get(key)
+
+            if body is None:
+                body = json.dumps(news.get_news_from_db(today)).encode('utf-8')
+                cache.store(key, body)
 
-    @staticmethod
-    def _add_location_data(news_data):
-        instance_path = current_app.instance_path
-        geo_file = os.path.join(instance_path, 'geodata.csv')
-        geo_db = pd.read_csv(geo_file)
+            resp = current_app.response_class(body, mimetype='application/json')
 
-        return [
-            {
-                'locations_mentioned': news.get_locations_mentioned(n['text'], geo_db),
-                **n
-            }
-            for n in news_data
-        ]
+        resp.set_etag(etag)
+        resp.cache_control.no_cache = True
+        return resp
 
 
 class News(Resource):
@@ -57,11 +117,102 @@ class News(Resource):
     to the database
     '''
 
+    def get(self):
+        '''
+        RETURNS:
+            A page of news stories and the after_id of the next page,
+            None on the last page
+
+        Lists news saved between the from and to dates, paginated
+        by passing the returned next_after_id as after_id
+        '''
+        args = ListParser.parse_args()
+        limit = max(1, min(args['limit'], MAX_PAGE_SIZE))
+        stories = news.list_news(
+            args['from'],
+            args['to'] or args['from'],
+            after_id=args['after_id'],
+            limit=limit
+        )
+        next_after_id = stories[-1]['id'] if len(stories) == limit else None
+        return {'news': stories, 'next_after_id': next_after_id}
+
     def post(self):
         '''
-        Inserts a list of news stories into the db
+        RETURNS:
+            Counts of stories inserted, skipped and failed
+
+        Inserts news stories into the db, either a json list in the
+        news_data form field or an ndjson body, optionally gzip
+        compressed. ndjson bodies are saved in chunks while they are
+        read, so chunks read before an invalid line are kept
+        '''
+        if request.mimetype not in NDJSON_MIMETYPES:
+            args = Parser.parse_args()
+            json_data = args['news_data']
+            data = json.loads(json_data)
+            return news.save_news_to_db(data)._asdict()
+
+        try:
+            result = news.ingest_stories(_read_ndjson(), current_app.config.get('INGEST_CHUNK_SIZE', 500))
+        except (ValueError, OSError, EOFError, zlib.error) as err:
+            abort(400, message='Could not read news: {}'.format(err))
+
+        return result._asdict()
+
+
+class RelatedNews(Resource):
+    '''
+    Stories most similar to a saved story, found with the
+    latest lsa model. Stories saved since the model was last
+    updated are not found until the next update
+    '''
+
+    def get(self, news_id: int):
+        '''
+        ARGS:
+            news_id: Id of a saved story
+
+        RETURNS:
+            The related stories, most similar first, with
+            their similarity scores
         '''
-        args = Parser.parse_args()
-        json_data = args['news_data']
-        data = json.loads(json_data)
-        news.save_news_to_db(data)
+        args = RelatedParser.parse_args()
+        limit = max(1, min(args['limit'], MAX_RELATED))
+        index = related.get_index()
+
+        if index is None or news_id not in index:
+            abort(404, message='No related news for story {}'.format(news_id))
+
+        scores = dict(index.related(news_id, limit))
+        stories = news.get_stories(list(scores))
+        return {'news_id': news_id, 'related': [{'score': scores[s['id']], **s} for s in stories]}
+
+
+class Search(Resource):
+    '''
+    Full text search of saved stories
+    '''
+
+    def get(self):
+        '''
+        RETURNS:
+            A page of stories containing all the keywords in q,
+            best match first, and the offset of the next page,
+            None on the last page
+        '''
+        args = SearchParser.parse_args()
+        limit = max(1, min(args['limit'], MAX_PAGE_SIZE))
+        offset = max(0, args['offset'])
+        stories = news.search_news(args['q'], limit=limit, offset=offset)
+        next_offset = offset + limit if len(stories) == limit else None
+        return {'news': stories, 'next_offset': next_offset}
+
+
+class Metrics(Resource):
+    '''
+    Metrics of the api and workers in the prometheus text format
+    '''
+
+    def get(self):
+        return current_app.response_class(metrics.render(), content_type=metrics.CONTENT_TYPE)
@@ -0,0 +1,90 @@
+'''
+Redis backed record of recently ingested stories, shared by all
+workers so stories polled again are not ingested twice
+'''
+
+import time
+import logging
+from typing import List
+
+from redis import Redis, RedisError
+
+from . import news
+
+
+LOGGER = logging.getLogger(__name__)
+
+
+class SeenStories:
+    '''
+    Digests of ingested stories kept in a redis sorted set scored
+    by the time they were seen. Entries expire after ttl seconds,
+    so memory stays bounded by the number of stories seen within ttl.
+    Redis errors are logged and every story is treated as unseen, the
+    links recorded in the database still keep stories from repeating
+    '''
+
+    def __init__(self, client: Redis, key: str = 'news-api:seen', ttl: int = 7 * 86400):
+        '''
+        ARGS:
+            client: Redis client
+            key: Key of the sorted set
+            ttl: Seconds a story is remembered for
+        '''
+        self._client = client
+        self._key = key
+        self._ttl = ttl
+
+    def unseen(self, stories: List) -> List:
+        '''
+        ARGS:
+            stories: Story dicts
+
+        RETURNS:
+            Stories not seen within ttl, in order, without
+            repeats of the same story
+        '''
+        digests = [news.story_digest(s) for s in stories]
+        pipe = self._client.pipeline(transaction=False)
+
+        for d in digests:
+            pipe.zscore(self._key, d)
+
+        expired = time.time() - self._ttl
+
+        try:
+            scores = pipe.execute()
+        except RedisError as err:
+            LOGGER.warning('Seen stories lookup failed: %s', err)
+            scores = [None] * len(digests)
+
+        seen = {d for d, score in zip(digests, scores) if score is not None and score > expired}
+        result = []
+
+        for d, story in zip(digests, stories):
+            if d not in seen:
+                seen.add(d)
+                result.append(story)
+
+        return result
+
+    def add(self, stories: List):
+        '''
+        ARGS:
+            stories: Story dicts
+
+        Marks stories as seen and drops expired entries
+        '''
+        now = time.time()
+        pipe = self._client.pipeline()
+
+        if stories:
+            pipe.zadd(self._key, {news.story_digest(s): now for s in stories})
+
+        pipe.zremrangebyscore(self._key, '-inf', now - self._ttl)
+        pipe.expire(self._key, self._ttl)
+
+        try:
+            pipe.execute()
+        except RedisError as err:
+            LOGGER.warning('Recording seen stories failed: %s', err)
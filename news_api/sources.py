@@ -0,0 +1,92 @@
+'''
+Registry of news sources polled for stories
+'''
+
+import threading
+from collections import OrderedDict
+from typing import Callable, NamedTuple, Optional
+
+from . import constants, db, fetch, news
+
+
+class Source(NamedTuple):
+    '''
+    A news source.
+
+    ingester is called with the feed url, a fetcher, a link store and
+    a record of seen stories, and saves stories as they are fetched,
+    returning the counts of stories saved. schedule is the number of
+    seconds between polls, None uses UPDATE_NEWS_PERIOD. rate_limit
+    is the number of requests per second allowed to each host
+    '''
+    name: str
+    feed_url: str
+    ingester: Callable = news.ingest_news_reuters
+    schedule: Optional[float] = None
+    rate_limit: Optional[float] = 4.0
+
+
+SOURCES = OrderedDict()
+
+_FETCHERS = {}
+
+_FETCHERS_LOCK = threading.Lock()
+
+
+def register(source: Source) -> Source:
+    '''
+    ARGS:
+        source: Source to be polled
+
+    Adds a source to the registry, replacing any source with the same name
+    '''
+    SOURCES[source.name] = source
+
+    with _FETCHERS_LOCK:
+        _FETCHERS.pop(source.name, None)
+
+    return source
+
+
+def get_source(name: str) -> Source:
+    '''
+    ARGS:
+        name: Source name
+
+    Get a registered source
+    '''
+    try:
+        return SOURCES[name]
+    except KeyError:
+        raise ValueError('Unknown news source: {}'.format(name))
+
+
+def get_fetcher(name: str) -> fetch.Fetcher:
+    '''
+    ARGS:
+        name: Source name
+
+    Get the fetcher of a source, limited to the source's rate
+    '''
+    with _FETCHERS_LOCK:
+        if name not in _FETCHERS:
+            _FETCHERS[name] = fetch.Fetcher(rate=get_source(name).rate_limit)
+
+        return _FETCHERS[name]
+
+
+def ingest(name: str, store: Optional[news.LinkStore] = None, seen=None) -> db.SaveResult:
+    '''
+    ARGS:
+        name: Source name
+        store: Fetch history of the source's feed and stories
+        seen: Recently ingested stories, such as seen.SeenStories
+
+    Saves new stories from a source as they are fetched
+    '''
+    source = get_source(name)
+    return source.ingester(source.feed_url, get_fetcher(name), store, seen)
+
+
+for _name, _url in constants.FEED_URLS.items():
+    register(Source(_name, _url))
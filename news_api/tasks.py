@@ -2,19 +2,24 @@
 Initializes tasks to be run with celery
 '''
 
-import json
-import pickle
-from typing import List
+import os
+import time
+from typing import Dict, List, Optional
+from collections import Counter, defaultdict
 
-import requests
+from celery import chord, group
 from flask import current_app
-from celery.schedules import crontab
 
 from . import (
     create_app,
     create_celery,
+    db,
     exceptions,
-    news
+    metrics,
+    news,
+    nlp,
+    seen,
+    sources
 )
 
 
@@ -25,7 +30,16 @@ CELERY = create_celery(APP, celery_name='celery')
 
 @CELERY.on_after_configure.connect
 def setup_tasks(sender, **kwargs):
-    sender.add_periodic_task(APP.config['UPDATE_NEWS_PERIOD'], update_news_reuters, name='update-news-reuters')
+    # Sources polled on the same schedule are fanned out together
+    schedules = defaultdict(list)
+
+    for source in sources.SOURCES.values():
+        schedules[source.schedule or APP.config['UPDATE_NEWS_PERIOD']].append(source.name)
+
+    for period, names in schedules.items():
+        sender.add_periodic_task(period, update_news.s(names), name='update-news-{}'.format(period))
+
+    sender.add_periodic_task(APP.config.get('LSA_REFIT_PERIOD', 86400), refit_lsa_model, name='refit-lsa-model')
 
 
 class NewsTask(CELERY.Task):
@@ -40,15 +54,14 @@ class NewsTask(CELERY.Task):
     def __init__(self):
         super().__init__()
         self._exception_count = 0
-        self._cache['NEWS'] = bytes()
 
     def __call__(self, *args, **kwargs):
         # Retry multiple times in case of exception before failing
         while True:
             try:
-                super().__call__(*args, **kwargs)
+                result = super().__call__(*args, **kwargs)
                 self._exception_count = 0
-                break
+                return result
             except exceptions.NewsApiError as err:
                 if self._exception_count == self._EXCEPTION_THRESHOLD:
                     current_app.logger.error('Maximum tries exceeded')
@@ -56,42 +69,175 @@ class NewsTask(CELERY.Task):
                     break
                 else:
                     self._exception_count += 1
+                    metrics.TASK_RETRIES.inc(task=self.name)
                     current_app.logger.warning('Failed, retrying in %s seconds', self._RETRY_IN)
                     time.sleep(self._RETRY_IN)
 
     @property
-    def cached_news(self):
+    def seen_stories(self) -> seen.SeenStories:
+        '''
+        Stories ingested within SEEN_STORY_TTL seconds
+        '''
+        return seen.SeenStories(self._cache, ttl=APP.config.get('SEEN_STORY_TTL', 7 * 86400))
+
+
+@CELERY.task
+def update_news(names: Optional[List] = None):
+    '''
+    ARGS:
+        names: Sources to be polled, defaults to all registered sources
+
+    Polls sources in parallel, one task per source, and
+    ingests their stories together once all have finished
+    '''
+    names = names or list(sources.SOURCES)
+    APP.logger.info('Polling %s source(s)...', len(names))
+    result = chord(group(poll_source.s(n) for n in names))(ingest_news.s())
+    return result.id
+
+
+@CELERY.task
+def update_news_reuters():
+    '''
+    Get latest news data from reuters
+    '''
+    return update_news(['reuters'])
+
+
+@CELERY.task(bind=True, base=NewsTask)
+def poll_source(self, name: str) -> Dict:
+    '''
+    ARGS:
+        name: Source name
+
+    Saves new stories from a source as they are downloaded,
+    skipping stories recently ingested
+    '''
+    APP.logger.info('Downloading news from %s...', name)
+    result = sources.ingest(name, news.LinkStore(db.get_db()), self.seen_stories)
+    return result._asdict()
+
+
+@CELERY.task(bind=True, base=NewsTask)
+def ingest_news(self, results: List):
+    '''
+    ARGS:
+        results: Counts of stories saved from each polled source,
+                 None for sources that failed
+
+    Updates the lsa model once all sources are polled
+    '''
+    totals = Counter()
+
+    for r in results:
+        totals.update(r or {})
+
+    APP.logger.info(
+        'Saved %s stories, skipped %s, failed %s from %s source(s)',
+        totals['inserted'], totals['skipped'], totals['failed'], len(results)
+    )
+
+    if totals['inserted']:
+        update_lsa_model.delay()
+
+
+class ModelTask(CELERY.Task):
+    '''
+    Tasks maintaining the lsa model of saved stories.
+    The model is saved under the instance folder and memory
+    mapped by each worker process, which reloads it when
+    another process saves a newer version
+    '''
+
+    lsa_model = None
+
+    lsa_version = None
+
+    @property
+    def model_root(self) -> str:
+        return os.path.join(APP.instance_path, nlp.MODEL_DIR)
+
+    def load_model(self) -> Optional[nlp.LSA]:
         '''
-        Gets news dat stored in cache
+        Get the current saved model, reloaded if a newer version was saved
         '''
-        try:
-            news_data = pickle.loads(self._cache['NEWS'])
-        except EOFError:
-            news_data = {}
+        version = nlp.current_model_version(self.model_root)
 
-        return news_data
+        if version is not None and version != ModelTask.lsa_version:
+            APP.logger.info('Loading lsa model %s...', version)
+
+            try:
+                ModelTask.lsa_model = nlp.LSA.load(os.path.join(self.model_root, version))
+            except exceptions.NLPError as err:  # Such as a model saved in an older format
+                APP.logger.warning('Could not load lsa model %s, rebuilding: %s', version, err)
+                return None
 
-    def save_news(self, news_data: List):
+            ModelTask.lsa_version = version
+
+        return ModelTask.lsa_model
+
+    def save_model(self):
         '''
-        Saves a list of dicts as bytes into redis
+        Saves the model as a new version
         '''
-        pck = pickle.dumps(news_data)
-        self._cache['NEWS'] = pck
+        os.makedirs(self.model_root, exist_ok=True)
+        ModelTask.lsa_version = nlp.save_model(ModelTask.lsa_model, self.model_root, APP.config.get('LSA_KEEP', 2))
 
+    def build_model(self) -> Optional[nlp.LSA]:
+        '''
+        Fits a model on all saved stories
+        '''
+        stories = news.get_stories_after()
 
-@CELERY.task(bind=True, base=NewsTask)
-def update_news_reuters(self):
+        if not stories:
+            return None
+
+        model = nlp.LSA(
+            [s['text'] for s in stories],
+            svd_rank=APP.config.get('LSA_RANK', 100),
+            doc_ids=[s['id'] for s in stories],
+            refit_threshold=APP.config.get('LSA_REFIT_THRESHOLD', 0.1)
+        )
+        ModelTask.lsa_model = model.fit()
+        self.save_model()
+        return ModelTask.lsa_model
+
+
+@CELERY.task(bind=True, base=ModelTask)
+def update_lsa_model(self):
     '''
-    Get latest news data from reuters
+    Folds stories saved since the last update into the lsa model,
+    refitting it if they are poorly represented
     '''
-    APP.logger.info('Getting cached news...')
-    previous = self.cached_news
+    model = self.load_model()
+
+    if model is None:
+        self.build_model()
+        return
 
-    APP.logger.info('Downloading news from reuters...')
-    new_news = news.get_news_reuters()
-    self.save_news(new_news)
+    stories = news.get_stories_after(max(model.doc_ids, default=None))
+
+    if stories:
+        error = model.fold_in([s['text'] for s in stories], [s['id'] for s in stories])
+        APP.logger.info('Folded %s stories into lsa model, error %.3f', len(stories), error)
+
+    if model.needs_refit:
+        APP.logger.info('Refitting lsa model...')
+        model.fit()
+
+    if stories:
+        self.save_model()
+
+
+@CELERY.task(bind=True, base=ModelTask)
+def refit_lsa_model(self):
+    '''
+    Refits the lsa model on all stories added to it
+    '''
+    model = self.load_model()
 
-    prev_titles = set([n['title'] for n in previous])
-    updates = [s for s in new_news if s['title'] not in prev_titles]
-    APP.logger.info('Saving news to db...')
-    requests.post('{}/news'.format(APP.config['APP_HOST']), data={'news_data': json.dumps(updates)})
+    if model is None:
+        self.build_model()
+    else:
+        model.fit()
+        self.save_model()
@@ -33,9 +33,10 @@ def news_data(data_path):
 def app():
     db_fd, db_path = tempfile.mkstemp()
 
-    app = create_app({
+    app = create_app(test_config={
         'TESTING': True,
-        'DATABASE': db_path
+        'DATABASE': db_path,
+        'METRICS_DIR': None
     })
 
     with app.app_context():
@@ -43,6 +44,7 @@ def app():
 
     yield app
 
+    db.get_manager(app).close_all()
     os.close(db_fd)
     os.unlink(db_path)
 
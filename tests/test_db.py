@@ -0,0 +1,188 @@
+'''
+Test database operations
+'''
+
+import sqlite3
+import threading
+
+import pytest
+
+from news_api import db, constants, exceptions
+
+
+OLD_SCHEMA = \
+    '''
+    DROP TABLE IF EXISTS news_locations;
+    DROP TABLE IF EXISTS news;
+
+    CREATE TABLE news
+    (
+     id INTEGER PRIMARY KEY AUTOINCREMENT,
+     title TEXT NOT NULL,
+     text TEXT NOT NULL,
+     dated TEXT NOT NULL
+    );
+
+    PRAGMA user_version = 0;
+    '''
+
+
+def test_init_db_is_current(app):
+    with app.app_context():
+        assert db.migrate_db() == 0
+
+
+def test_migrate_db(app):
+    with app.app_context():
+        conn = db.get_db()
+        conn.executescript(OLD_SCHEMA)
+        conn.execute("INSERT INTO news (title, text, dated) VALUES ('a', 'b', '20200101')")
+
+        assert db.migrate_db() == len(constants.MIGRATIONS)
+        rows = db.read_all('news', conn)
+        assert rows[0]['located'] == 0
+        assert db.read_all('news_locations', conn) == []
+        assert len(db.read_match('news', conn, 'news_fts', 'b')) == 1
+
+
+def test_read_update_where_in(app):
+    with app.app_context():
+        conn = db.get_db()
+        rows = [{'title': str(i), 'text': 'text', 'dated': '20200101'} for i in range(1500)]
+        db.save('news', conn, rows)
+        ids = [r['id'] for r in db.read_all('news', conn)]
+        assert len(db.read_where_in('news', conn, 'id', ids)) == 1500
+        assert len(db.read_where_in('news', conn, 'id', ids, limit=10)) == 10
+
+        db.update_where_in('news', conn, {'located': 1}, 'id', ids[:1200])
+        assert len(db.read_where_in('news', conn, 'located', [0])) == 300
+
+
+def test_read_range(app):
+    with app.app_context():
+        conn = db.get_db()
+        rows = [{'title': str(i), 'text': 'text', 'dated': '2020010{}'.format(i % 3 + 1)} for i in range(30)]
+        db.save('news', conn, rows)
+
+        assert len(db.read_range('news', conn, 'dated', '20200101')) == 10
+        assert len(db.read_range('news', conn, 'dated', '20200102', '20200103')) == 20
+
+        page = db.read_range('news', conn, 'dated', '20200101', '20200103', columns=['id'], limit=12)
+        assert list(page[0]) == ['id']
+        rest = db.read_range('news', conn, 'dated', '20200101', '20200103', after_id=page[-1]['id'])
+        assert len(page) + len(rest) == 30
+
+
+def test_read_match(app):
+    with app.app_context():
+        conn = db.get_db()
+        db.save('news', conn, [
+            {'title': 'Floods in Mozambique', 'text': 'Rivers flooded the north', 'dated': '20200101'},
+            {'title': 'Elections', 'text': 'Flooding delayed the vote', 'dated': '20200101'},
+            {'title': 'Markets', 'text': 'Prices rose', 'dated': '20200101'},
+        ])
+
+        rows = db.read_match('news', conn, 'news_fts', 'flood', columns=['id', 'title'])
+        assert [r['title'] for r in rows] == ['Floods in Mozambique', 'Elections']
+        assert rows[0]['score'] >= rows[1]['score']
+        assert '<b>' in rows[1]['snippet']
+        assert len(db.read_match('news', conn, 'news_fts', 'flood', limit=1, offset=1)) == 1
+
+        conn.execute("UPDATE news SET text = 'Rain' WHERE title = 'Elections'")
+        conn.execute("DELETE FROM news WHERE title = 'Floods in Mozambique'")
+        assert db.read_match('news', conn, 'news_fts', 'flood') == []
+
+
+def test_read_range_unknown_column(app):
+    with app.app_context():
+        with pytest.raises(exceptions.DBError):
+            db.read_range('news', db.get_db(), 'dated', '20200101', columns=['id; DROP TABLE news'])
+
+
+def test_save(app):
+    with app.app_context():
+        conn = db.get_db()
+        rows = [{'title': str(i), 'text': 'text', 'dated': '20200101', 'digest': str(i)} for i in range(1200)]
+        rows.append({'title': 'no digest', 'text': 'text', 'dated': '20200101'})
+        rows.append({'title': 'bad', 'text': 'text', 'dated': '20200101', 'digest': 'bad', 'missing': 1})
+
+        result = db.save('news', conn, rows)
+        conn.commit()
+        assert result == db.SaveResult(inserted=1201, skipped=0, failed=1)
+
+        result = db.save('news', conn, rows[:10] + rows[-2:-1])
+        assert result == db.SaveResult(inserted=1, skipped=10, failed=0)
+        assert len(db.read_all('news', conn)) == 1202
+
+
+def test_save_rolls_back_failed_chunk(app):
+    with app.app_context():
+        conn = db.get_db()
+        rows = [{'title': str(i), 'text': 'text', 'dated': '20200101', 'digest': str(i % 5)} for i in range(10)]
+
+        result = db.save('news', conn, rows, on_conflict='abort', chunk_size=4)
+        assert result == db.SaveResult(inserted=5, skipped=0, failed=5)
+        assert len(db.read_all('news', conn)) == 5
+
+
+class TestConnectionManager:
+
+    def test_connection_reused(self, app):
+        with app.app_context():
+            conn = db.get_db()
+
+        with app.app_context():
+            assert db.get_db() is conn
+            assert conn.execute('PRAGMA journal_mode').fetchone()[0] == 'wal'
+
+    def test_readonly(self, app):
+        with app.app_context():
+            conn = db.get_db(readonly=True)
+            assert conn is not db.get_db()
+
+            with pytest.raises(sqlite3.OperationalError):
+                conn.execute("INSERT INTO news (title, text, dated) VALUES ('a', 'b', 'c')")
+
+    def test_uncommitted_changes_discarded(self, app):
+        with app.app_context():
+            conn = db.get_db()
+            conn.execute("INSERT INTO news (title, text, dated) VALUES ('a', 'b', 'c')")
+
+        with app.app_context():
+            assert db.read_all('news', db.get_db()) == []
+
+    def test_connection_per_context(self, app):
+        with app.app_context():
+            conn = db.get_db()
+            result = []
+
+            def read():
+                with app.app_context():
+                    result.append(db.get_db())
+
+            thread = threading.Thread(target=read)
+            thread.start()
+            thread.join()
+            assert result[0] is not conn
+
+    def test_pool_bounded(self, app):
+        app.config['DB_POOL_SIZE'] = 2
+        app.extensions.pop('sqlite').close_all()
+        barrier = threading.Barrier(10)
+
+        def read():
+            with app.app_context():
+                db.get_db()
+                db.get_db(readonly=True)
+                barrier.wait()
+
+        for _ in range(5):
+            threads = [threading.Thread(target=read) for _ in range(10)]
+
+            for t in threads:
+                t.start()
+
+            for t in threads:
+                t.join()
+
+        assert db.get_manager(app).open_connections == 4
@@ -0,0 +1,55 @@
+'''
+Tests near duplicate detection
+'''
+
+from news_api import db, dedupe, news
+
+
+STORY = (
+    'Heavy rains caused floods across northern Mozambique on Monday, '
+    'forcing thousands of people from their homes as rivers burst their banks. '
+    'Aid agencies said roads to the worst hit districts had been cut off '
+    'and warned that more rain was expected later in the week.'
+)
+
+REWRITE = STORY.replace('Monday', 'Tuesday') + ' Reporting by a correspondent.'
+
+OTHER = 'Markets rallied after the central bank cut interest rates by a quarter point.'
+
+
+def test_minhash():
+    assert dedupe.minhash('') is None
+    assert (dedupe.minhash(STORY) == dedupe.minhash(STORY.upper())).all()
+    assert dedupe.similarity(dedupe.minhash(STORY), dedupe.minhash(REWRITE)) > 0.7
+    assert dedupe.similarity(dedupe.minhash(STORY), dedupe.minhash(OTHER)) < 0.1
+
+
+def test_fingerprint_store(app):
+    with app.app_context():
+        conn = db.get_db()
+        store = dedupe.FingerprintStore(conn)
+        signatures = [dedupe.minhash(t) for t in (STORY, REWRITE, '', OTHER)]
+        assert store.filter(signatures) == [True, False, True, True]
+
+        db.save('news', conn, [{'title': 'Floods', 'text': STORY, 'dated': '20200101'}])
+        store.save([(1, signatures[0])])
+        assert store.filter(signatures[1:]) == [False, True, True]
+
+
+def test_save_news_skips_near_duplicates(app):
+    with app.app_context():
+        stories = [
+            {'title': 'Floods in Mozambique', 'text': STORY, 'dated': '20200101'},
+            {'title': 'Mozambique floods displace thousands', 'text': REWRITE, 'dated': '20200101'},
+        ]
+        result = news.save_news_to_db(stories[:1])
+        assert result.inserted == 1
+
+        result = news.save_news_to_db(stories[1:])
+        assert (result.inserted, result.skipped) == (0, 1)
+
+        conn = db.get_db()
+        conn.execute('DELETE FROM news_minhash')
+        conn.commit()
+        assert news.backfill_fingerprints() == 1
+        assert news.backfill_fingerprints() == 0
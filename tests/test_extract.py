@@ -0,0 +1,40 @@
+'''
+Tests html text extraction
+'''
+
+import os
+
+import pytest
+
+from news_api import exceptions, extract
+
+
+@pytest.fixture
+def story_html(data_path):
+    with open(os.path.join(data_path, 'html', 'reuters_story.html'), 'rb') as fd:
+        return fd.read()
+
+
+def test_engines_agree(story_html):
+    expected = extract.extract_paragraphs(story_html, 'utf-8', 'html.parser')
+    assert expected
+
+    for engine in extract.ENGINES:
+        assert extract.extract_paragraphs(story_html, 'utf-8', engine) == expected
+
+
+def test_encoding():
+    html = '<html><body><p>Amara Ndiayé</p></body></html>'.encode('latin-1')
+    assert extract.extract_paragraphs(html, 'latin-1') == 'Amara Ndiayé'
+    assert extract.charset_from_content_type('text/html; charset="ISO-8859-1"') == 'ISO-8859-1'
+    assert extract.charset_from_content_type('text/html') is None
+
+
+def test_detected_encoding():
+    html = '<html><head><meta charset="latin-1"></head><body><p>Ndiayé</p></body></html>'
+    assert extract.extract_paragraphs(html.encode('latin-1')) == 'Ndiayé'
+
+
+def test_unknown_engine():
+    with pytest.raises(exceptions.ScrapingError):
+        extract.extract_paragraphs(b'<p>text</p>', engine='regex')
@@ -0,0 +1,214 @@
+'''
+Test fetching against a local stub HTTP server
+'''
+
+import time
+import threading
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+
+import pytest
+
+from news_api import db, dedupe, exceptions, fetch, news
+
+
+FEED = '''<?xml version="1.0" encoding="UTF-8"?>
+<rss version="2.0">
+<channel>
+<title>Stub feed</title>
+<item><title>First story</title><link>{host}/first</link></item>
+<item><title>Broken story</title><link>{host}/broken</link></item>
+<item><title>Second story</title><link>{host}/second</link></item>
+</channel>
+</rss>
+'''
+
+PAGES = {
+    '/first': '<html><body><p>First paragraph</p><p>Second paragraph</p></body></html>',
+    '/second': '<html><body><div><p>Only paragraph</p></div></body></html>',
+}
+
+
+class _Server(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class _Handler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        self.server.requests.append(self.path)
+
+        if self.path == '/feed' and self.headers.get('If-None-Match') == '"v1"':
+            self._send(304, '', 'application/rss+xml')
+        elif self.path == '/feed':
+            self._send(200, FEED.format(host=self.server.url), 'application/rss+xml')
+        elif self.path == '/slow':
+            time.sleep(1)
+            self._send(200, '', 'text/html')
+        elif self.path in PAGES:
+            self._send(200, PAGES[self.path], 'text/html; charset=utf-8')
+        else:
+            self._send(500, 'error', 'text/plain')
+
+    def _send(self, status, body, content_type):
+        data = body.encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(data)))
+        self.send_header('ETag', '"v1"')
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def stub_server():
+    server = _Server(('127.0.0.1', 0), _Handler)
+    server.url = 'http://127.0.0.1:{}'.format(server.server_address[1])
+    server.requests = []
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def fetcher():
+    instance = fetch.Fetcher(max_workers=4, rate=None, timeout=(1, 0.5), retries=0)
+    yield instance
+    instance.close()
+
+
+def test_get_news_reuters(stub_server, fetcher):
+    result = news.get_news_reuters('{}/feed'.format(stub_server.url), fetcher)
+    assert [r['title'] for r in result] == ['First story', 'Second story']
+    assert result[0]['text'] == 'First paragraph\nSecond paragraph'
+
+
+def test_fetch_timeout(stub_server, fetcher):
+    with pytest.raises(exceptions.ScrapingError):
+        fetcher.get('{}/slow'.format(stub_server.url))
+
+
+def test_rate_limiter():
+    limiter = fetch.RateLimiter(rate=20, burst=2)
+    started = time.monotonic()
+
+    for _ in range(6):
+        limiter.acquire('example.com')
+
+    limiter.acquire('example.org')
+    assert time.monotonic() - started >= 0.19
+
+
+def test_get_news_reuters_skips_fetched(app, stub_server, fetcher):
+    feed_url = '{}/feed'.format(stub_server.url)
+
+    with app.app_context():
+        store = news.LinkStore(db.get_db())
+        first = news.get_news_reuters(feed_url, fetcher, store)
+        assert len(first) == 2
+
+        # The broken story is retried, so the feed validators are not saved
+        stub_server.requests.clear()
+        assert news.get_news_reuters(feed_url, fetcher, store) == []
+        assert stub_server.requests == ['/feed', '/broken']
+
+        PAGES['/broken'] = PAGES['/first']  # Republished under another url
+
+        try:
+            assert news.get_news_reuters(feed_url, fetcher, store) == []
+        finally:
+            del PAGES['/broken']
+
+        stub_server.requests.clear()
+        assert news.get_news_reuters(feed_url, fetcher, store) == []
+        assert stub_server.requests == ['/feed']
+
+
+def test_get_news_reuters_uncommitted(app, stub_server, fetcher):
+    feed_url = '{}/feed'.format(stub_server.url)
+
+    with app.app_context():
+        assert len(news.get_news_reuters(feed_url, fetcher, news.LinkStore(db.get_db()))) == 2
+
+    # Stories were not saved, so they are fetched again
+    with app.app_context():
+        assert len(news.get_news_reuters(feed_url, fetcher, news.LinkStore(db.get_db()))) == 2
+
+
+def test_ingest_news_reuters(app, stub_server, fetcher):
+    feed_url = '{}/feed'.format(stub_server.url)
+
+    class Seen:
+        titles = set()
+
+        def unseen(self, stories):
+            return [s for s in stories if s['title'] not in self.titles]
+
+        def add(self, stories):
+            self.titles.update(s['title'] for s in stories)
+
+    with app.app_context():
+        store = news.LinkStore(db.get_db())
+        seen = Seen()
+        result = news.ingest_news_reuters(feed_url, fetcher, store, seen)
+        assert result == db.SaveResult(inserted=2, skipped=1, failed=0)
+        assert seen.titles == {'First story', 'Second story'}
+        assert sorted(r['title'] for r in db.read_all('news', db.get_db())) == ['First story', 'Second story']
+
+        stub_server.requests.clear()
+        assert news.ingest_news_reuters(feed_url, fetcher, store, seen).inserted == 0
+        assert stub_server.requests == ['/feed', '/broken']
+
+
+def test_ingest_news_reuters_dedupes_once(app, stub_server, fetcher, monkeypatch):
+    feed_url = '{}/feed'.format(stub_server.url)
+    texts = []
+    minhash = dedupe.minhash
+
+    def counted(text):
+        texts.append(text)
+        return minhash(text)
+
+    monkeypatch.setattr(dedupe, 'minhash', counted)
+
+    with app.app_context():
+        assert news.ingest_news_reuters(feed_url, fetcher).inserted == 2
+
+    # Selected while finding locations, and not again when saved
+    assert len(texts) == 2
+
+
+def test_ingest_news_reuters_connections(app, stub_server, fetcher):
+    feed_url = '{}/feed'.format(stub_server.url)
+
+    with app.app_context():
+        opened = []
+
+        # Stages take pooled connections in threads of their own, so how
+        # many are open depends on whether they overlap, but never grows
+        for _ in range(12):
+            news.ingest_news_reuters(feed_url, fetcher)
+            opened.append(db.get_manager().open_connections)
+
+        assert max(opened) <= app.config.get('DB_POOL_SIZE', 8)
+
+
+def test_ingest_news_reuters_failed_save(app, stub_server, fetcher, monkeypatch):
+    feed_url = '{}/feed'.format(stub_server.url)
+
+    def fail(*args, **kwargs):
+        raise exceptions.NewsApiError('save failed')
+
+    monkeypatch.setattr(news, 'save_news_to_db', fail)
+
+    with app.app_context():
+        with pytest.raises(exceptions.NewsApiError):
+            news.ingest_news_reuters(feed_url, fetcher, news.LinkStore(db.get_db()))
+
+        # Links of stories that were not saved are fetched again
+        assert db.read_all('fetched_links', db.get_db()) == []
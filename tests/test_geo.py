@@ -0,0 +1,56 @@
+'''
+Tests geographic lookups
+'''
+
+import os
+
+import pytest
+
+from news_api import geo
+
+
+@pytest.fixture
+def geo_file(tmp_path):
+    path = os.path.join(str(tmp_path), 'geodata.csv')
+
+    with open(path, 'w') as fd:
+        fd.write('nationalities,countries\n')
+        fd.write('Kenyan,Kenya\n')
+        fd.write('South African,South Africa\n')
+        fd.write('Congolese,Democratic Republic of the Congo\n')
+
+    return path
+
+
+class TestGazetteer:
+
+    def test_resolve(self, geo_file):
+        gazetteer = geo.Gazetteer.from_csv(geo_file)
+        assert gazetteer.resolve('Kenyan') == 'kenya'
+        assert gazetteer.resolve('KENYA') == 'kenya'
+        assert gazetteer.resolve('Nairobi') is None
+
+    def test_locate(self, geo_file):
+        gazetteer = geo.Gazetteer.from_csv(geo_file)
+        names = ['South African', 'Kenya', 'the Democratic Republic of the Congo', 'Lagos']
+        assert sorted(gazetteer.locate(names)) \
+            == ['democratic republic of the congo', 'kenya', 'south africa']
+
+    def test_match_phrases(self, geo_file):
+        gazetteer = geo.Gazetteer.from_csv(geo_file)
+        text = 'Talks between Kenyan and South African officials'
+        assert gazetteer.match_phrases(text) == {'kenya', 'south africa'}
+
+    def test_reloaded_when_modified(self, geo_file):
+        first = geo.get_gazetteer(geo_file)
+        assert geo.get_gazetteer(geo_file) is first
+
+        with open(geo_file, 'a') as fd:
+            fd.write('Nigerian,Nigeria\n')
+
+        stat = os.stat(geo_file)
+        os.utime(geo_file, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1))
+
+        second = geo.get_gazetteer(geo_file)
+        assert second is not first
+        assert second.resolve('nigerian') == 'nigeria'
@@ -0,0 +1,90 @@
+'''
+Tests metrics collection and rendering
+'''
+
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+
+from news_api import metrics
+
+
+def test_render():
+    registry = metrics.Registry()
+    requests = registry.counter('requests_total', 'Requests', ['path'])
+    latency = registry.histogram('latency_seconds', 'Latency', buckets=[0.1, 1])
+
+    requests.inc(path='/a')
+    requests.inc(2, path='/a"b')
+    latency.observe(0.05)
+    latency.observe(0.5)
+    latency.observe(5)
+
+    text = registry.render()
+    assert '# TYPE requests_total counter' in text
+    assert 'requests_total{path="/a"} 1' in text
+    assert 'requests_total{path="/a\\"b"} 2' in text
+    assert 'latency_seconds_bucket{le="0.1"} 1' in text
+    assert 'latency_seconds_bucket{le="1.0"} 2' in text
+    assert 'latency_seconds_bucket{le="+Inf"} 3' in text
+    assert 'latency_seconds_sum 5.55' in text
+    assert 'latency_seconds_count 3' in text
+
+
+def test_processes_aggregated(tmp_path):
+    registry = metrics.Registry()
+    registry.configure(str(tmp_path), interval=0)
+    requests = registry.counter('requests_total', 'Requests', ['path'])
+    requests.inc(path='/a')
+
+    assert os.path.exists(os.path.join(str(tmp_path), 'metrics-{}.json'.format(os.getpid())))
+
+    with open(os.path.join(str(tmp_path), 'metrics-1.json'), 'w') as fd:
+        json.dump({'requests_total': [[['/a'], 4], [['/b'], 1]]}, fd)
+
+    text = registry.render()
+    assert 'requests_total{path="/a"} 5' in text
+    assert 'requests_total{path="/b"} 1' in text
+
+
+def test_exited_processes_pruned(tmp_path):
+    registry = metrics.Registry()
+    registry.configure(str(tmp_path), interval=0)
+    requests = registry.counter('requests_total', 'Requests', ['path'])
+    requests.inc(path='/a')
+
+    exited = subprocess.run([sys.executable, '-c', 'import os; print(os.getpid())'], stdout=subprocess.PIPE)
+    path = os.path.join(str(tmp_path), 'metrics-{}.json'.format(int(exited.stdout)))
+
+    with open(path, 'w') as fd:
+        json.dump({'requests_total': [[['/a'], 4]]}, fd)
+
+    assert 'requests_total{path="/a"} 1' in registry.render()
+    assert not os.path.exists(path)
+    assert os.path.exists(os.path.join(str(tmp_path), 'metrics-{}.json'.format(os.getpid())))
+
+
+def test_metrics_endpoint(client):
+    client.get('/latest')
+    resp = client.get('/metrics')
+    assert resp.status_code == 200
+    assert resp.content_type.startswith('text/plain')
+
+    text = resp.get_data(as_text=True)
+    assert 'news_api_http_request_seconds_count{method="GET",endpoint="dailynews",status="200"}' in text
+    assert 'news_api_db_query_seconds_count{operation="read_max",table="news"}' in text
+
+
+def test_failed_request_observed(app):
+    @app.route('/fail')
+    def fail():
+        raise RuntimeError('fail')
+
+    with pytest.raises(RuntimeError):
+        app.test_client().get('/fail')
+
+    counts = metrics.HTTP_REQUEST_SECONDS.snapshot()[('GET', 'fail', '500')]
+    assert sum(counts[:-1]) == 1
@@ -2,6 +2,7 @@
 Test api and end points
 '''
 
+import gzip
 import json
 import datetime as dt
 from news_api import __version__, create_app, constants
@@ -29,3 +30,84 @@ class TestEndpoints:
         data = json.loads(resp.get_data(as_text=True))
         assert data
         assert isinstance(data, list)
+
+    def test_list_news(self, client, news_data):
+        today = dt.datetime.now().date().strftime(constants.DATE_FMT)
+        news_data = [{'title': t, 'text': d, 'dated': today} for t, d in news_data.items()]
+        client.post('/news', data={'news_data': json.dumps(news_data)})
+
+        resp = client.get('/news', query_string={'from': today, 'to': today, 'limit': 2})
+        page = json.loads(resp.get_data(as_text=True))
+        assert len(page['news']) == min(2, len(news_data))
+
+        resp = client.get('/news', query_string={'from': today, 'after_id': page['news'][0]['id']})
+        rest = json.loads(resp.get_data(as_text=True))
+        assert len(rest['news']) == len(news_data) - 1
+        assert rest['next_after_id'] is None
+
+    def test_list_news_bad_date(self, client):
+        resp = client.get('/news', query_string={'from': 'yesterday'})
+        assert resp.status_code == 400
+
+    def test_latest_etag(self, client, news_data):
+        today = dt.datetime.now().date().strftime(constants.DATE_FMT)
+        news_data = [{'title': t, 'text': d, 'dated': today} for t, d in news_data.items()]
+        client.post('/news', data={'news_data': json.dumps(news_data[:1])})
+
+        resp = client.get('/latest')
+        etag = resp.headers['ETag']
+        assert resp.status_code == 200
+        assert client.get('/latest').get_data() == resp.get_data()
+
+        resp = client.get('/latest', headers={'If-None-Match': etag})
+        assert resp.status_code == 304
+
+        client.post('/news', data={'news_data': json.dumps(news_data[1:])})
+        resp = client.get('/latest', headers={'If-None-Match': etag})
+        assert resp.status_code == 200
+        assert len(json.loads(resp.get_data(as_text=True))) == len(news_data)
+
+    def test_related_news_without_model(self, client):
+        assert client.get('/news/1/related').status_code == 404
+
+    def test_search(self, client, news_data):
+        today = dt.datetime.now().date().strftime(constants.DATE_FMT)
+        news_data = [{'title': t, 'text': d, 'dated': today} for t, d in news_data.items()]
+        client.post('/news', data={'news_data': json.dumps(news_data)})
+
+        resp = client.get('/search', query_string={'q': 'Iran "', 'limit': 1})
+        page = json.loads(resp.get_data(as_text=True))
+        assert resp.status_code == 200
+        assert len(page['news']) == 1
+        assert page['next_offset'] == 1
+
+        resp = client.get('/search', query_string={'q': 'xyzzy'})
+        assert json.loads(resp.get_data(as_text=True)) == {'news': [], 'next_offset': None}
+
+    def test_post_ndjson(self, client, news_data):
+        today = dt.datetime.now().date().strftime(constants.DATE_FMT)
+        lines = [json.dumps({'title': t, 'text': d, 'dated': today}) for t, d in news_data.items()]
+        body = gzip.compress('\n'.join(lines + lines[:1]).encode('utf-8'))
+
+        resp = client.post(
+            '/news',
+            data=body,
+            content_type='application/x-ndjson',
+            headers={'Content-Encoding': 'gzip'}
+        )
+        assert json.loads(resp.get_data(as_text=True)) == {'inserted': len(lines), 'skipped': 1, 'failed': 0}
+
+        resp = client.get('/news', query_string={'from': today})
+        assert len(json.loads(resp.get_data(as_text=True))['news']) == len(lines)
+
+    def test_post_ndjson_invalid(self, client):
+        resp = client.post('/news', data='{"title": "a"}\n', content_type='application/x-ndjson')
+        assert resp.status_code == 400
+
+        resp = client.post(
+            '/news',
+            data=b'not gzip',
+            content_type='application/x-ndjson',
+            headers={'Content-Encoding': 'gzip'}
+        )
+        assert resp.status_code == 400
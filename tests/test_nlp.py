@@ -3,7 +3,9 @@ Tests nlp functions
 '''
 
 import pytest
+import numpy as np
 import pandas as pd
+from scipy.sparse import csr_matrix
 
 from news_api import nlp
 
@@ -23,6 +25,17 @@ class TestLsa:
         matrix = lsa.get_occurrence_matrix()
         assert isinstance(matrix, pd.DataFrame)
 
+    def test_get_sparse_occurence_matrix(self, news_story):
+        sentences = nlp.make_sentences(news_story['text'])
+        lsa = nlp.LSA(sentences)
+        matrix = lsa.get_occurrence_matrix(sparse=True)
+        frame = lsa.get_occurrence_matrix()
+
+        assert isinstance(matrix, csr_matrix)
+        assert matrix.shape == (len(frame.index), len(sentences))
+        assert frame.index.is_unique
+        assert (matrix.toarray() == frame.to_numpy()).all()
+
     def test_get_similarity(self, news_story):
         headline = news_story['title']
         story = news_story['text']
@@ -33,6 +46,86 @@ class TestLsa:
         similarity_scores = lsa.get_similarity(headline, matrix)
         assert isinstance(similarity_scores, pd.Series)
 
+    def test_get_similarity_batch(self, news_story):
+        headline = news_story['title']
+        sentences = nlp.make_sentences(news_story['text'])
+        lsa = nlp.LSA(sentences).fit()
+
+        scores = lsa.get_similarity([headline, sentences[0]])
+        assert isinstance(scores, pd.DataFrame)
+        assert scores.shape == (2, len(sentences))
+        assert (scores.loc[headline] == lsa.get_similarity(headline)).all()
+        assert scores.abs().max().max() <= 1 + 1e-9
+
+    def test_doc_ids_length(self):
+        with pytest.raises(ValueError):
+            nlp.LSA(['Floods in Mozambique', 'Rates cut'], doc_ids=[1])
+
+    def test_transform(self, news_story):
+        sentences = nlp.make_sentences(news_story['text'])
+        lsa = nlp.LSA(sentences, svd_rank=2).fit()
+        assert lsa.transform(sentences).shape == (len(sentences), 2)
+
+    def test_fold_in(self, news_data):
+        first, second = list(news_data.values())[:2]
+        lsa = nlp.LSA(nlp.make_sentences(first), svd_rank=2).fit()
+        known = len(lsa.doc_ids)
+
+        new = nlp.make_sentences(second)
+        error = lsa.fold_in(new, doc_ids=['new'] * len(new))
+        assert 0 <= error <= 1
+        assert lsa.doc_ids[known:] == ['new'] * len(new)
+        assert lsa.get_similarity(new[0]).shape == (known + len(new),)
+
+        lsa.fit()
+        assert lsa.fold_in_error == 0
+        assert not lsa.needs_refit
+
+    def test_fold_in_doc_ids_length(self, news_story):
+        lsa = nlp.LSA(nlp.make_sentences(news_story['text']), svd_rank=2).fit()
+        doc_ids, vectors = list(lsa.doc_ids), lsa.doc_vectors.shape
+
+        with pytest.raises(ValueError):
+            lsa.fold_in(['Floods in Mozambique', 'Rates cut'], doc_ids=[1000])
+
+        assert lsa.doc_ids == doc_ids and lsa.doc_vectors.shape == vectors
+
+    def test_save_load(self, news_story, tmp_path):
+        sentences = nlp.make_sentences(news_story['text'])
+        lsa = nlp.LSA(sentences, svd_rank=2).fit()
+
+        for _ in range(3):
+            version = nlp.save_model(lsa, str(tmp_path), keep=2)
+
+        assert nlp.current_model_version(str(tmp_path)) == version
+        assert len([p for p in tmp_path.iterdir() if p.is_dir()]) == 2
+
+        loaded = nlp.load_model(str(tmp_path))
+        assert loaded.doc_ids == lsa.doc_ids
+        assert (loaded.get_similarity(news_story['title']) == lsa.get_similarity(news_story['title'])).all()
+        assert loaded.get_related_keywords(news_story['title']) == lsa.get_related_keywords(news_story['title'])
+
+    def test_save_fold_in(self, news_data, tmp_path):
+        first, second = list(news_data.values())[:2]
+        nlp.save_model(nlp.LSA(nlp.make_sentences(first), svd_rank=2).fit(), str(tmp_path))
+
+        lsa = nlp.load_model(str(tmp_path))
+        new = nlp.make_sentences(second)[:1]  # Few enough not to be merged with the fitted documents
+        lsa.fold_in(new, doc_ids=list(range(1000, 1000 + len(new))))
+        version = nlp.save_model(lsa, str(tmp_path))
+
+        # The fitted documents are linked from the previous version, not written again
+        segments = sorted(p for p in (tmp_path / version).iterdir() if p.is_dir())
+        assert len(segments) == 2
+        assert (segments[0] / 'documents.json').stat().st_nlink == 2
+
+        loaded = nlp.load_model(str(tmp_path))
+        assert isinstance(loaded.doc_vectors, np.memmap) and isinstance(loaded._U, np.memmap)
+        assert loaded.doc_ids == lsa.doc_ids
+        assert loaded.documents[-len(new):] == new
+        assert (loaded.doc_vectors == lsa.doc_vectors).all()
+        assert loaded.fold_in_error == lsa.fold_in_error
+
     def test_get_related_keywords(self, news_story):
         headline = news_story['title']
         story = news_story['text']
@@ -42,3 +135,30 @@ class TestLsa:
         matrix = lsa.get_occurrence_matrix()
         related_keywords = lsa.get_related_keywords(headline, matrix)
         assert isinstance(related_keywords, list)
+
+
+class TestPipelineRegistry:
+
+    def test_pipeline_loaded_once(self):
+        registry = nlp.PipelineRegistry()
+        first = registry.get('ner')
+        second = registry.get('ner')
+        assert first is second
+        assert registry.stats['ner']['loads'] == 1
+        assert registry.stats['ner']['hits'] == 1
+
+    def test_variant_components(self):
+        registry = nlp.PipelineRegistry()
+        assert registry.get('ner').pipe_names == ['ner']
+        assert registry.get('sentencizer').pipe_names == ['sentencizer']
+
+    def test_warm_up(self):
+        registry = nlp.PipelineRegistry()
+        registry.warm_up(['tagger'])
+        assert list(registry.stats) == ['tagger']
+
+
+def test_get_entities_batch(news_data):
+    stories = list(news_data.values())[:3]
+    batch = nlp.get_entities_batch(stories, batch_size=2, n_process=1)
+    assert batch == [nlp.get_entities(s) for s in stories]
@@ -0,0 +1,55 @@
+'''
+Tests staged processing
+'''
+
+import threading
+
+import pytest
+
+from news_api.pipeline import Pipeline, Stage
+
+
+def test_pipeline():
+    pipeline = Pipeline([
+        Stage('double', lambda x: x * 2, workers=4),
+        Stage('odd', lambda x: x if x % 4 else None, workers=2),
+        Stage('sum', lambda batch: [sum(batch)], batch_size=5),
+    ], queue_size=2)
+
+    assert sum(pipeline.run(range(100))) == sum(x * 2 for x in range(100) if x % 2)
+
+    stats = pipeline.stats
+    assert stats['double'] == {'received': 100, 'passed': 100, 'seconds': stats['double']['seconds']}
+    assert stats['odd']['passed'] == 50
+    assert stats['sum']['received'] == 50
+
+
+def test_pipeline_bounded():
+    in_flight = []
+    lock = threading.Lock()
+    fed = [0]
+
+    def items():
+        for i in range(1000):
+            with lock:
+                fed[0] += 1
+            yield i
+
+    results = Pipeline([Stage('pass', lambda x: x)], queue_size=4).run(items())
+    next(results)
+
+    with lock:
+        in_flight.append(fed[0])
+
+    results.close()
+    assert in_flight[0] < 20
+
+
+def test_pipeline_error():
+    def fail(x):
+        if x == 7:
+            raise ValueError('bad item')
+        return x
+
+    with pytest.raises(ValueError):
+        list(Pipeline([Stage('fail', fail, workers=2)]).run(range(100)))
@@ -0,0 +1,97 @@
+'''
+Tests profiling of requests and tasks
+'''
+
+import os
+import time
+import pstats
+
+import pytest
+
+from news_api import create_app, profiling
+
+
+def profiles(directory):
+    return sorted(os.listdir(directory)) if os.path.isdir(directory) else []
+
+
+@pytest.fixture
+def profiled_app(tmp_path):
+    def make(**config):
+        return create_app(test_config={
+            'TESTING': True,
+            'DATABASE': str(tmp_path / 'news.db'),
+            'METRICS_DIR': None,
+            'PROFILE_DIR': str(tmp_path / 'profiles'),
+            **config
+        })
+
+    return make
+
+
+def test_profile_flag(profiled_app, tmp_path):
+    app = profiled_app(PROFILE=True)
+    app.test_client().get('/metrics')
+
+    files = profiles(str(tmp_path / 'profiles'))
+    assert len(files) == 1
+    assert files[0].startswith('request-metrics-') and files[0].endswith('.prof')
+    assert pstats.Stats(str(tmp_path / 'profiles' / files[0])).total_calls > 0
+
+
+def test_profiles_back_to_back(tmp_path):
+    profiler = profiling.Profiler(str(tmp_path), enabled=True)
+
+    for _ in range(2):
+        with profiler.profile('task', 'news_api.tasks.quick'):
+            pass
+
+    files = profiles(str(tmp_path))
+    assert len(files) == 2
+    assert all(f.startswith('task-news_api.tasks.quick-') for f in files)
+
+
+def test_profile_header(profiled_app, tmp_path):
+    app = profiled_app(PROFILE_ALLOWED=['10.0.0.1'])
+    client = app.test_client()
+
+    client.get('/metrics', headers={'X-Profile': '1'})
+    assert profiles(str(tmp_path / 'profiles')) == []
+
+    client.get('/metrics', headers={'X-Profile': '1'}, environ_base={'REMOTE_ADDR': '10.0.0.1'})
+    assert len(profiles(str(tmp_path / 'profiles'))) == 1
+
+
+def test_sampler(tmp_path):
+    profiler = profiling.Profiler(str(tmp_path), mode='sample', enabled=True, interval=0.001)
+
+    with profiler.profile('task', 'news_api.tasks.busy'):
+        end = time.perf_counter() + 0.1
+
+        while time.perf_counter() < end:
+            pass
+
+    files = profiles(str(tmp_path))
+    assert len(files) == 1 and files[0].endswith('.folded')
+
+    with open(str(tmp_path / files[0])) as fd:
+        lines = fd.read().splitlines()
+
+    assert lines
+    assert all(line.rsplit(' ', 1)[1].isdigit() for line in lines)
+    assert any('test_sampler' in line for line in lines)
+
+
+def test_rotate(tmp_path):
+    profiler = profiling.Profiler(str(tmp_path), max_bytes=250)
+
+    for i in range(5):
+        path = str(tmp_path / 'request-{}.prof'.format(i))
+
+        with open(path, 'w') as fd:
+            fd.write('x' * 100)
+
+        os.utime(path, (i, i))
+
+    profiler.rotate()
+    assert profiles(str(tmp_path)) == ['request-3.prof', 'request-4.prof']
@@ -0,0 +1,58 @@
+'''
+Tests the related news index
+'''
+
+import numpy as np
+import pytest
+
+from news_api.related import NeighbourIndex
+
+
+@pytest.fixture
+def vectors():
+    rng = np.random.default_rng(1)
+    return rng.standard_normal((500, 16))
+
+
+class TestNeighbourIndex:
+
+    def test_related(self, vectors):
+        index = NeighbourIndex(vectors, range(100, 600), block_size=64)
+        unit = vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+        scores = unit @ unit[0]
+        scores[0] = -np.inf
+        expected = [100 + i for i in np.argsort(-scores)[:10]]
+
+        results = index.related(100, 10)
+        assert [r[0] for r in results] == expected
+        assert np.allclose([r[1] for r in results], np.sort(scores)[::-1][:10], atol=1e-5)
+
+    def test_blocks_match_single_block(self, vectors):
+        blocked = NeighbourIndex(vectors, range(500), block_size=7)
+        single = NeighbourIndex(vectors, range(500), block_size=1000)
+        assert [r[0] for r in blocked.query(vectors[3], 5)] == [r[0] for r in single.query(vectors[3], 5)]
+
+    def test_lsh(self, vectors):
+        index = NeighbourIndex(vectors, range(500), lsh_bits=4, lsh_tables=8)
+        exact = NeighbourIndex(vectors, range(500))
+
+        results = index.related(0, 5)
+        assert len(results) == 5
+        assert 0 not in [r[0] for r in results]
+        assert len(set(r[0] for r in results) & set(r[0] for r in exact.related(0, 5))) >= 3
+
+    def test_extended(self, vectors):
+        full = NeighbourIndex(vectors, range(500), lsh_bits=4, lsh_tables=8)
+        base = NeighbourIndex(vectors[:400], range(400), lsh_bits=4, lsh_tables=8)
+        extended = base.extended(vectors[400:], range(400, 500))
+
+        assert len(base) == 400 and len(extended) == 500
+        assert 450 in extended and 450 not in base
+
+        for doc_id in (0, 450):
+            assert extended.related(doc_id, 5) == full.related(doc_id, 5)
+
+    def test_zero_vector(self, vectors):
+        index = NeighbourIndex(vectors, range(500))
+        assert index.query(np.zeros(16)) == []
+        assert 1 in index and 500 not in index
@@ -2,7 +2,7 @@
 Test if data can be scraped from news sources
 '''
 
-from news_api import news
+from news_api import db, news, sources
 
 
 def test_reuters():
@@ -16,3 +16,21 @@ def test_reuters():
 
         for _, v in entry.items():
             assert isinstance(v, str)
+
+
+def test_source_registry():
+    calls = []
+
+    def ingester(feed_url, fetcher, store, seen):
+        calls.append((feed_url, fetcher, store, seen))
+        return db.SaveResult(1, 0, 0)
+
+    source = sources.register(sources.Source('stub', 'http://localhost/feed', ingester, rate_limit=None))
+
+    try:
+        assert sources.get_source('stub') is source
+        assert sources.ingest('stub') == db.SaveResult(1, 0, 0)
+        assert calls[0][0] == 'http://localhost/feed'
+        assert calls[0][1] is sources.get_fetcher('stub')
+    finally:
+        del sources.SOURCES['stub']
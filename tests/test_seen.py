@@ -0,0 +1,79 @@
+'''
+Tests the redis record of ingested stories
+'''
+
+import fakeredis
+import pytest
+
+from news_api import seen
+
+
+def story(title):
+    return {'title': title, 'link': 'https://example.com/' + title.lower().replace(' ', '-')}
+
+
+@pytest.fixture
+def server():
+    return fakeredis.FakeServer()
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(seen.time, 'time', lambda: now[0])
+    return now
+
+
+def make_seen(server, ttl=100):
+    return seen.SeenStories(fakeredis.FakeStrictRedis(server=server), key='test:seen', ttl=ttl)
+
+
+def test_add_unseen(server):
+    stories = make_seen(server)
+    floods, rates = story('Floods in Mozambique'), story('Rates cut')
+    assert stories.unseen([floods, rates]) == [floods, rates]
+
+    stories.add([floods])
+    assert stories.unseen([floods, rates]) == [rates]
+    assert make_seen(server).unseen([story('FLOODS  in Mozambique')]) == []
+
+
+def test_unseen_batch(server):
+    stories = make_seen(server)
+    batch = [story('Story {}'.format(i)) for i in range(50)]
+    stories.add(batch[::2])
+
+    assert stories.unseen(batch + batch[1:4]) == batch[1::2]
+    assert stories.unseen([]) == []
+
+
+def test_expiry(server, clock):
+    stories = make_seen(server, ttl=100)
+    old, recent = story('Old story'), story('Recent story')
+    client = fakeredis.FakeStrictRedis(server=server)
+
+    stories.add([old])
+    clock[0] += 60
+    stories.add([recent])
+    clock[0] += 50
+    assert stories.unseen([old, recent]) == [old]
+    assert client.zcard('test:seen') == 2
+
+    stories.add([])
+    assert client.zcard('test:seen') == 1
+    assert client.ttl('test:seen') > 0
+
+
+def test_redis_unavailable(server, caplog):
+    stories = make_seen(server)
+    floods = story('Floods in Mozambique')
+    stories.add([floods])
+    server.connected = False
+
+    assert stories.unseen([floods, floods]) == [floods]
+    stories.add([floods])
+    assert 'Seen stories lookup failed' in caplog.text
+    assert 'Recording seen stories failed' in caplog.text
+
+    server.connected = True
+    assert stories.unseen([floods]) == []